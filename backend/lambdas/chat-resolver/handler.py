@@ -7,6 +7,15 @@ from typing import Dict, Any, List, Optional
 import boto3
 from botocore.exceptions import ClientError
 
+# Admission control comes from the common layer; without it requests are not limited
+try:
+    from tenant_admission import TenantAdmission
+except ImportError:
+    TenantAdmission = None
+
+# Shared with rag-query through the common layer
+from response_encoding import parse_fields, project_response
+
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
 lambda_client = boto3.client('lambda')
@@ -22,6 +31,19 @@ KENDRA_INDEX_ID = os.environ['KENDRA_INDEX_ID']
 conversations_table = dynamodb.Table(CONVERSATIONS_TABLE)
 messages_table = dynamodb.Table(MESSAGES_TABLE)
 
+# Per-tenant token buckets (None when ADMISSION_TABLE is unset)
+admission = None
+if TenantAdmission is not None and os.environ.get('ADMISSION_TABLE'):
+    admission = TenantAdmission.from_environment('chat', boto3.client('dynamodb'))
+
+class RagQueryUnavailable(Exception):
+    """rag-query shed the request (429 or 503); the client should retry after retry_after seconds"""
+    
+    def __init__(self, status_code: int, retry_after: str):
+        super().__init__(f"RAG query returned {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
 class ChatResolver:
     def __init__(self):
         self.model_id = "anthropic.claude-3-haiku-20240307-v1:0"
@@ -97,8 +119,13 @@ class ChatResolver:
         try:
             payload = {
                 'question': question,
-                'tenant_id': tenant_id
+                'tenant_id': tenant_id,
+                # Only the answer and citations are used here
+                'fields': ['answer', 'citations']
             }
+            if admission:
+                # Already charged to the tenant's 'chat' bucket; rag-query does not charge it again
+                payload['admitted_by'] = 'chat'
             
             response = lambda_client.invoke(
                 FunctionName=RAG_FUNCTION_ARN,
@@ -107,6 +134,11 @@ class ChatResolver:
             )
             
             result = json.loads(response['Payload'].read())
+            # Overload is passed on to the client instead of answering without document context
+            if result.get('statusCode') in (429, 503):
+                retry_after = result.get('headers', {}).get('Retry-After') or \
+                    str(json.loads(result.get('body') or '{}').get('retry_after_seconds', 1))
+                raise RagQueryUnavailable(result['statusCode'], retry_after)
             if 'body' in result:
                 return json.loads(result['body'])
             return result
@@ -217,6 +249,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         message = body.get('message')
         stream = body.get('stream', False)
+        # Mobile clients ask for the content alone rather than every cited excerpt
+        fields = parse_fields(body.get('fields'))
         
         # Validate inputs
         if not all([conversation_id, tenant_id, message]):
@@ -228,9 +262,46 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 })
             }
         
+        # Reject before spending Kendra or Bedrock quota on an over-limit tenant
+        if admission:
+            decision = admission.admit(tenant_id)
+            if not decision.allowed:
+                return {
+                    'statusCode': 429,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': str(decision.retry_after_seconds)
+                    },
+                    'body': json.dumps({
+                        'error': 'TooManyRequests',
+                        'message': 'Rate limit exceeded for this tenant',
+                        'retry_after_seconds': decision.retry_after_seconds
+                    })
+                }
+        
         # Initialize chat resolver
         resolver = ChatResolver()
         
+        # Invoke RAG query for relevant information, before anything is saved so a
+        # shed request can be retried without duplicating the user's message
+        try:
+            rag_response = resolver.invoke_rag_query(message, tenant_id)
+        except RagQueryUnavailable as e:
+            return {
+                'statusCode': e.status_code,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Retry-After': e.retry_after
+                },
+                'body': json.dumps({
+                    'error': 'TooManyRequests' if e.status_code == 429 else 'ServiceUnavailable',
+                    'message': 'Document search is busy; retry shortly',
+                    'retry_after_seconds': int(float(e.retry_after))
+                })
+            }
+        
         # Save user message
         user_message_id = resolver.save_message(
             conversation_id=conversation_id,
@@ -242,9 +313,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # Get conversation context
         context_messages = resolver.get_conversation_context(conversation_id)
         
-        # Invoke RAG query for relevant information
-        rag_response = resolver.invoke_rag_query(message, tenant_id)
-        
         # Build prompt with context
         prompt = resolver.build_prompt_with_context(
             question=message,
@@ -270,20 +338,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         resolver.update_conversation(tenant_id, conversation_id)
         
         # Return response
+        response_body = json.dumps(project_response({
+            'conversation_id': conversation_id,
+            'message_id': assistant_message_id,
+            'content': response['content'],
+            'citations': rag_response.get('citations', []),
+            'generation_time_ms': generation_time,
+            'usage': response.get('usage', {})
+        }, fields))
+        print(f"Response: {len(response_body.encode('utf-8'))} bytes")
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'conversation_id': conversation_id,
-                'message_id': assistant_message_id,
-                'content': response['content'],
-                'citations': rag_response.get('citations', []),
-                'generation_time_ms': generation_time,
-                'usage': response.get('usage', {})
-            })
+            'body': response_body
         }
         
     except Exception as e:
@@ -166,6 +166,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'statusCode': 200,
         'tenantId': tenant_id,
         'documentId': document_id,
+        'bucket': event.get('bucket'),
+        'key': event.get('key'),
         'chunks': [chunk['text'] for chunk in result['chunks']],
         'chunkMetadata': result['chunks'],
         'totalChunks': result['statistics']['total_chunks'],
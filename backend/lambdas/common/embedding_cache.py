@@ -0,0 +1,133 @@
+"""
+Two-tier cache for text embeddings shared by the query-side Lambdas
+"""
+import hashlib
+import logging
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+# Metrics are optional so the cache also works where Powertools is not installed
+try:
+    from aws_lambda_powertools.metrics import MetricUnit
+    from powertools_layer import metrics
+except ImportError:
+    MetricUnit = None
+    metrics = None
+
+logger = logging.getLogger()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Case-fold and collapse whitespace so trivially different inputs share an entry"""
+    return _WHITESPACE.sub(' ', text.lower()).strip()
+
+
+def pack_embedding(embedding: List[float]) -> bytes:
+    """Encode as little-endian float16 (2 bytes per dimension)"""
+    return struct.pack(f'<{len(embedding)}e', *embedding)
+
+
+def unpack_embedding(payload: bytes) -> List[float]:
+    return list(struct.unpack(f'<{len(payload) // 2}e', payload))
+
+
+class EmbeddingCache:
+    """
+    Cache keyed on model id, dimensions and a hash of the normalised text.
+
+    Entries are held as float16 bytes in a bounded in-process LRU and,
+    when a table name is given, in a DynamoDB table with a TTL attribute
+    so every container benefits from embeddings computed elsewhere.
+    """
+
+    def __init__(self, max_entries: int = 2048, table_name: Optional[str] = None,
+                 dynamodb_client: Any = None, ttl_seconds: int = 7 * 86400):
+        self.max_entries = max_entries
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.ttl_seconds = ttl_seconds
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_id: str, dimensions: int, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+        return f"{model_id}#{dimensions}#{digest}"
+
+    def get(self, model_id: str, dimensions: int, text: str) -> Optional[List[float]]:
+        key = self.key(model_id, dimensions, text)
+
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        if payload is not None:
+            self._record('EmbeddingCacheHit', 'memory')
+            return unpack_embedding(payload)
+
+        if self.table_name and self.dynamodb:
+            try:
+                response = self.dynamodb.get_item(
+                    TableName=self.table_name,
+                    Key={'cache_key': {'S': key}}
+                )
+                item = response.get('Item')
+                if item and int(item['expires_at']['N']) > time.time():
+                    payload = item['embedding']['B']
+                    self._remember(key, payload)
+                    self._record('EmbeddingCacheHit', 'dynamodb')
+                    return unpack_embedding(payload)
+            except Exception as e:
+                logger.warning(f"Shared embedding cache lookup failed: {str(e)}")
+
+        self._record('EmbeddingCacheMiss')
+        return None
+
+    def put(self, model_id: str, dimensions: int, text: str, embedding: List[float]) -> None:
+        key = self.key(model_id, dimensions, text)
+        payload = pack_embedding(embedding)
+        self._remember(key, payload)
+
+        if self.table_name and self.dynamodb:
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        'cache_key': {'S': key},
+                        'embedding': {'B': payload},
+                        'expires_at': {'N': str(int(time.time() + self.ttl_seconds))}
+                    }
+                )
+            except Exception as e:
+                logger.warning(f"Failed to write shared embedding cache: {str(e)}")
+
+    def get_or_compute(self, model_id: str, dimensions: int, text: str,
+                       compute: Callable[[str], Optional[List[float]]]) -> Optional[List[float]]:
+        """Return the cached embedding or compute, cache and return it"""
+        embedding = self.get(model_id, dimensions, text)
+        if embedding is None:
+            embedding = compute(text)
+            if embedding:
+                self.put(model_id, dimensions, text, embedding)
+        return embedding
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _record(name: str, tier: Optional[str] = None) -> None:
+        if metrics is None:
+            return
+        metrics.add_metric(name=name, unit=MetricUnit.Count, value=1)
+        if tier:
+            metrics.add_metric(name=f"{name}{tier.capitalize()}", unit=MetricUnit.Count, value=1)
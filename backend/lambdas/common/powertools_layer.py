@@ -3,6 +3,7 @@ Common utilities and decorators for Lambda functions using AWS Lambda Powertools
 """
 import os
 import json
+import time
 from typing import Any, Dict, Callable
 from functools import wraps
 from aws_lambda_powertools import Logger, Tracer, Metrics
@@ -0,0 +1,74 @@
+"""
+Response shaping shared by the RAG query and chat resolver Lambdas.
+
+Clients can ask for a subset of the response with a `fields` list (or a
+comma-separated string). Top-level keys select whole sections, and
+`citations.<key>` selects individual keys of each citation, so
+["answer", "citations.document_id"] returns the answer and cited ids only.
+Error fields are always kept.
+
+Bodies are gzip-compressed when the request's Accept-Encoding allows it
+and the body is large enough for compression to pay off. Requests that
+arrive through API Gateway carry no headers to the Lambda; the REST API
+compresses those responses itself.
+"""
+import base64
+import gzip
+from typing import Any, Dict, List, Optional, Tuple
+
+# Always returned so a projected response still explains a failure
+ALWAYS_INCLUDED = ('error', 'retry_after_seconds')
+
+
+def parse_fields(raw: Any) -> Optional[List[str]]:
+    """Normalise the fields parameter; None means the full response"""
+    if not raw:
+        return None
+    if isinstance(raw, str):
+        raw = raw.split(',')
+    if not isinstance(raw, list):
+        return None
+    fields = [str(name).strip() for name in raw if str(name).strip()]
+    return fields or None
+
+
+def project_response(result: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Keep only the requested top-level keys and citation keys"""
+    if not fields:
+        return result
+
+    top_level = set(ALWAYS_INCLUDED)
+    citation_keys = []
+    for name in fields:
+        section, _, key = name.partition('.')
+        top_level.add(section)
+        if section == 'citations' and key:
+            citation_keys.append(key)
+
+    projected = {name: value for name, value in result.items() if name in top_level}
+    if citation_keys and isinstance(projected.get('citations'), list):
+        projected['citations'] = [
+            {key: citation[key] for key in citation_keys if key in citation}
+            for citation in projected['citations']
+        ]
+    return projected
+
+
+def accepts_gzip(headers: Optional[Dict[str, str]]) -> bool:
+    for name, value in (headers or {}).items():
+        if name.lower() == 'accept-encoding' and value:
+            for coding in value.split(','):
+                coding, _, params = coding.strip().partition(';')
+                if coding.strip().lower() in ('gzip', '*') and params.replace(' ', '') != 'q=0':
+                    return True
+    return False
+
+
+def encode_body(text: str, gzip_allowed: bool, min_bytes: int = 1024) -> Tuple[str, bool, int, int]:
+    """Return (body, is_base64_encoded, uncompressed bytes, compressed bytes)"""
+    raw = text.encode('utf-8')
+    if gzip_allowed and len(raw) >= min_bytes:
+        compressed = gzip.compress(raw, compresslevel=6)
+        if len(compressed) < len(raw):
+            return base64.b64encode(compressed).decode('ascii'), True, len(raw), len(compressed)
+    return text, False, len(raw), len(raw)
@@ -0,0 +1,188 @@
+"""
+Per-tenant admission control shared by the query-side Lambdas.
+
+Each tenant has a token bucket per service (rag-query, chat) so one tenant
+running scripts cannot spend the Kendra and Bedrock quotas every other
+tenant depends on. Buckets live in DynamoDB so every container sees the
+same balance; LocalBucketStore keeps them in memory for tests and local
+runs.
+
+Limits default to ADMISSION_RATE requests per second with bursts of
+ADMISSION_BURST. A batch costs one token per question, so the burst must
+cover the largest batch a tenant may send. A tenant's limit is overridden
+by setting numeric `rate` and `burst` attributes on its item in the
+admission table.
+
+Usage and rejections are printed as EMF metrics dimensioned by tenant and
+service. If the store cannot be reached the request is admitted.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+NAMESPACE = os.environ.get('POWERTOOLS_METRICS_NAMESPACE', 'StrataGPT/RAG')
+
+
+@dataclass(frozen=True)
+class TenantLimit:
+    rate: float
+    burst: float
+
+
+@dataclass
+class AdmissionDecision:
+    allowed: bool
+    retry_after: float
+    remaining: float
+    limit: TenantLimit
+
+    @property
+    def retry_after_seconds(self) -> int:
+        return max(1, math.ceil(self.retry_after))
+
+
+def refill(tokens: float, updated_at: float, now: float, limit: TenantLimit) -> float:
+    return min(limit.burst, tokens + max(0.0, now - updated_at) * limit.rate)
+
+
+def take_tokens(tokens: float, cost: float, limit: TenantLimit) -> Tuple[bool, float, float]:
+    """Return (allowed, tokens left, seconds until cost tokens are available)"""
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    # A request larger than the burst can never fit; wait for a full bucket
+    needed = min(cost, limit.burst) - tokens
+    return False, tokens, needed / limit.rate if limit.rate > 0 else float('inf')
+
+
+class LocalBucketStore:
+    """In-memory buckets for tests and single-container use"""
+
+    def __init__(self, limits: Optional[Dict[str, TenantLimit]] = None):
+        self.limits = limits or {}
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, tenant_id: str, bucket: str, cost: float, default: TenantLimit,
+             now: float) -> AdmissionDecision:
+        limit = self.limits.get(tenant_id, default)
+        with self._lock:
+            tokens, updated_at = self._buckets.get((tenant_id, bucket), (limit.burst, now))
+            allowed, tokens, retry_after = take_tokens(refill(tokens, updated_at, now, limit), cost, limit)
+            self._buckets[(tenant_id, bucket)] = (tokens, now)
+        return AdmissionDecision(allowed, retry_after, tokens, limit)
+
+
+class DynamoDBBucketStore:
+    """
+    Buckets stored as one item per (tenant_id, bucket). Updates are
+    conditional on the previous updated_at, so concurrent containers retry
+    instead of overwriting each other's spend.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client: Any, max_attempts: int = 3):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def _limit(item: Dict[str, Any], default: TenantLimit) -> TenantLimit:
+        rate = float(item['rate']['N']) if 'rate' in item else default.rate
+        burst = float(item['burst']['N']) if 'burst' in item else default.burst
+        return TenantLimit(rate, burst)
+
+    def take(self, tenant_id: str, bucket: str, cost: float, default: TenantLimit,
+             now: float) -> AdmissionDecision:
+        key = {'tenant_id': {'S': tenant_id}, 'bucket': {'S': bucket}}
+        for _ in range(self.max_attempts):
+            item = self.dynamodb.get_item(TableName=self.table_name, Key=key, ConsistentRead=True).get('Item', {})
+            limit = self._limit(item, default)
+            if 'tokens' in item:
+                previous = item['updated_at']['N']
+                tokens = refill(float(item['tokens']['N']), float(previous), now, limit)
+                condition, values = 'updated_at = :previous', {':previous': {'N': previous}}
+            else:
+                tokens = limit.burst
+                condition, values = 'attribute_not_exists(tokens)', {}
+
+            allowed, tokens, retry_after = take_tokens(tokens, cost, limit)
+            if not allowed:
+                # Nothing was spent, so there is nothing to write
+                return AdmissionDecision(False, retry_after, tokens, limit)
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key=key,
+                    UpdateExpression='SET tokens = :tokens, updated_at = :now',
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues={
+                        ':tokens': {'N': repr(tokens)},
+                        ':now': {'N': repr(now)},
+                        **values
+                    }
+                )
+                return AdmissionDecision(True, 0.0, tokens, limit)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Another container spent from the bucket first; re-read it
+
+        raise RuntimeError(f"Admission bucket for tenant {tenant_id} is contended")
+
+
+class TenantAdmission:
+    def __init__(self, store: Any, service: str, default_limit: TenantLimit):
+        self.store = store
+        self.service = service
+        self.default_limit = default_limit
+
+    @classmethod
+    def from_environment(cls, service: str, dynamodb_client: Any) -> Optional['TenantAdmission']:
+        """Admission control backed by ADMISSION_TABLE, or None when it is not configured"""
+        table_name = os.environ.get('ADMISSION_TABLE')
+        if not table_name:
+            return None
+        default_limit = TenantLimit(
+            rate=float(os.environ.get('ADMISSION_RATE', '2')),
+            burst=float(os.environ.get('ADMISSION_BURST', '50'))
+        )
+        return cls(DynamoDBBucketStore(table_name, dynamodb_client), service, default_limit)
+
+    def admit(self, tenant_id: str, cost: float = 1) -> AdmissionDecision:
+        """Spend cost tokens from the tenant's bucket if it can afford them"""
+        try:
+            decision = self.store.take(tenant_id, self.service, cost, self.default_limit, time.time())
+        except Exception as e:
+            logger.warning(f"Admission check failed for tenant {tenant_id}, admitting: {str(e)}")
+            return AdmissionDecision(True, 0.0, 0.0, self.default_limit)
+
+        self.emit_metrics(tenant_id, decision, cost)
+        if not decision.allowed:
+            logger.warning(f"Tenant {tenant_id} over {self.service} limit "
+                           f"({decision.limit.rate}/s, burst {decision.limit.burst}); retry in {decision.retry_after:.1f}s")
+        return decision
+
+    def emit_metrics(self, tenant_id: str, decision: AdmissionDecision, cost: float) -> None:
+        """Print an EMF record of the tenant's admitted or rejected units"""
+        name = 'AdmittedRequests' if decision.allowed else 'RejectedRequests'
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['tenant_id', 'service'], ['service']],
+                    'Metrics': [{'Name': name, 'Unit': 'Count'}]
+                }]
+            },
+            'tenant_id': tenant_id,
+            'service': self.service,
+            name: cost
+        }))
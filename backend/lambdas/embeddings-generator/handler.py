@@ -9,6 +9,8 @@ from requests.auth import HTTPBasicAuth
 import time
 from dataclasses import dataclass
 import base64
+import struct
+from urllib.parse import quote
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -17,6 +19,12 @@ bedrock = boto3.client('bedrock-runtime')
 s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
 
+# Chunk artifacts read by rag-query's in-process index for small tenants
+LOCAL_INDEX_PREFIX = os.environ.get('LOCAL_INDEX_PREFIX', 'local-index')
+
+# Per-tenant document generations that rag-query checks its caches and vector snapshots against
+TENANT_STATE_TABLE = os.environ.get('TENANT_STATE_TABLE')
+
 @dataclass
 class EmbeddingConfig:
     model_id: str = 'amazon.titan-embed-text-v2:0'
@@ -54,6 +62,7 @@ class OpenSearchClient:
                     "tenant_id": {"type": "keyword"},
                     "document_id": {"type": "keyword"},
                     "chunk_id": {"type": "keyword"},
+                    "s3_key": {"type": "keyword"},
                     "text": {"type": "text"},
                     "embedding": {
                         "type": "knn_vector",
@@ -199,6 +208,73 @@ class EmbeddingGenerator:
         except Exception as e:
             logger.warning(f"Failed to update status: {str(e)}")
 
+def chunk_artifact_key(tenant_id: str, document_id: str, source_key: Optional[str] = None) -> str:
+    """
+    Artifacts are named after the URL-encoded source object key when it is known,
+    so kendra-custom-ingest can delete a document's artifact from its S3 key alone
+    """
+    name = quote(source_key, safe='') if source_key else document_id
+    return f"{LOCAL_INDEX_PREFIX}/{tenant_id}/{name}.json"
+
+def document_title(source_key: Optional[str]) -> Optional[str]:
+    """Derive the title from the file name the way kendra-custom-ingest does, so both backends cite the same title"""
+    if not source_key:
+        return None
+    return source_key.split('/')[-1].replace('-', ' ').replace('_', ' ').title()
+
+def write_chunk_artifact(tenant_id: str, document_id: str, documents: List[Dict[str, Any]],
+                         source_key: Optional[str] = None, title: Optional[str] = None) -> bool:
+    """Write the document's chunks and float16 embeddings to s3://DOCUMENT_BUCKET/<chunk_artifact_key>"""
+    bucket = os.environ.get('DOCUMENT_BUCKET')
+    if not bucket:
+        return False
+    
+    try:
+        artifact = {
+            'tenant_id': tenant_id,
+            'document_id': document_id,
+            'title': title,
+            'source_key': source_key,
+            'chunks': [
+                {
+                    'chunk_id': doc['chunk_id'],
+                    'text': doc['text'],
+                    'page_number': doc['metadata'].get('page_number'),
+                    'embedding': base64.b64encode(
+                        struct.pack(f"<{len(doc['embedding'])}e", *doc['embedding'])
+                    ).decode('ascii')
+                }
+                for doc in documents
+            ]
+        }
+        s3.put_object(
+            Bucket=bucket,
+            Key=chunk_artifact_key(tenant_id, document_id, source_key),
+            Body=json.dumps(artifact),
+            ContentType='application/json'
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to write chunk artifact for document {document_id}: {str(e)}")
+        return False
+
+def bump_tenant_generation(tenant_id: str) -> None:
+    """Increment the tenant's document generation so rag-query drops snapshots and caches built before this document"""
+    if not TENANT_STATE_TABLE:
+        return
+    
+    try:
+        dynamodb.Table(TENANT_STATE_TABLE).update_item(
+            Key={'tenant_id': tenant_id},
+            UpdateExpression='ADD generation :one SET updated_at = :updated_at',
+            ExpressionAttributeValues={
+                ':one': 1,
+                ':updated_at': datetime.utcnow().isoformat()
+            }
+        )
+    except Exception as e:
+        logger.warning(f"Failed to bump generation for tenant {tenant_id}: {str(e)}")
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     logger.info(f"Generating embeddings for document: {event.get('documentId')}")
     
@@ -242,6 +318,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'tenant_id': tenant_id,
                 'document_id': document_id,
                 'chunk_id': f"{document_id}_chunk_{i}",
+                's3_key': event.get('key'),
                 'text': chunk,
                 'embedding': embedding,
                 'metadata': metadata,
@@ -256,6 +333,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     indexed_count = result.get('items_processed', 0) if result.get('success') else 0
     
+    if result.get('success'):
+        write_chunk_artifact(tenant_id, document_id, documents_to_index,
+                             source_key=event.get('key'), title=document_title(event.get('key')))
+        bump_tenant_generation(tenant_id)
+    
     generator.update_processing_status(
         tenant_id, 
         document_id, 
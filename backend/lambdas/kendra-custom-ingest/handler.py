@@ -4,6 +4,7 @@ import os
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from urllib.parse import quote
 import hashlib
 
 logger = logging.getLogger()
@@ -17,11 +18,16 @@ dynamodb = boto3.resource('dynamodb')
 # Environment variables
 KENDRA_INDEX_ID = os.environ['KENDRA_INDEX_ID']
 DOCUMENT_TABLE = os.environ.get('DOCUMENT_TABLE', 'strata-documents')
+TENANT_STATE_TABLE = os.environ.get('TENANT_STATE_TABLE')
+
+# Chunk artifacts written by embeddings-generator for rag-query's in-process index
+LOCAL_INDEX_PREFIX = os.environ.get('LOCAL_INDEX_PREFIX', 'local-index')
 
 class KendraCustomIngestor:
     def __init__(self):
         self.kendra_index_id = KENDRA_INDEX_ID
         self.doc_table = dynamodb.Table(DOCUMENT_TABLE) if DOCUMENT_TABLE else None
+        self.tenant_state_table = dynamodb.Table(TENANT_STATE_TABLE) if TENANT_STATE_TABLE else None
         
     def generate_document_id(self, bucket: str, key: str) -> str:
         """Generate a unique document ID for Kendra"""
@@ -35,6 +41,32 @@ class KendraCustomIngestor:
             return parts[0]
         return 'unknown'
     
+    def bump_tenant_generation(self, tenant_id: str) -> None:
+        """Increment the tenant's document generation so RAG query caches drop stale entries"""
+        if not self.tenant_state_table:
+            return
+        
+        try:
+            self.tenant_state_table.update_item(
+                Key={'tenant_id': tenant_id},
+                UpdateExpression='ADD generation :one SET updated_at = :updated_at',
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':updated_at': datetime.utcnow().isoformat()
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Failed to bump generation for tenant {tenant_id}: {str(e)}")
+    
+    def delete_chunk_artifact(self, bucket: str, key: str) -> None:
+        """Delete the document's local-index chunk artifact so rag-query stops serving its chunks"""
+        # Named as in embeddings-generator's chunk_artifact_key
+        artifact_key = f"{LOCAL_INDEX_PREFIX}/{self.extract_tenant_id_from_key(key)}/{quote(key, safe='')}.json"
+        try:
+            s3.delete_object(Bucket=bucket, Key=artifact_key)
+        except Exception as e:
+            logger.warning(f"Failed to delete chunk artifact {artifact_key}: {str(e)}")
+    
     def get_document_metadata(self, bucket: str, key: str) -> Dict[str, Any]:
         """Get document metadata from S3 object tags and custom metadata"""
         try:
@@ -250,6 +282,8 @@ class KendraCustomIngestor:
                 except Exception as e:
                     logger.warning(f"Failed to update tracking table: {str(e)}")
             
+            self.bump_tenant_generation(tenant_id)
+            
             return {
                 'success': True,
                 'document_id': doc_id,
@@ -291,6 +325,10 @@ class KendraCustomIngestor:
                 except Exception as e:
                     logger.warning(f"Failed to update tracking table: {str(e)}")
             
+            # Before the generation bump, so rag-query's reload no longer finds the artifact
+            self.delete_chunk_artifact(bucket, key)
+            self.bump_tenant_generation(self.extract_tenant_id_from_key(key))
+            
             return {
                 'success': True,
                 'document_id': doc_id,
@@ -0,0 +1,184 @@
+"""
+Tenant-scoped semantic answer cache for the RAG query Lambda.
+
+Answers are keyed on tenant, document generation, answer style and the
+embedding of the normalised question. A lookup returns a stored response when the cosine
+similarity to a previously answered question clears the threshold, so
+reworded repeats ("AGM quorum?" / "what's the quorum for the AGM") skip
+both Kendra and Bedrock.
+
+Two tiers are used: a bounded in-memory LRU that lives for the container,
+and an optional DynamoDB table shared by all containers with a TTL
+attribute so DynamoDB expires old answers itself.
+"""
+import json
+import hashlib
+import logging
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+_PUNCTUATION = re.compile(r"[^\w\s-]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    question = _PUNCTUATION.sub(' ', question.lower())
+    return _WHITESPACE.sub(' ', question).strip()
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode()).hexdigest()[:32]
+
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CachedAnswer:
+    vector: np.ndarray
+    payload: Dict[str, Any]
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512,
+                 ttl_seconds: int = 86400, table_name: Optional[str] = None,
+                 dynamodb_client: Any = None, max_shared_candidates: int = 100):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.max_shared_candidates = max_shared_candidates
+
+        # (scope, question hash) -> entry, in LRU order
+        self._entries: 'OrderedDict[Tuple[str, str], CachedAnswer]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def scope(tenant_id: str, answer_style: str, generation: int = 0) -> str:
+        return f"{tenant_id}#{generation}#{answer_style}"
+
+    def get(self, tenant_id: str, answer_style: str, embedding: List[float],
+            generation: int = 0) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Return (payload, hit info) for the closest cached answer above threshold"""
+        scope = self.scope(tenant_id, answer_style, generation)
+        vector = _unit_vector(embedding)
+
+        hit = self._get_memory(scope, vector)
+        if hit:
+            return hit
+
+        if self.table_name and self.dynamodb:
+            return self._get_shared(scope, vector)
+
+        return None
+
+    def put(self, tenant_id: str, answer_style: str, question: str,
+            embedding: List[float], payload: Dict[str, Any], generation: int = 0) -> None:
+        scope = self.scope(tenant_id, answer_style, generation)
+        key = question_hash(question)
+        vector = _unit_vector(embedding)
+        expires_at = time.time() + self.ttl_seconds
+
+        self._put_memory(scope, key, CachedAnswer(vector, payload, expires_at))
+
+        if self.table_name and self.dynamodb:
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        'scope': {'S': scope},
+                        'question_hash': {'S': key},
+                        'embedding': {'B': vector.astype(np.float16).tobytes()},
+                        'payload': {'S': json.dumps(payload)},
+                        'expires_at': {'N': str(int(expires_at))}
+                    }
+                )
+            except Exception as e:
+                logger.warning(f"Failed to write shared answer cache: {str(e)}")
+
+    def _get_memory(self, scope: str, vector: np.ndarray) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == scope]
+            live = []
+            for key in keys:
+                entry = self._entries[key]
+                if entry.expires_at <= now:
+                    del self._entries[key]
+                else:
+                    live.append((key, entry))
+
+            if not live:
+                return None
+
+            similarities = np.stack([entry.vector for _, entry in live]) @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None
+
+            key, entry = live[best]
+            self._entries.move_to_end(key)
+            return entry.payload, {'hit': True, 'tier': 'memory', 'similarity': round(similarity, 4)}
+
+    def _put_memory(self, scope: str, key: str, entry: CachedAnswer) -> None:
+        with self._lock:
+            self._entries[(scope, key)] = entry
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, scope: str, vector: np.ndarray) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        try:
+            response = self.dynamodb.query(
+                TableName=self.table_name,
+                KeyConditionExpression='#scope = :scope',
+                FilterExpression='expires_at > :now',
+                ExpressionAttributeNames={'#scope': 'scope'},
+                ExpressionAttributeValues={
+                    ':scope': {'S': scope},
+                    ':now': {'N': str(int(time.time()))}
+                },
+                Limit=self.max_shared_candidates
+            )
+        except Exception as e:
+            logger.warning(f"Shared answer cache lookup failed: {str(e)}")
+            return None
+
+        items = response.get('Items', [])
+        if not items:
+            return None
+
+        matrix = np.stack([
+            np.frombuffer(item['embedding']['B'], dtype=np.float16).astype(np.float32)
+            for item in items
+        ])
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.threshold:
+            return None
+
+        item = items[best]
+        payload = json.loads(item['payload']['S'])
+
+        # Promote into the local tier so the next lookup stays in-process
+        self._put_memory(scope, item['question_hash']['S'], CachedAnswer(
+            matrix[best], payload, float(item['expires_at']['N'])
+        ))
+
+        return payload, {'hit': True, 'tier': 'dynamodb', 'similarity': round(similarity, 4)}
@@ -0,0 +1,93 @@
+"""
+Lazily constructed AWS clients for the RAG query Lambda.
+
+Clients are created on first use and cached at module level so warm
+invocations reuse the same botocore connection pools (and their open
+TLS sessions) instead of paying connection setup on every request.
+"""
+import os
+import logging
+import threading
+import time
+from typing import Any, Dict, Callable
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, BotoCoreError
+
+logger = logging.getLogger()
+
+# Shared defaults: keep-alive connections sized for the thread pools used by
+# the engine, and "standard" retries so botocore does not add its own long
+# legacy backoff on top of the engine's retry handling.
+_BASE_CONFIG = Config(
+    connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT', '2')),
+    read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', '10')),
+    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '16')),
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 2}
+)
+
+# Per-service overrides merged on top of the base config
+_SERVICE_CONFIG = {
+    # Generation can legitimately take tens of seconds for long answers
+    'bedrock-runtime': Config(read_timeout=float(os.environ.get('BEDROCK_READ_TIMEOUT', '60'))),
+}
+
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name: str) -> Any:
+    """Return the cached client for a service, creating it on first use"""
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            config = _BASE_CONFIG
+            if service_name in _SERVICE_CONFIG:
+                config = config.merge(_SERVICE_CONFIG[service_name])
+            client = boto3.client(service_name, config=config)
+            _clients[service_name] = client
+        return client
+
+
+def reset_clients() -> None:
+    """Drop all cached clients (used by tests)"""
+    with _lock:
+        _clients.clear()
+
+
+def prime_connections(kendra_index_id: str = '', document_bucket: str = '') -> Dict[str, int]:
+    """
+    Open a TLS connection for each client during the init phase.
+
+    Each service gets the cheapest call we can make against it. The result
+    of the call does not matter - an AccessDenied or validation error still
+    leaves an established keep-alive connection in the pool for the first
+    real request to reuse.
+    """
+    calls: Dict[str, Callable[[Any], Any]] = {
+        'bedrock-runtime': lambda c: c.list_async_invokes(maxResults=1),
+    }
+    if kendra_index_id:
+        calls['kendra'] = lambda c: c.describe_index(Id=kendra_index_id)
+    if document_bucket:
+        calls['s3'] = lambda c: c.head_bucket(Bucket=document_bucket)
+
+    timings = {}
+    for service_name, call in calls.items():
+        start = time.perf_counter()
+        try:
+            call(get_client(service_name))
+        except (ClientError, BotoCoreError) as e:
+            logger.debug(f"Priming call for {service_name} returned {type(e).__name__}")
+        except Exception as e:
+            logger.warning(f"Failed to prime {service_name} connection: {str(e)}")
+        timings[service_name] = int((time.perf_counter() - start) * 1000)
+
+    logger.info(f"Primed AWS connections: {timings}")
+    return timings
@@ -0,0 +1,153 @@
+"""
+Per-tenant store of precomputed answers to canonical questions.
+
+An offline job answers each tenant's common questions through the normal
+pipeline and writes the responses to DynamoDB, tagged with the tenant's
+document generation. At query time the tenant's entries are held in an
+in-memory character-trigram index. A question whose trigram Jaccard
+similarity to a canonical question reaches the threshold is answered from
+the store without retrieval or generation.
+
+Entries from an older generation are never served, so precomputed answers
+expire as soon as the tenant's documents change.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from answer_cache import normalize_question, question_hash
+
+logger = logging.getLogger()
+
+# Response fields worth storing; timing and metrics belong to the precompute run
+STORED_FIELDS = ('answer', 'citations', 'total_sources', 'cited_sources', 'answer_source')
+
+
+def trigrams(question: str) -> Set[str]:
+    text = f"  {normalize_question(question)} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@dataclass
+class _TenantIndex:
+    generation: int
+    loaded_at: float
+    questions: List[str] = field(default_factory=list)
+    payloads: List[Dict[str, Any]] = field(default_factory=list)
+    sizes: List[int] = field(default_factory=list)
+    postings: Dict[str, List[int]] = field(default_factory=dict)
+
+    def add(self, question: str, payload: Dict[str, Any]) -> None:
+        grams = trigrams(question)
+        position = len(self.questions)
+        self.questions.append(question)
+        self.payloads.append(payload)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(position)
+
+    def best_match(self, question: str) -> Tuple[int, float]:
+        """Position and Jaccard similarity of the closest canonical question (-1 if none share a trigram)"""
+        grams = trigrams(question)
+        overlap: Dict[int, int] = {}
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                overlap[position] = overlap.get(position, 0) + 1
+
+        best, best_score = -1, 0.0
+        for position, shared in overlap.items():
+            score = shared / (len(grams) + self.sizes[position] - shared)
+            if score > best_score:
+                best, best_score = position, score
+        return best, best_score
+
+
+class FaqStore:
+    def __init__(self, table_name: str, dynamodb_client: Any, threshold: float = 0.8,
+                 refresh_seconds: float = 300, ttl_seconds: int = 30 * 86400):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.threshold = threshold
+        self.refresh_seconds = refresh_seconds
+        self.ttl_seconds = ttl_seconds
+        self._indexes: Dict[Tuple[str, str], _TenantIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(answer_style: str, question: str) -> str:
+        return f"{answer_style}#{question_hash(question)}"
+
+    def _load(self, tenant_id: str, answer_style: str, generation: int) -> _TenantIndex:
+        index = _TenantIndex(generation=generation, loaded_at=time.monotonic())
+        params = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'tenant_id = :tenant AND begins_with(faq_key, :style)',
+            'ExpressionAttributeValues': {
+                ':tenant': {'S': tenant_id},
+                ':style': {'S': f"{answer_style}#"}
+            }
+        }
+        while True:
+            response = self.dynamodb.query(**params)
+            for item in response.get('Items', []):
+                # Answers computed against an older document set are expired
+                if int(item['generation']['N']) != generation:
+                    continue
+                index.add(item['question']['S'], json.loads(item['response']['S']))
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        logger.info(f"Loaded {len(index.questions)} FAQ answers for tenant {tenant_id} (generation {generation})")
+        return index
+
+    def _index(self, tenant_id: str, answer_style: str, generation: int) -> _TenantIndex:
+        with self._lock:
+            index = self._indexes.get((tenant_id, answer_style))
+        if (index is None or index.generation != generation
+                or time.monotonic() - index.loaded_at >= self.refresh_seconds):
+            index = self._load(tenant_id, answer_style, generation)
+            with self._lock:
+                self._indexes[(tenant_id, answer_style)] = index
+        return index
+
+    def lookup(self, tenant_id: str, answer_style: str, question: str,
+               generation: int) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Return (stored response, match info) when a canonical question is close enough"""
+        try:
+            index = self._index(tenant_id, answer_style, generation)
+        except Exception as e:
+            logger.warning(f"FAQ store load failed for tenant {tenant_id}: {str(e)}")
+            # Remember the empty index so a failing table is not queried on every request
+            with self._lock:
+                self._indexes[(tenant_id, answer_style)] = _TenantIndex(generation, time.monotonic())
+            return None
+
+        position, similarity = index.best_match(question)
+        if position < 0 or similarity < self.threshold:
+            return None
+        return dict(index.payloads[position]), {
+            'question': index.questions[position],
+            'similarity': round(similarity, 4)
+        }
+
+    def put(self, tenant_id: str, answer_style: str, question: str,
+            generation: int, response: Dict[str, Any]) -> None:
+        payload = {name: response[name] for name in STORED_FIELDS if name in response}
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                'tenant_id': {'S': tenant_id},
+                'faq_key': {'S': self.key(answer_style, question)},
+                'question': {'S': question},
+                'generation': {'N': str(generation)},
+                'response': {'S': json.dumps(payload)},
+                'expires_at': {'N': str(int(time.time() + self.ttl_seconds))}
+            }
+        )
+        # Make the new entry visible on the next lookup in this container
+        with self._lock:
+            self._indexes.pop((tenant_id, answer_style), None)
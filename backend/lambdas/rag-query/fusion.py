@@ -0,0 +1,46 @@
+"""
+Reciprocal rank fusion for merging ranked result lists from different
+retrieval backends.
+
+Kendra confidence buckets and OpenSearch scores are not comparable, so the
+lists are merged on rank alone: each hit scores sum(1 / (k + rank)) over
+the lists it appears in.
+
+The backends do not return the same passage text for a document: Kendra
+returns a short excerpt around the match, OpenSearch the whole chunk, and
+their document ids differ. Hits are therefore matched on the document's
+S3 key, and the n-th hit for a document in one list is fused with the
+n-th hit for that document in every other list.
+"""
+from typing import Dict, List, Callable, Hashable, Optional
+
+from retrieval_hit import RetrievalHit
+
+
+def document_key(result: RetrievalHit) -> Hashable:
+    """Identify a hit by the S3 object it was retrieved from"""
+    return result.source_key
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[RetrievalHit]], k: int = 60,
+                           limit: Optional[int] = None,
+                           key: Callable[[RetrievalHit], Hashable] = document_key) -> List[RetrievalHit]:
+    """Merge ranked lists, keeping the first-seen copy of any passage returned by several backends"""
+    scores: Dict[Hashable, float] = {}
+    first_seen: Dict[Hashable, RetrievalHit] = {}
+
+    for results in ranked_lists:
+        occurrences: Dict[Hashable, int] = {}
+        for rank, result in enumerate(results, start=1):
+            identity = key(result)
+            result_key = identity, occurrences.get(identity, 0)
+            occurrences[identity] = result_key[1] + 1
+            scores[result_key] = scores.get(result_key, 0.0) + 1.0 / (k + rank)
+            first_seen.setdefault(result_key, result)
+
+    # sorted() is stable, so ties keep the order in which passages were first seen
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    if limit is not None:
+        ordered = ordered[:limit]
+
+    return [first_seen[result_key] for result_key in ordered]
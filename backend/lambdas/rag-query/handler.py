@@ -2,22 +2,68 @@ import json
 import boto3
 import os
 import logging
-from typing import Dict, Any, List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, Iterator, Callable
+from dataclasses import dataclass, replace
 from datetime import datetime
+import math
 import re
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from botocore.exceptions import ClientError
-# from opensearchpy import OpenSearch, RequestsHttpConnection
-# from requests_aws4auth import AWS4Auth
+import numpy as np
+
+# OpenSearch dependencies are only needed for the opensearch/hybrid backends
+try:
+    from opensearchpy import OpenSearch, RequestsHttpConnection
+    from requests_aws4auth import AWS4Auth
+except ImportError:
+    OpenSearch = None
+
+# Shared modules from the common layer are optional so the function still runs without it
+try:
+    from embedding_cache import EmbeddingCache
+except ImportError:
+    EmbeddingCache = None
+
+try:
+    from tenant_admission import TenantAdmission
+except ImportError:
+    TenantAdmission = None
+
+try:
+    from powertools_layer import metrics as powertools_metrics
+except ImportError:
+    powertools_metrics = None
+
+# Shared with chat-resolver through the common layer, which both functions always carry
+from response_encoding import parse_fields, project_response, accepts_gzip, encode_body
+
+from clients import get_client, prime_connections
+from fusion import reciprocal_rank_fusion
+from retrieval_hit import RetrievalHit
+from rerank import Reranker
+from context_packer import ContextPacker
+from rate_limit import RateLimiter, AdaptiveRateLimiter
+from circuit_breaker import CircuitBreaker, BackendUnavailableError, CLOSED
+from hedging import Hedger, HedgeBudget, LatencyTracker
+from stage_metrics import StageTimer, emit_stage_metrics, tokens_per_second
+from model_router import ModelRouter, RoutingDecision, load_routing_table
+from prompts import ANSWER_STYLE_INSTRUCTIONS
+from answer_cache import SemanticAnswerCache, normalize_question
+from retrieval_cache import RetrievalCache, TenantGenerations
+from faq_store import FaqStore
+from query_expansion import QueryExpander, load_dictionary
+from near_duplicates import collapse_near_duplicates
+from local_index import LocalIndexStore, LocalTenantIndex, IndexedDocumentCounts
+from vector_snapshot import VectorSnapshot, VectorSnapshotStore, write_snapshot
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-kendra = boto3.client('kendra')
-bedrock = boto3.client('bedrock-runtime')
-s3 = boto3.client('s3')
+def record_metric(name: str, value: float = 1, unit: str = 'Count') -> None:
+    """Add a Powertools metric when the common layer is available"""
+    if powertools_metrics is not None:
+        powertools_metrics.add_metric(name=name, unit=unit, value=value)
 
 @dataclass
 class QueryContext:
@@ -26,6 +72,10 @@ class QueryContext:
     max_results: int = 10
     include_citations: bool = True
     answer_style: str = "professional"  # professional, simple, detailed
+    debug: bool = False  # include the per-stage latency breakdown in metrics
+    use_faq: bool = True  # False when precomputing the FAQ store itself
+    search_text: Optional[str] = None  # question plus domain expansions, for keyword retrieval
+    permit_wait: Optional[float] = None  # seconds to wait for a Kendra rate-limit permit; None uses the engine default
 
 @dataclass
 class Citation:
@@ -35,6 +85,28 @@ class Citation:
     page_number: Optional[int]
     confidence_score: float
     s3_uri: Optional[str]
+    
+    @property
+    def source(self) -> str:
+        """The S3 object the excerpt came from; pipeline chunks share a placeholder document id"""
+        return self.s3_uri or self.document_id
+
+@dataclass
+class PreparedQuery:
+    """A query that has been retrieved and prompted, ready for generation"""
+    context: QueryContext
+    start_time: datetime
+    citations: List[Citation]
+    prompt: str
+    question_embedding: Optional[List[float]]
+    answer_generation: Optional[int]
+    retrieval_metrics: Dict[str, Any]
+    timer: StageTimer
+    route: Optional[RoutingDecision] = None
+
+CITATION_PATTERN = re.compile(r'\[Document (\d+)\]')
+
+GENERATION_FAILED_ANSWER = "I apologize, but I'm unable to generate a response at this time."
 
 class StrataRAGEngine:
     def __init__(self):
@@ -43,9 +115,213 @@ class StrataRAGEngine:
         self.document_bucket = os.environ['DOCUMENT_BUCKET']
         self.use_opensearch = os.environ.get('USE_OPENSEARCH', 'true').lower() == 'true'
         
+        # Question embeddings use the same Titan model as the ingestion pipeline
+        self.embedding_model_id = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+        self.embedding_dimensions = int(os.environ.get('EMBEDDING_DIMENSIONS', '768'))
+        
+        # Cache question embeddings so repeated and follow-up questions skip Titan
+        self.embedding_cache = None
+        if EmbeddingCache is not None and os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true':
+            embedding_cache_table = os.environ.get('EMBEDDING_CACHE_TABLE')
+            self.embedding_cache = EmbeddingCache(
+                max_entries=int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '2048')),
+                table_name=embedding_cache_table,
+                dynamodb_client=get_client('dynamodb') if embedding_cache_table else None
+            )
+        
+        # Per-tenant document generations, bumped by the ingestion Lambda
+        tenant_state_table = os.environ.get('TENANT_STATE_TABLE')
+        self.tenant_generations = TenantGenerations(
+            table_name=tenant_state_table,
+            dynamodb_client=get_client('dynamodb') if tenant_state_table else None,
+            refresh_seconds=float(os.environ.get('TENANT_GENERATION_REFRESH_SECONDS', '10'))
+        )
+        
+        # Exact-match Kendra result cache, invalidated by tenant generation
+        self.retrieval_cache = None
+        if os.environ.get('RETRIEVAL_CACHE_ENABLED', 'false').lower() == 'true':
+            self.retrieval_cache = RetrievalCache(
+                ttl_seconds=float(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', '300')),
+                max_entries=int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', '256'))
+            )
+        
+        # Semantic answer cache (in-memory LRU plus optional shared DynamoDB tier)
+        self.answer_cache = None
+        if os.environ.get('ANSWER_CACHE_ENABLED', 'false').lower() == 'true':
+            answer_cache_table = os.environ.get('ANSWER_CACHE_TABLE')
+            self.answer_cache = SemanticAnswerCache(
+                threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95')),
+                max_entries=int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '512')),
+                ttl_seconds=int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '86400')),
+                table_name=answer_cache_table,
+                dynamodb_client=get_client('dynamodb') if answer_cache_table else None
+            )
+        
+        # Precomputed answers to each tenant's canonical questions, matched by trigram similarity
+        faq_table = os.environ.get('FAQ_TABLE')
+        self.faq_store = FaqStore(
+            table_name=faq_table,
+            dynamodb_client=get_client('dynamodb'),
+            threshold=float(os.environ.get('FAQ_THRESHOLD', '0.8')),
+            refresh_seconds=float(os.environ.get('FAQ_REFRESH_SECONDS', '300'))
+        ) if faq_table else None
+        # Questions per precompute call, small enough to finish well inside the Lambda timeout
+        self.faq_max_questions = int(os.environ.get('FAQ_MAX_QUESTIONS', '10'))
+        
+        # Strata synonym/abbreviation automaton, compiled once per container
+        self.query_expander = None
+        if os.environ.get('QUERY_EXPANSION_ENABLED', 'false').lower() == 'true':
+            self.query_expander = QueryExpander(load_dictionary(os.environ.get('QUERY_EXPANSION_TERMS')))
+        
+        # In-process BM25 + vector index built from the tenant's chunk artifacts in S3.
+        # Tenants up to LOCAL_INDEX_MAX_DOCUMENTS whose artifacts cover every document
+        # DOCUMENT_TABLE lists as indexed are served from it directly; larger
+        # tenants up to LOCAL_INDEX_FALLBACK_MAX_DOCUMENTS are loaded in the background
+        # once Kendra is unavailable, and used until it recovers. All loaded indexes
+        # together stay under LOCAL_INDEX_MAX_MB.
+        self.local_index = None
+        self.indexed_documents = None
+        self.local_index_max_documents = int(os.environ.get('LOCAL_INDEX_MAX_DOCUMENTS', '50'))
+        if os.environ.get('LOCAL_INDEX_ENABLED', 'false').lower() == 'true':
+            self.local_index = LocalIndexStore(
+                s3_client=get_client('s3'),
+                bucket=self.document_bucket,
+                prefix=os.environ.get('LOCAL_INDEX_PREFIX', 'local-index'),
+                max_documents=int(os.environ.get('LOCAL_INDEX_FALLBACK_MAX_DOCUMENTS', '500')),
+                max_bytes=int(os.environ.get('LOCAL_INDEX_MAX_MB', '256')) * 1024 * 1024
+            )
+            self.indexed_documents = IndexedDocumentCounts(
+                table_name=os.environ.get('DOCUMENT_TABLE'),
+                dynamodb_client=get_client('dynamodb') if os.environ.get('DOCUMENT_TABLE') else None
+            )
+        
+        # Float16 per-tenant embedding snapshots, memory-mapped from /tmp in place of the OpenSearch k-NN hop
+        self.vector_snapshot_prefix = os.environ.get('VECTOR_SNAPSHOT_PREFIX', 'vector-snapshots')
+        self.vector_snapshots = None
+        if os.environ.get('VECTOR_SNAPSHOT_ENABLED', 'false').lower() == 'true':
+            self.vector_snapshots = VectorSnapshotStore(
+                s3_client=get_client('s3'),
+                bucket=self.document_bucket,
+                prefix=self.vector_snapshot_prefix,
+                directory=os.environ.get('VECTOR_SNAPSHOT_DIR', '/tmp/vector-snapshots'),
+                max_bytes=int(os.environ.get('VECTOR_SNAPSHOT_MAX_MB', '512')) * 1024 * 1024,
+                refresh_seconds=float(os.environ.get('VECTOR_SNAPSHOT_REFRESH_SECONDS', '300'))
+            )
+        
+        # Per-tenant token buckets shared across containers (None when ADMISSION_TABLE is unset)
+        self.admission = None
+        if TenantAdmission is not None and os.environ.get('ADMISSION_TABLE'):
+            self.admission = TenantAdmission.from_environment('rag-query', get_client('dynamodb'))
+        
+        # Search backend: kendra, opensearch or hybrid (both, merged with reciprocal rank fusion)
+        self.search_backend = os.environ.get('SEARCH_BACKEND', 'opensearch' if self.use_opensearch else 'kendra').lower()
+        self.kendra_timeout = float(os.environ.get('KENDRA_TIMEOUT_MS', '2500')) / 1000
+        self.opensearch_timeout = float(os.environ.get('OPENSEARCH_TIMEOUT_MS', '1500')) / 1000
+        self.rrf_k = int(os.environ.get('RRF_K', '60'))
+        self.excerpt_chars = int(os.environ.get('OPENSEARCH_EXCERPT_CHARS', '1000'))
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='search')
+        
+        # Optional concurrent pre-generation pipeline (own pool so hybrid search cannot starve it)
+        self.concurrent_pipeline = os.environ.get('CONCURRENT_PIPELINE_ENABLED', 'false').lower() == 'true'
+        self.tenant_state_deadline = int(os.environ.get('PIPELINE_TENANT_STATE_DEADLINE_MS', '500')) / 1000
+        self.embedding_deadline = int(os.environ.get('PIPELINE_EMBEDDING_DEADLINE_MS', '2000')) / 1000
+        self.search_deadline = int(os.environ.get('PIPELINE_SEARCH_DEADLINE_MS', '8000')) / 1000
+        self._pipeline_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='pipeline') if self.concurrent_pipeline else None
+        # Start retrieval alongside the answer-cache lookup; a hit discards it, still spending the query
+        self.speculative_retrieval = os.environ.get('SPECULATIVE_RETRIEVAL_ENABLED', 'false').lower() == 'true'
+        
+        # Optional in-process reranking over a wider candidate set (0 disables)
+        self.rerank_candidates = int(os.environ.get('RERANK_CANDIDATES', '0'))
+        self.reranker = Reranker(
+            bm25_weight=float(os.environ.get('RERANK_BM25_WEIGHT', '0.6')),
+            vector_weight=float(os.environ.get('RERANK_VECTOR_WEIGHT', '0.3')),
+            prior_weight=float(os.environ.get('RERANK_PRIOR_WEIGHT', '0.1'))
+        ) if self.rerank_candidates > 0 else None
+        
+        # Collapse retrieved excerpts whose SimHash fingerprints are within this many bits (-1 disables)
+        self.near_duplicate_threshold = int(os.environ.get('NEAR_DUPLICATE_THRESHOLD', '-1'))
+        
+        # Token-budgeted prompt context (0 keeps the fixed top-5 excerpts)
+        context_budget = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '0'))
+        self.context_packer = ContextPacker(budget_tokens=context_budget) if context_budget > 0 else None
+        
+        # Kendra throttling: adaptive client-side rate plus a circuit breaker. A request waits
+        # a bounded time for a rate-limit permit; batches, which are not interactive, wait longer
+        self.kendra_limiter = AdaptiveRateLimiter(
+            max_rate=float(os.environ.get('KENDRA_MAX_RPS', '10')),
+            min_rate=float(os.environ.get('KENDRA_MIN_RPS', '0.5'))
+        )
+        self.kendra_permit_wait = int(os.environ.get('KENDRA_PERMIT_WAIT_MS', '250')) / 1000
+        self.batch_kendra_permit_wait = int(os.environ.get('BATCH_KENDRA_PERMIT_WAIT_MS', '20000')) / 1000
+        self.kendra_breaker = CircuitBreaker(
+            'kendra',
+            failure_threshold=int(os.environ.get('KENDRA_BREAKER_THRESHOLD', '3')),
+            reset_seconds=float(os.environ.get('KENDRA_BREAKER_RESET_SECONDS', '10')),
+            on_transition=self._record_breaker_transition
+        )
+        
+        # Opt-in: re-issue Kendra queries slower than the container's recent latency percentile,
+        # hedging at most KENDRA_HEDGE_MAX_FRACTION of queries
+        self.kendra_hedger = None
+        if os.environ.get('KENDRA_HEDGE_ENABLED', 'false').lower() == 'true':
+            self.kendra_hedger = Hedger(
+                ThreadPoolExecutor(max_workers=int(os.environ.get('KENDRA_HEDGE_WORKERS', '8')), thread_name_prefix='kendra'),
+                LatencyTracker(
+                    percentile=float(os.environ.get('KENDRA_HEDGE_PERCENTILE', '95')),
+                    min_samples=int(os.environ.get('KENDRA_HEDGE_MIN_SAMPLES', '20'))
+                ),
+                HedgeBudget(max_fraction=float(os.environ.get('KENDRA_HEDGE_MAX_FRACTION', '0.05'))),
+                min_delay=float(os.environ.get('KENDRA_HEDGE_MIN_DELAY_MS', '50')) / 1000
+            )
+        
+        # Optional routing of each question to a model tier and output cap
+        self.model_router = ModelRouter(
+            self.bedrock_model_id,
+            load_routing_table(os.environ.get('MODEL_ROUTING_TABLE'))
+        ) if os.environ.get('MODEL_ROUTING_ENABLED', 'false').lower() == 'true' else None
+        
+        # Opt-in: request Kendra extractive answers and FAQ matches and skip Bedrock on VERY_HIGH ones
+        self.kendra_answer_shortcut = os.environ.get('KENDRA_ANSWER_SHORTCUT', 'false').lower() == 'true'
+        
+        # Per-stage latency as EMF metrics
+        self.stage_metrics_enabled = os.environ.get('STAGE_METRICS_ENABLED', 'true').lower() == 'true'
+        
+        # Responses at least this large are gzip-compressed for clients that accept it
+        self.response_gzip_min_bytes = int(os.environ.get('RESPONSE_GZIP_MIN_BYTES', '1024'))
+        
+        # Batch requests: bounded retrieval fan-out and rate-limited generation
+        self.batch_max_questions = int(os.environ.get('BATCH_MAX_QUESTIONS', '50'))
+        self.batch_retrieval_concurrency = int(os.environ.get('BATCH_RETRIEVAL_CONCURRENCY', '8'))
+        self.batch_generation_concurrency = int(os.environ.get('BATCH_GENERATION_CONCURRENCY', '4'))
+        self.generation_limiter = RateLimiter(float(os.environ.get('BATCH_GENERATION_RPS', '5')))
+        
         # Initialize OpenSearch client if needed
-        # Temporarily disabled for testing
         self.opensearch_client = None
+        if self.search_backend in ('opensearch', 'hybrid') and os.environ.get('OPENSEARCH_ENDPOINT'):
+            if OpenSearch is None:
+                logger.warning("opensearch-py is not installed, falling back to Kendra")
+            else:
+                try:
+                    self.opensearch_client = self._init_opensearch()
+                except Exception as e:
+                    logger.error(f"Failed to initialise OpenSearch client: {str(e)}")
+
+    # AWS clients are resolved lazily and shared across warm invocations
+    @property
+    def kendra(self):
+        return get_client('kendra')
+
+    @property
+    def bedrock(self):
+        return get_client('bedrock-runtime')
+
+    @property
+    def s3(self):
+        return get_client('s3')
+
+    def prime(self) -> Dict[str, int]:
+        """Open connections to Kendra, Bedrock and S3 ahead of the first request"""
+        return prime_connections(self.kendra_index_id, self.document_bucket)
             
     def _init_opensearch(self):
         """Initialize OpenSearch client with AWS authentication"""
@@ -69,101 +345,148 @@ class StrataRAGEngine:
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection,
-            timeout=30
+            timeout=30,
+            pool_maxsize=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '16'))
         )
         
         return client
         
-    def search_documents_opensearch(self, context: QueryContext) -> List[Dict[str, Any]]:
-        """Search documents using OpenSearch with proper tenant filtering"""
-        try:
-            # Build search query with tenant filtering
-            search_body = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "multi_match": {
-                                    "query": context.question,
-                                    "fields": ["content^2", "title^3", "chunk_text"],
-                                    "type": "best_fields",
-                                    "fuzziness": "AUTO"
-                                }
-                            },
-                            {
-                                "term": {
-                                    "tenant_id.keyword": context.tenant_id
-                                }
+    def _opensearch_knn_query(self, context: QueryContext, embedding: List[float]) -> Dict[str, Any]:
+        """k-NN query over the chunk embeddings with the tenant as a non-scoring filter"""
+        query: Dict[str, Any] = {
+            "bool": {
+                "must": [
+                    {
+                        "knn": {
+                            "embedding": {
+                                "vector": embedding,
+                                "k": context.max_results
                             }
-                        ]
+                        }
                     }
-                },
-                "size": context.max_results,
-                "_source": ["content", "title", "document_id", "page_number", "chunk_text", "s3_key"],
-                "highlight": {
-                    "fields": {
-                        "content": {"fragment_size": 200},
-                        "chunk_text": {"fragment_size": 200}
+                ]
+            }
+        }
+        if context.tenant_id and context.tenant_id != 'ALL':
+            query["bool"]["filter"] = [{"term": {"tenant_id": context.tenant_id}}]
+        
+        return {
+            "query": query,
+            "size": context.max_results,
+            "_source": ["text", "title", "document_id", "chunk_id", "page_number", "s3_key"]
+        }
+    
+    def _opensearch_lexical_query(self, context: QueryContext) -> Dict[str, Any]:
+        """Fuzzy keyword query, used when the question cannot be embedded"""
+        query: Dict[str, Any] = {
+            "bool": {
+                "must": [
+                    {
+                        "multi_match": {
+                            "query": context.search_text or context.question,
+                            "fields": ["text", "content^2", "title^3", "chunk_text"],
+                            "type": "best_fields",
+                            "fuzziness": "AUTO"
+                        }
                     }
+                ]
+            }
+        }
+        if context.tenant_id and context.tenant_id != 'ALL':
+            query["bool"]["filter"] = [{"term": {"tenant_id": context.tenant_id}}]
+        
+        return {
+            "query": query,
+            "size": context.max_results,
+            "_source": ["content", "text", "title", "document_id", "chunk_id", "page_number", "chunk_text", "s3_key"],
+            "highlight": {
+                "fields": {
+                    "text": {"fragment_size": 200},
+                    "content": {"fragment_size": 200},
+                    "chunk_text": {"fragment_size": 200}
                 }
             }
+        }
+    
+    def search_documents_opensearch(self, context: QueryContext) -> List[RetrievalHit]:
+        """Search documents using OpenSearch with proper tenant filtering"""
+        try:
+            # Prefer vector search over the chunk embeddings written by embeddings-generator
+            embedding = self.embed_question(context.question)
+            
+            # Tenants with a snapshot at their current generation are searched in-process
+            snapshot = self._tenant_vector_snapshot(context) if embedding else None
+            if snapshot is not None:
+                record_metric('VectorSnapshotSearch')
+                return self.search_documents_snapshot(context, snapshot, embedding)
             
-            # Execute search
+            if embedding:
+                search_body = self._opensearch_knn_query(context, embedding)
+            else:
+                logger.warning("Question embedding unavailable, using lexical OpenSearch query")
+                search_body = self._opensearch_lexical_query(context)
+            
+            # Execute search against the tenant's index
             response = self.opensearch_client.search(
-                index="strata-documents",
+                index=self._opensearch_index(context.tenant_id),
                 body=search_body
             )
             
-            # Convert OpenSearch results to Kendra-like format
+            # Convert OpenSearch hits to retrieval hits
             results = []
             for hit in response['hits']['hits']:
                 source = hit['_source']
                 highlights = hit.get('highlight', {})
                 
-                # Extract highlighted text or use content
+                # Extract highlighted text or use the chunk text
                 excerpt = ''
-                if 'content' in highlights:
+                if 'text' in highlights:
+                    excerpt = ' ... '.join(highlights['text'])
+                elif 'content' in highlights:
                     excerpt = ' ... '.join(highlights['content'])
                 elif 'chunk_text' in highlights:
                     excerpt = ' ... '.join(highlights['chunk_text'])
+                elif embedding:
+                    excerpt = self._truncate_excerpt(source.get('text') or source.get('content', ''))
                 else:
-                    excerpt = source.get('content', '')[:200] + '...'
+                    excerpt = (source.get('text') or source.get('content', ''))[:200] + '...'
                 
-                result = {
-                    'DocumentId': source.get('document_id', ''),
-                    'DocumentTitle': {
-                        'Text': source.get('title', 'Untitled Document')
-                    },
-                    'DocumentExcerpt': {
-                        'Text': excerpt
-                    },
-                    'ScoreAttributes': {
-                        'ScoreConfidence': self._score_to_confidence(hit['_score'])
-                    },
-                    'DocumentAttributes': [
-                        {
-                            'Key': '_source_uri',
-                            'Value': {
-                                'StringValue': f"s3://{self.document_bucket}/{source.get('s3_key', '')}"
-                            }
-                        },
-                        {
-                            'Key': 'page_number',
-                            'Value': {
-                                'LongValue': source.get('page_number', 1)
-                            }
-                        }
-                    ]
-                }
-                results.append(result)
+                if embedding:
+                    # The k-NN plugin reports cosinesimil hits as 1 / (2 - cosine)
+                    similarity = 2 - 1 / hit['_score'] if hit['_score'] > 0 else -1.0
+                    confidence = self._similarity_to_confidence(similarity)
+                else:
+                    similarity = math.nan
+                    confidence = self._score_to_confidence(hit['_score'])
+                
+                results.append(RetrievalHit(
+                    document_id=source.get('document_id', ''),
+                    title=source.get('title', 'Untitled Document'),
+                    excerpt=excerpt,
+                    confidence=confidence,
+                    similarity=similarity,
+                    page_number=source.get('page_number', 1),
+                    s3_uri=f"s3://{self.document_bucket}/{source['s3_key']}" if source.get('s3_key') else None
+                ))
             
-            logger.info(f"OpenSearch returned {len(results)} results for tenant {context.tenant_id}")
+            logger.info(f"OpenSearch {'k-NN' if embedding else 'lexical'} search returned {len(results)} results for tenant {context.tenant_id}")
             return results
             
         except Exception as e:
             logger.error(f"OpenSearch error: {str(e)}")
             return []
     
+    @staticmethod
+    def _opensearch_index(tenant_id: str) -> str:
+        """Per-tenant index name used by embeddings-generator"""
+        return 'strata-*' if tenant_id == 'ALL' else f"strata-{tenant_id}"
+    
+    def _truncate_excerpt(self, text: str) -> str:
+        """Trim a full chunk to an excerpt, breaking on a word boundary"""
+        if len(text) <= self.excerpt_chars:
+            return text
+        return text[:self.excerpt_chars].rsplit(' ', 1)[0] + '...'
+    
     def _score_to_confidence(self, score: float) -> str:
         """Convert OpenSearch score to Kendra-like confidence"""
         if score > 10:
@@ -175,119 +498,380 @@ class StrataRAGEngine:
         else:
             return 'LOW'
     
-    def search_documents_kendra(self, context: QueryContext) -> List[Dict[str, Any]]:
-        """Search documents using Kendra with retry logic for throttling"""
-        max_retries = 3
-        base_delay = 1  # seconds
+    def _similarity_to_confidence(self, cosine: float) -> str:
+        """Convert a question/chunk cosine similarity to Kendra-like confidence"""
+        if cosine >= 0.75:
+            return 'VERY_HIGH'
+        elif cosine >= 0.6:
+            return 'HIGH'
+        elif cosine >= 0.45:
+            return 'MEDIUM'
+        else:
+            return 'LOW'
+    
+    @staticmethod
+    def _record_breaker_transition(name: str, previous: str, state: str) -> None:
+        logger.warning(f"{name} circuit breaker {previous} -> {state}")
+        record_metric(f"CircuitBreaker{state.title().replace('_', '')}")
+    
+    def _kendra_unavailable(self, context: QueryContext, reason: str, retry_after: float) -> List[RetrievalHit]:
+        """Serve a stale cached retrieval if there is one, otherwise fail fast with a retry-after hint"""
+        if self.retrieval_cache:
+            stale = self.retrieval_cache.get_stale(context.tenant_id, context.question, context.max_results)
+            if stale is not None:
+                logger.warning(f"Kendra {reason}, serving stale retrieval for tenant {context.tenant_id}")
+                record_metric('KendraStaleRetrieval')
+                return stale
         
-        for attempt in range(max_retries):
-            try:
-                # Build query parameters with tenant filtering
-                query_params = {
-                    'IndexId': self.kendra_index_id,
-                    'QueryText': context.question,
-                    'PageSize': context.max_results,
-                    'QueryResultTypeFilter': 'DOCUMENT'
-                }
-                
-                # Add tenant filtering using AttributeFilter
-                # Skip filtering if tenant_id is 'ALL' (for testing purposes)
-                if context.tenant_id and context.tenant_id != 'ALL':
-                    query_params['AttributeFilter'] = {
-                        'EqualsTo': {
-                            'Key': 'tenant_id',
-                            'Value': {
-                                'StringValue': context.tenant_id
-                            }
+        generation = self._local_index_generation(context)
+        if generation is not None:
+            index = self.local_index.cached(context.tenant_id, generation)
+            if index is not None and len(index):
+                logger.warning(f"Kendra {reason}, serving local index for tenant {context.tenant_id}")
+                record_metric('LocalIndexFallback')
+                return self.search_documents_local(context, index)
+            if index is None:
+                # Load off the request thread so later requests can fall back to it
+                self.local_index.load_in_background(context.tenant_id, generation)
+        
+        record_metric('KendraFailFast')
+        raise BackendUnavailableError(f"Kendra {reason}", retry_after)
+    
+    def _local_index_generation(self, context: QueryContext) -> Optional[int]:
+        """The tenant's document generation if it may have a local index, otherwise None"""
+        if not self.local_index or not LocalIndexStore.valid_tenant(context.tenant_id):
+            return None
+        return self.tenant_generations.get(context.tenant_id)
+    
+    def _tenant_local_index(self, context: QueryContext) -> Optional[LocalTenantIndex]:
+        """The tenant's in-process index if it is small and complete enough to serve every request from"""
+        generation = self._local_index_generation(context)
+        if generation is None:
+            return None
+        # Documents indexed before the artifacts existed are only in Kendra, so without
+        # a count to check the artifacts against the tenant stays on Kendra
+        indexed = self.indexed_documents.get(context.tenant_id, generation)
+        if not indexed or indexed > self.local_index_max_documents:
+            return None
+        index = self.local_index.get(context.tenant_id, generation, max_documents=self.local_index_max_documents)
+        if index is None or not len(index) or index.document_count > self.local_index_max_documents:
+            return None
+        if index.document_count < indexed:
+            logger.info(f"Local index for tenant {context.tenant_id} covers {index.document_count} of "
+                        f"{indexed} indexed documents; searching Kendra")
+            return None
+        return index
+    
+    def _local_hit(self, chunk: Dict[str, Any], bm25: float, similarity: float) -> RetrievalHit:
+        return RetrievalHit(
+            document_id=chunk['document_id'],
+            title=chunk['title'],
+            excerpt=self._truncate_excerpt(chunk['text']),
+            confidence=self._score_to_confidence(bm25) if math.isnan(similarity) else self._similarity_to_confidence(similarity),
+            similarity=similarity,
+            page_number=chunk['page_number'],
+            s3_uri=f"s3://{self.document_bucket}/{chunk['source_key']}" if chunk['source_key'] else None
+        )
+    
+    def search_documents_local(self, context: QueryContext, index: LocalTenantIndex) -> List[RetrievalHit]:
+        """BM25 and vector search over the tenant's in-process index"""
+        start = time.perf_counter()
+        results = index.search(context.search_text or context.question, self.embed_question(context.question),
+                               context.max_results, self._local_hit, self.rrf_k)
+        logger.info(f"Local index search returned {len(results)} results for tenant {context.tenant_id} "
+                    f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+        return results
+    
+    def _tenant_vector_snapshot(self, context: QueryContext) -> Optional[VectorSnapshot]:
+        """The tenant's vector snapshot if one was exported at its current generation"""
+        if not self.vector_snapshots:
+            return None
+        generation = self.tenant_generations.get(context.tenant_id)
+        if generation is None:
+            return None
+        snapshot = self.vector_snapshots.get(context.tenant_id, generation)
+        return snapshot if snapshot is not None and len(snapshot) else None
+    
+    def search_documents_snapshot(self, context: QueryContext, snapshot: VectorSnapshot,
+                                  embedding: List[float]) -> List[RetrievalHit]:
+        """Exact cosine search over the tenant's memory-mapped snapshot"""
+        start = time.perf_counter()
+        results = [
+            self._local_hit(snapshot.chunk(row), math.nan, similarity)
+            for row, similarity in snapshot.search(embedding, context.max_results)
+        ]
+        logger.info(f"Vector snapshot search returned {len(results)} results for tenant {context.tenant_id} "
+                    f"over {len(snapshot)} chunks in {(time.perf_counter() - start) * 1000:.1f}ms")
+        return results
+    
+    def search_documents_kendra(self, context: QueryContext) -> List[RetrievalHit]:
+        """Search documents using Kendra, failing fast or serving stale results when throttled"""
+        # Serve identical questions from the retrieval cache while the tenant's documents are unchanged
+        generation = None
+        if self.retrieval_cache:
+            generation = self.tenant_generations.get(context.tenant_id)
+            if generation is not None:
+                cached = self.retrieval_cache.get(context.tenant_id, generation, context.question, context.max_results)
+                if cached is not None:
+                    logger.info(f"Retrieval cache hit for tenant {context.tenant_id} (generation {generation})")
+                    return cached
+        
+        if not self.kendra_breaker.allow():
+            return self._kendra_unavailable(context, 'circuit open', self.kendra_breaker.retry_after())
+        
+        if self.kendra_limiter.try_acquire() > 0:
+            # The permit is late, not refused: wait for it up to the request's bound
+            permit_wait = self.kendra_permit_wait if context.permit_wait is None else context.permit_wait
+            waited = self.kendra_limiter.acquire(timeout=permit_wait)
+            if waited < 0:
+                self.kendra_breaker.release()
+                return self._kendra_unavailable(context, 'client rate limit reached', 1 / self.kendra_limiter.rate)
+            record_metric('KendraPermitWaitMs', waited * 1000, 'Milliseconds')
+        
+        try:
+            # Build query parameters with tenant filtering
+            query_params = {
+                'IndexId': self.kendra_index_id,
+                'QueryText': context.search_text or context.question,
+                'PageSize': context.max_results
+            }
+            # Without a filter Kendra also returns ANSWER and QUESTION_ANSWER results
+            if not self.kendra_answer_shortcut:
+                query_params['QueryResultTypeFilter'] = 'DOCUMENT'
+            
+            # Add tenant filtering using AttributeFilter
+            # Skip filtering if tenant_id is 'ALL' (for testing purposes)
+            if context.tenant_id and context.tenant_id != 'ALL':
+                query_params['AttributeFilter'] = {
+                    'EqualsTo': {
+                        'Key': 'tenant_id',
+                        'Value': {
+                            'StringValue': context.tenant_id
                         }
                     }
-                    logger.info(f"Added tenant filter for tenant_id: {context.tenant_id}")
-                
-                logger.info(f"Querying Kendra (attempt {attempt + 1}/{max_retries}) with tenant_id: {context.tenant_id}")
-                
-                # Query Kendra
-                response = kendra.query(**query_params)
-                
-                results = response.get('ResultItems', [])
-                logger.info(f"Kendra returned {len(results)} results")
-                
-                return results
-                
-            except ClientError as e:
-                error_code = e.response['Error']['Code']
-                if error_code == 'ThrottlingException':
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt)  # Exponential backoff
-                        logger.warning(f"Kendra throttling detected, retrying in {delay} seconds...")
-                        time.sleep(delay)
-                        continue
-                    else:
-                        logger.error(f"Kendra throttling persists after {max_retries} attempts")
-                        raise
-                else:
-                    logger.error(f"Kendra search error: {str(e)}")
-                    raise
+                }
+                logger.info(f"Added tenant filter for tenant_id: {context.tenant_id}")
+            
+            logger.info(f"Querying Kendra with tenant_id: {context.tenant_id}")
+            
+            # Query Kendra
+            response = self._query_kendra(query_params)
+            
+            results = [RetrievalHit.from_kendra(item) for item in response.get('ResultItems', [])]
+            logger.info(f"Kendra returned {len(results)} results")
+            
+            self.kendra_breaker.record_success()
+            self.kendra_limiter.on_success()
+            
+            if generation is not None:
+                self.retrieval_cache.put(context.tenant_id, generation, context.question, context.max_results, results)
+            
+            return results
             
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == 'ThrottlingException':
+                logger.warning(f"Kendra throttling detected (rate now {self.kendra_limiter.rate:.2f}/s)")
+                record_metric('KendraThrottle')
+                self.kendra_limiter.on_throttle()
+                self.kendra_breaker.record_failure()
+                return self._kendra_unavailable(context, 'throttled', max(self.kendra_breaker.retry_after(), 1.0))
+            
+            # Kendra answered, so the circuit has no reason to stay open
+            self.kendra_breaker.record_success()
+            logger.error(f"Kendra search error: {str(e)}")
+            raise
+        
+        except Exception as e:
+            self.kendra_breaker.record_failure()
+            logger.error(f"Unexpected Kendra search error: {str(e)}")
+            return []
+    
+    def _query_kendra(self, query_params: Dict[str, Any]) -> Dict[str, Any]:
+        """kendra.query, hedged once past the tracked latency percentile when hedging is enabled"""
+        if not self.kendra_hedger:
+            return self.kendra.query(**query_params)
+        
+        # A hedge is a second Kendra query, so it also needs a client-side rate permit
+        response, outcome = self.kendra_hedger.call(
+            lambda: self.kendra.query(**query_params),
+            can_hedge=lambda: self.kendra_limiter.try_acquire() == 0
+        )
+        # Emitted as 0/1 per query: the Average is the hedge rate, the Sum the count
+        record_metric('KendraHedged', int(outcome.hedged))
+        record_metric('KendraHedgeWins', int(outcome.won))
+        record_metric('KendraHedgeDenied', int(outcome.denied))
+        if outcome.hedged:
+            logger.info(f"Hedged Kendra query; {'hedge' if outcome.won else 'original'} returned first")
+        return response
+    
+    def search_documents_hybrid(self, context: QueryContext) -> List[RetrievalHit]:
+        """Query Kendra and OpenSearch concurrently and merge with reciprocal rank fusion"""
+        backends = {
+            'kendra': (self._search_pool.submit(self.search_documents_kendra, context), self.kendra_timeout),
+            'opensearch': (self._search_pool.submit(self.search_documents_opensearch, context), self.opensearch_timeout)
+        }
+        
+        # Each backend gets its own deadline measured from submission
+        start = time.perf_counter()
+        ranked_lists = []
+        errors = []
+        for name, (future, timeout) in backends.items():
+            try:
+                remaining = max(0.0, timeout - (time.perf_counter() - start))
+                ranked_lists.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                logger.warning(f"Hybrid search: {name} exceeded {int(timeout * 1000)}ms, continuing without it")
             except Exception as e:
-                logger.error(f"Unexpected Kendra search error: {str(e)}")
-                return []
+                logger.warning(f"Hybrid search: {name} failed: {str(e)}")
+                errors.append(e)
+        
+        if errors and len(errors) == len(backends):
+            raise errors[0]
+        
+        results = reciprocal_rank_fusion(ranked_lists, k=self.rrf_k, limit=context.max_results)
+        logger.info(f"Hybrid search fused {[len(r) for r in ranked_lists]} results into {len(results)}")
+        return results
     
-    def search_documents(self, context: QueryContext) -> List[Dict[str, Any]]:
-        """Main search method that chooses between OpenSearch and Kendra"""
-        if self.use_opensearch and self.opensearch_client:
+    @property
+    def active_backend(self) -> str:
+        """The configured backend, or kendra when OpenSearch is unavailable"""
+        if self.search_backend in ('hybrid', 'opensearch') and self.opensearch_client:
+            return self.search_backend
+        return 'kendra'
+    
+    def search_documents(self, context: QueryContext) -> List[RetrievalHit]:
+        """Main search method that chooses between the local index, OpenSearch, Kendra or both"""
+        # Small tenants are answered in-process without a Kendra round-trip
+        index = self._tenant_local_index(context)
+        if index is not None:
+            record_metric('LocalIndexSearch')
+            return self.search_documents_local(context, index)
+        
+        backend = self.active_backend
+        if backend == 'hybrid':
+            logger.info("Using hybrid Kendra + OpenSearch document search")
+            return self.search_documents_hybrid(context)
+        elif backend == 'opensearch':
             logger.info("Using OpenSearch for document search")
             return self.search_documents_opensearch(context)
         else:
             logger.info("Using Kendra for document search")
             return self.search_documents_kendra(context)
     
-    def extract_citations(self, search_results: List[Dict[str, Any]]) -> List[Citation]:
-        """Extract and format citations from search results"""
-        citations = []
+    def retrieve(self, context: QueryContext) -> Tuple[List[RetrievalHit], Dict[str, Any]]:
+        """Search documents and post-process the candidates, returning results and retrieval metrics"""
+        retrieval_metrics: Dict[str, Any] = {}
+        if self.kendra_breaker.state != CLOSED:
+            retrieval_metrics['kendra_circuit'] = self.kendra_breaker.state
         
+        # Add statutory terms for abbreviations and informal names before searching
+        if self.query_expander:
+            start = time.perf_counter()
+            search_text, expansions = self.query_expander.expand(context.question)
+            if expansions:
+                context = replace(context, search_text=search_text)
+                retrieval_metrics['query_expansion'] = {
+                    'terms': expansions,
+                    'duration_us': round((time.perf_counter() - start) * 1e6, 1)
+                }
+                logger.info(f"Query expansion for tenant {context.tenant_id}: {json.dumps(expansions)}")
+        
+        if not self.reranker:
+            return self.search_documents(context), retrieval_metrics
+        
+        # Retrieve wider than we need, then rerank in-process
+        candidates = self.search_documents(replace(context, max_results=max(context.max_results, self.rerank_candidates)))
+        
+        # Kendra answers stay in front; only document passages are reranked
+        answers = [r for r in candidates if r.is_answer]
+        documents = [r for r in candidates if not r.is_answer]
+        
+        start = time.perf_counter()
+        results = self.reranker.rerank(context.search_text or context.question, documents, limit=context.max_results)
+        retrieval_metrics['rerank'] = {
+            'candidates': len(documents),
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+        return answers + results, retrieval_metrics
+    
+    def kendra_answer(self, search_results: List[RetrievalHit]) -> Optional[Tuple[str, str, Citation]]:
+        """Return (answer source, answer text, citation) for the first VERY_HIGH Kendra answer or FAQ match"""
         for result in search_results:
-            try:
-                # Extract document attributes
-                doc_attributes = result.get('DocumentAttributes', [])
-                doc_id = result.get('DocumentId', '')
-                
-                # Find document title
-                title = result.get('DocumentTitle', {}).get('Text', 'Untitled Document')
-                
-                # Extract excerpt with highlights
-                excerpt = result.get('DocumentExcerpt', {}).get('Text', '')
-                
-                # Get confidence score
-                score = result.get('ScoreAttributes', {}).get('ScoreConfidence', 'MEDIUM')
-                confidence_map = {'LOW': 0.3, 'MEDIUM': 0.6, 'HIGH': 0.8, 'VERY_HIGH': 0.95}
-                confidence = confidence_map.get(score, 0.5)
-                
-                # Extract S3 URI if available
-                s3_uri = None
-                for attr in doc_attributes:
-                    if attr.get('Key') == '_source_uri':
-                        s3_uri = attr.get('Value', {}).get('StringValue')
-                
-                # Extract page number if available
-                page_number = None
-                for attr in doc_attributes:
-                    if attr.get('Key') == 'page_number':
-                        page_number = int(attr.get('Value', {}).get('LongValue', 0))
-                
-                citations.append(Citation(
-                    document_id=doc_id,
-                    document_title=title,
-                    excerpt=excerpt,
-                    page_number=page_number,
-                    confidence_score=confidence,
-                    s3_uri=s3_uri
-                ))
-                
-            except Exception as e:
-                logger.warning(f"Error extracting citation: {str(e)}")
+            if not result.is_answer or result.confidence != 'VERY_HIGH' or not result.answer_text:
                 continue
+            
+            text = result.answer_text
+            if result.result_type == 'ANSWER':
+                # Lead with Kendra's top answer span when it picked one out of the passage
+                top = next((h for h in result.answer_highlights if h.get('TopAnswer')), None)
+                span = text[top['BeginOffset']:top['EndOffset']].strip() if top else ''
+                answer = f"{span}\n\n\"{text.strip()}\" [Document 1]" if span and span != text.strip() else f"{text.strip()} [Document 1]"
+                source = 'kendra_answer'
+            else:
+                answer = f"{text.strip()} [Document 1]"
+                source = 'kendra_faq'
+            
+            citation = self.hit_citation(result)
+            citation.excerpt = text
+            return source, answer, citation
+        return None
+    
+    @staticmethod
+    def hit_citation(hit: RetrievalHit) -> Citation:
+        return Citation(
+            document_id=hit.document_id,
+            document_title=hit.title,
+            excerpt=hit.excerpt,
+            page_number=hit.page_number,
+            confidence_score=hit.confidence_score,
+            s3_uri=hit.s3_uri
+        )
+    
+    def suppress_near_duplicates(self, search_results: List[RetrievalHit],
+                                 retrieval_metrics: Dict[str, Any]) -> List[RetrievalHit]:
+        """Keep the best-ranked hit of each group of near-identical excerpts, recording how many were collapsed"""
+        if self.near_duplicate_threshold < 0:
+            return search_results
         
-        return citations
+        start = time.perf_counter()
+        kept, collapsed = collapse_near_duplicates(search_results, self.near_duplicate_threshold)
+        retrieval_metrics['near_duplicates'] = {
+            'collapsed': collapsed,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+        if collapsed:
+            logger.info(f"Collapsed {collapsed} near-duplicate excerpts of {len(search_results)}")
+        record_metric('NearDuplicatesCollapsed', collapsed)
+        return kept
+    
+    def extract_citations(self, search_results: List[RetrievalHit]) -> List[Citation]:
+        """Extract citations from search results"""
+        # Kendra answers are handled by kendra_answer, not used as prompt context
+        return [self.hit_citation(result) for result in search_results if not result.is_answer]
+    
+    def route_query(self, context: QueryContext, citations: List[Citation]) -> Optional[RoutingDecision]:
+        """Pick the model tier for this question, or None to use the default model"""
+        if not self.model_router:
+            return None
+        
+        prompt_citations = citations if self.context_packer else citations[:5]
+        document_count = len({c.source for c in prompt_citations})
+        route = self.model_router.route(context.question, context.answer_style, document_count)
+        logger.info(f"Routing to {route.tier} tier ({route.model_id}, max_tokens {route.max_tokens}): {', '.join(route.signals)}")
+        return route
+    
+    def pack_context(self, citations: List[Citation],
+                     retrieval_metrics: Dict[str, Any]) -> List[Citation]:
+        """Fit citations to the prompt token budget, recording packing stats"""
+        if not self.context_packer:
+            return citations
+        
+        packed, stats = self.context_packer.pack(citations)
+        retrieval_metrics['context_packing'] = stats
+        logger.info(f"Packed {len(citations)} excerpts into {len(packed)} documents, "
+                    f"~{stats['packed_tokens']} tokens against ~{stats['baseline_tokens']} for the top 5")
+        return packed
     
     def build_strata_prompt(self, context: QueryContext, citations: List[Citation]) -> str:
         """Build a prompt optimized for Australian strata law context"""
@@ -297,15 +881,12 @@ class StrataRAGEngine:
             f"Document {i+1}: {c.document_title}\n"
             f"Excerpt: {c.excerpt}\n"
             f"Confidence: {c.confidence_score:.0%}"
-            for i, c in enumerate(citations[:5])  # Use top 5 citations
+            # Packed citations already fit the token budget; otherwise use top 5
+            for i, c in enumerate(citations if self.context_packer else citations[:5])
         ])
         
         # Style-specific instructions
-        style_instructions = {
-            "professional": "Provide a professional response suitable for strata managers and committee members.",
-            "simple": "Provide a simple, easy-to-understand response for lot owners.",
-            "detailed": "Provide a comprehensive response with detailed legal references."
-        }
+        style_instructions = ANSWER_STYLE_INSTRUCTIONS
         
         prompt = f"""You are an expert assistant for Australian strata law and management. You help answer questions about strata schemes, by-laws, meeting procedures, and compliance requirements.
 
@@ -332,26 +913,28 @@ RESPONSE:"""
         
         return prompt
     
-    def generate_answer(self, prompt: str) -> Tuple[str, Dict[str, Any]]:
+    def _generation_request(self, prompt: str, max_tokens: int = 1000) -> Dict[str, Any]:
+        """Bedrock request body for a prompt"""
+        return {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": 0.3,  # Lower temperature for more factual responses
+            "anthropic_version": "bedrock-2023-05-31"
+        }
+    
+    def generate_answer(self, prompt: str, route: Optional[RoutingDecision] = None) -> Tuple[str, Dict[str, Any]]:
         """Generate answer using Bedrock"""
+        model_id = route.model_id if route else self.bedrock_model_id
         try:
-            # Prepare the request
-            request_body = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.3,  # Lower temperature for more factual responses
-                "anthropic_version": "bedrock-2023-05-31"
-            }
-            
             # Invoke Bedrock
-            response = bedrock.invoke_model(
-                modelId=self.bedrock_model_id,
-                body=json.dumps(request_body)
+            response = self.bedrock.invoke_model(
+                modelId=model_id,
+                body=json.dumps(self._generation_request(prompt, route.max_tokens if route else 1000))
             )
             
             # Parse response
@@ -362,7 +945,7 @@ RESPONSE:"""
             metrics = {
                 'input_tokens': response_body.get('usage', {}).get('input_tokens', 0),
                 'output_tokens': response_body.get('usage', {}).get('output_tokens', 0),
-                'model': self.bedrock_model_id,
+                'model': model_id,
                 'temperature': 0.3
             }
             
@@ -370,28 +953,53 @@ RESPONSE:"""
             
         except Exception as e:
             logger.error(f"Bedrock generation error: {str(e)}")
-            return "I apologize, but I'm unable to generate a response at this time.", {}
+            return GENERATION_FAILED_ANSWER, {}
+    
+    def embed_question(self, question: str) -> Optional[List[float]]:
+        """Embed the normalised question with the Titan embedding model"""
+        text = normalize_question(question)
+        if self.embedding_cache:
+            return self.embedding_cache.get_or_compute(self.embedding_model_id, self.embedding_dimensions, text, self._invoke_embedding_model)
+        return self._invoke_embedding_model(text)
+    
+    def _invoke_embedding_model(self, text: str) -> Optional[List[float]]:
+        try:
+            response = self.bedrock.invoke_model(
+                modelId=self.embedding_model_id,
+                body=json.dumps({
+                    'inputText': text,
+                    'dimensions': self.embedding_dimensions,
+                    'normalize': True
+                })
+            )
+            return json.loads(response['body'].read()).get('embedding')
+            
+        except Exception as e:
+            logger.warning(f"Question embedding error: {str(e)}")
+            return None
+    
+    @staticmethod
+    def format_citation(citation: Citation) -> Dict[str, Any]:
+        return {
+            'document_id': citation.document_id,
+            'title': citation.document_title,
+            'excerpt': citation.excerpt,
+            'page': citation.page_number,
+            'confidence': citation.confidence_score,
+            's3_uri': citation.s3_uri
+        }
     
     def format_response(self, answer: str, citations: List[Citation]) -> Dict[str, Any]:
         """Format the final response with citations"""
         
         # Extract citation references from the answer
-        citation_pattern = r'\[Document (\d+)\]'
-        cited_indices = set(int(m.group(1)) - 1 for m in re.finditer(citation_pattern, answer))
+        cited_indices = set(int(m.group(1)) - 1 for m in CITATION_PATTERN.finditer(answer))
         
         # Build citation list
         formatted_citations = []
         for idx in cited_indices:
             if 0 <= idx < len(citations):
-                citation = citations[idx]
-                formatted_citations.append({
-                    'document_id': citation.document_id,
-                    'title': citation.document_title,
-                    'excerpt': citation.excerpt,
-                    'page': citation.page_number,
-                    'confidence': citation.confidence_score,
-                    's3_uri': citation.s3_uri
-                })
+                formatted_citations.append(self.format_citation(citations[idx]))
         
         return {
             'answer': answer,
@@ -400,85 +1008,783 @@ RESPONSE:"""
             'cited_sources': len(formatted_citations)
         }
     
-    def process_query(self, context: QueryContext) -> Dict[str, Any]:
-        """Main query processing pipeline"""
-        start_time = datetime.utcnow()
+    @staticmethod
+    def _elapsed_ms(start_time: datetime) -> int:
+        return int((datetime.utcnow() - start_time).total_seconds() * 1000)
+    
+    def _lookup_answer_cache(self, context: QueryContext, start_time: datetime) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]], Optional[int]]:
+        """Return (cached response, question embedding, tenant generation)"""
+        if not self.answer_cache:
+            return None, None, None
         
-        try:
-            # Step 1: Search documents
-            logger.info(f"Searching documents for tenant {context.tenant_id}")
-            search_results = self.search_documents(context)
+        question_embedding = None
+        answer_generation = self.tenant_generations.get(context.tenant_id)
+        if answer_generation is not None:
+            question_embedding = self.embed_question(context.question)
+        if not question_embedding:
+            return None, None, answer_generation
+        
+        return self._answer_cache_hit(context, start_time, question_embedding, answer_generation), question_embedding, answer_generation
+    
+    def _answer_cache_hit(self, context: QueryContext, start_time: datetime,
+                          question_embedding: List[float], answer_generation: Optional[int]) -> Optional[Dict[str, Any]]:
+        cached = self.answer_cache.get(context.tenant_id, context.answer_style, question_embedding, answer_generation)
+        if not cached:
+            return None
+        
+        payload, cache_info = cached
+        logger.info(f"Answer cache hit for tenant {context.tenant_id} ({cache_info['tier']}, similarity {cache_info['similarity']})")
+        response = dict(payload)
+        response['answer_source'] = 'answer_cache'
+        response['processing_time_ms'] = self._elapsed_ms(start_time)
+        response['metrics'] = {'answer_cache': cache_info}
+        response['tenant_id'] = context.tenant_id
+        response['timestamp'] = datetime.utcnow().isoformat()
+        return response
+    
+    def _lookup_faq(self, context: QueryContext, start_time: datetime) -> Optional[Dict[str, Any]]:
+        generation = self.tenant_generations.get(context.tenant_id)
+        if generation is None:
+            return None
+        
+        hit = self.faq_store.lookup(context.tenant_id, context.answer_style, context.question, generation)
+        if not hit:
+            return None
+        
+        payload, match = hit
+        logger.info(f"FAQ hit for tenant {context.tenant_id} (similarity {match['similarity']})")
+        record_metric('FaqHit')
+        response = payload
+        response['answer_source'] = 'faq'
+        response['processing_time_ms'] = self._elapsed_ms(start_time)
+        response['metrics'] = {'faq': match}
+        response['tenant_id'] = context.tenant_id
+        response['timestamp'] = datetime.utcnow().isoformat()
+        return response
+    
+    def precompute_faq(self, tenant_id: str, questions: List[str], answer_style: str = 'professional') -> Dict[str, Any]:
+        """
+        Answer canonical questions through the normal pipeline and store them
+        for the tenant's current generation. Each answer is stored as soon as
+        it completes, so a call cut short by the Lambda timeout keeps the
+        answers it already produced.
+        """
+        generation = self.tenant_generations.get(tenant_id)
+        if generation is None:
+            raise RuntimeError(f"Tenant generation unavailable for {tenant_id}")
+        
+        stored, skipped_indices = 0, []
+        
+        def store(index: int, response: Dict[str, Any]) -> None:
+            nonlocal stored
+            # Only real answers are worth serving again: no errors, failed generations or empty retrievals
+            if 'error' in response or 'answer_source' not in response or response['answer'] == GENERATION_FAILED_ANSWER:
+                skipped_indices.append(index)
+                return
+            self.faq_store.put(tenant_id, answer_style, questions[index], generation, response)
+            stored += 1
+        
+        batch = self.process_batch([
+            QueryContext(question=question, tenant_id=tenant_id, answer_style=answer_style, use_faq=False)
+            for question in questions
+        ], on_result=store)
+        
+        logger.info(f"Precomputed {stored} FAQ answers for tenant {tenant_id} (generation {generation})")
+        return {
+            'tenant_id': tenant_id,
+            'generation': generation,
+            'stored': stored,
+            'skipped': [questions[i] for i in sorted(skipped_indices)],
+            'metrics': batch['metrics']
+        }
+    
+    def _scroll_tenant_chunks(self, tenant_id: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Every chunk in the tenant's OpenSearch index, with its embedding"""
+        response = self.opensearch_client.search(
+            index=self._opensearch_index(tenant_id),
+            scroll='2m',
+            body={
+                "query": {"bool": {"filter": [{"term": {"tenant_id": tenant_id}}]}},
+                "size": page_size,
+                "sort": ["_doc"],
+                "_source": ["text", "title", "document_id", "chunk_id", "page_number", "s3_key", "metadata", "embedding"]
+            }
+        )
+        # The scroll context expires after its 2m keep-alive; the role has no ESHttpDelete to clear it early
+        while response['hits']['hits']:
+            for hit in response['hits']['hits']:
+                yield hit['_source']
+            response = self.opensearch_client.scroll(scroll_id=response['_scroll_id'], scroll='2m')
+    
+    def export_vector_snapshot(self, tenant_id: str) -> Dict[str, Any]:
+        """Write the tenant's OpenSearch chunk embeddings to S3 as a float16 snapshot at its current generation"""
+        # Read the generation first: documents ingested mid-export bump it and retire this snapshot
+        generation = self.tenant_generations.get(tenant_id)
+        if generation is None:
+            raise RuntimeError(f"Tenant generation unavailable for {tenant_id}")
+        
+        start = time.perf_counter()
+        chunks = []
+        for source in self._scroll_tenant_chunks(tenant_id):
+            if not source.get('embedding'):
+                continue
+            chunks.append({
+                'chunk_id': source.get('chunk_id', ''),
+                'document_id': source.get('document_id', ''),
+                'title': source.get('title'),
+                'source_key': source.get('s3_key'),
+                'page_number': source.get('page_number') or source.get('metadata', {}).get('page_number'),
+                'text': source.get('text') or source.get('content', ''),
+                'embedding': source['embedding']
+            })
+        if not chunks:
+            raise RuntimeError(f"No embedded chunks found for tenant {tenant_id}")
+        
+        summary = write_snapshot(self.s3, self.document_bucket, self.vector_snapshot_prefix, tenant_id, generation, chunks)
+        summary['duration_ms'] = int((time.perf_counter() - start) * 1000)
+        logger.info(f"Exported vector snapshot for tenant {tenant_id}: {summary['rows']} chunks, "
+                    f"{summary['matrix_bytes']} bytes at generation {generation}")
+        return summary
+    
+    def benchmark_vector_snapshot(self, tenant_id: str, questions: List[str], k: int = 10) -> Dict[str, Any]:
+        """Latency and recall@k of the snapshot and OpenSearch HNSW against exact OpenSearch search"""
+        generation = self.tenant_generations.get(tenant_id)
+        if generation is None:
+            raise RuntimeError(f"Tenant generation unavailable for {tenant_id}")
+        
+        start = time.perf_counter()
+        snapshot = self.vector_snapshots.get(tenant_id, generation)
+        load_ms = (time.perf_counter() - start) * 1000
+        if snapshot is None:
+            raise RuntimeError(f"No vector snapshot for tenant {tenant_id} at generation {generation}")
+        
+        index = self._opensearch_index(tenant_id)
+        context = QueryContext(question='', tenant_id=tenant_id, max_results=k)
+        latency: Dict[str, List[float]] = {'opensearch_hnsw': [], 'snapshot': []}
+        recall: Dict[str, List[float]] = {'opensearch_hnsw': [], 'snapshot': []}
+        for question in questions:
+            embedding = self.embed_question(question)
+            if not embedding:
+                continue
             
-            if not search_results:
-                return {
-                    'answer': "I couldn't find any relevant documents to answer your question. Please ensure documents have been uploaded for your strata scheme.",
-                    'citations': [],
-                    'processing_time_ms': int((datetime.utcnow() - start_time).total_seconds() * 1000)
-                }
+            # Ground truth: exact float32 cosine scoring of every chunk by the k-NN plugin
+            exact = self.opensearch_client.search(index=index, body={
+                "size": k,
+                "_source": ["chunk_id"],
+                "query": {"script_score": {
+                    "query": {"bool": {"filter": [{"term": {"tenant_id": tenant_id}}]}},
+                    "script": {"source": "knn_score", "lang": "knn", "params": {
+                        "field": "embedding", "query_value": embedding, "space_type": "cosinesimil"
+                    }}
+                }}
+            })
+            expected = {hit['_source']['chunk_id'] for hit in exact['hits']['hits']}
+            if not expected:
+                continue
             
-            # Step 2: Extract citations
-            citations = self.extract_citations(search_results)
-            logger.info(f"Found {len(citations)} relevant documents")
+            search_start = time.perf_counter()
+            hnsw = self.opensearch_client.search(index=index, body=self._opensearch_knn_query(context, embedding))
+            latency['opensearch_hnsw'].append((time.perf_counter() - search_start) * 1000)
+            found = {hit['_source'].get('chunk_id') for hit in hnsw['hits']['hits']}
+            recall['opensearch_hnsw'].append(len(found & expected) / len(expected))
             
-            # Step 3: Build prompt
-            prompt = self.build_strata_prompt(context, citations)
+            search_start = time.perf_counter()
+            rows = snapshot.search(embedding, k)
+            latency['snapshot'].append((time.perf_counter() - search_start) * 1000)
+            found = {snapshot.chunks['chunk_id'][row] for row, _ in rows}
+            recall['snapshot'].append(len(found & expected) / len(expected))
+        
+        if not latency['snapshot']:
+            raise RuntimeError(f"No benchmark questions could be embedded and answered for tenant {tenant_id}")
+        
+        result = {
+            'tenant_id': tenant_id,
+            'generation': generation,
+            'k': k,
+            'questions': len(latency['snapshot']),
+            'snapshot': {'chunks': len(snapshot), 'matrix_bytes': snapshot.nbytes, 'load_ms': round(load_ms, 1)},
+            'latency_ms': {
+                name: {
+                    'p50': round(float(np.percentile(values, 50)), 2),
+                    'p95': round(float(np.percentile(values, 95)), 2),
+                    'mean': round(float(np.mean(values)), 2)
+                }
+                for name, values in latency.items()
+            },
+            f'recall_at_{k}': {name: round(float(np.mean(values)), 4) for name, values in recall.items()}
+        }
+        logger.info(f"Vector snapshot benchmark for tenant {tenant_id}: {json.dumps(result)}")
+        return result
+    
+    def _no_results_response(self, start_time: datetime) -> Dict[str, Any]:
+        return {
+            'answer': "I couldn't find any relevant documents to answer your question. Please ensure documents have been uploaded for your strata scheme.",
+            'citations': [],
+            'processing_time_ms': self._elapsed_ms(start_time)
+        }
+    
+    def _error_response(self, error: Exception, start_time: datetime) -> Dict[str, Any]:
+        response = {
+            'error': str(error),
+            'answer': "I encountered an error processing your query. Please try again.",
+            'citations': [],
+            'processing_time_ms': self._elapsed_ms(start_time)
+        }
+        if isinstance(error, BackendUnavailableError):
+            response['retry_after_seconds'] = max(1, math.ceil(error.retry_after))
+        return response
+    
+    def _record_timings(self, context: QueryContext, timer: StageTimer, metrics: Dict[str, Any]) -> None:
+        """Emit stage latencies as EMF and, for debug requests, add them to the response metrics"""
+        generate_ms = timer.durations_ms.get('generate')
+        throughput = {
+            'InputTokensPerSecond': tokens_per_second(metrics.get('input_tokens', 0), generate_ms),
+            'OutputTokensPerSecond': tokens_per_second(metrics.get('output_tokens', 0), generate_ms)
+        } if generate_ms and metrics.get('input_tokens') else None
+        
+        if self.stage_metrics_enabled:
+            emit_stage_metrics(timer.durations_ms, self.active_backend, throughput)
+        
+        if context.debug:
+            latency = {'stages_ms': timer.breakdown()}
+            if throughput:
+                latency['input_tokens_per_second'] = throughput['InputTokensPerSecond']
+                latency['output_tokens_per_second'] = throughput['OutputTokensPerSecond']
+            metrics['latency'] = latency
+    
+    def _shortcut_response(self, context: QueryContext, shortcut: Tuple[str, str, Citation], start_time: datetime,
+                           retrieval_metrics: Dict[str, Any], timer: StageTimer) -> Dict[str, Any]:
+        """Response for a Kendra answer served without invoking Bedrock"""
+        source, answer, citation = shortcut
+        logger.info(f"Short-circuiting generation with {source} for tenant {context.tenant_id}")
+        record_metric('KendraShortCircuit')
+        
+        with timer.stage('format'):
+            response = self.format_response(answer, [citation])
+        
+        metrics = {**retrieval_metrics, 'short_circuit': True}
+        self._record_timings(context, timer, metrics)
+        
+        response['answer_source'] = source
+        response['processing_time_ms'] = self._elapsed_ms(start_time)
+        response['metrics'] = metrics
+        response['tenant_id'] = context.tenant_id
+        response['timestamp'] = datetime.utcnow().isoformat()
+        return response
+    
+    def _complete_response(self, prepared: PreparedQuery, answer: str, metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """Format the generated answer, populate the answer cache and add metadata"""
+        context = prepared.context
+        
+        with prepared.timer.stage('format'):
+            response = self.format_response(answer, prepared.citations)
             
-            # Step 4: Generate answer
-            answer, metrics = self.generate_answer(prompt)
+            # Only successful generations are worth caching
+            if self.answer_cache and prepared.question_embedding:
+                if metrics:
+                    self.answer_cache.put(context.tenant_id, context.answer_style, context.question,
+                                          prepared.question_embedding, dict(response), prepared.answer_generation)
+                metrics['answer_cache'] = {'hit': False}
             
-            # Step 5: Format response
-            response = self.format_response(answer, citations)
+            metrics.update(prepared.retrieval_metrics)
+            if prepared.route:
+                metrics['routing'] = prepared.route.to_metrics()
+        
+        self._record_timings(context, prepared.timer, metrics)
+        
+        # Add metadata
+        response['answer_source'] = 'generated'
+        response['processing_time_ms'] = self._elapsed_ms(prepared.start_time)
+        response['metrics'] = metrics
+        response['tenant_id'] = context.tenant_id
+        response['timestamp'] = datetime.utcnow().isoformat()
+        
+        return response
+    
+    @staticmethod
+    def _await(future: Optional[Future], deadline: float, name: str) -> Any:
+        """Result of a pipeline call, or None if it failed or missed its deadline (monotonic time)"""
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            logger.warning(f"{name} missed its pipeline deadline")
+        except Exception as e:
+            logger.warning(f"{name} failed in pipeline: {str(e)}")
+        return None
+    
+    def _gather_concurrent(self, context: QueryContext, start_time: datetime, timer: StageTimer) -> Tuple[
+            Optional[Dict[str, Any]], Optional[List[float]], Optional[int], List[RetrievalHit], Dict[str, Any]]:
+        """
+        Start the tenant-state lookup and question embedding together, and
+        start retrieval as soon as the answer cache has missed (or at once
+        when it is disabled), so a cache hit never reaches the search
+        backends. With speculative retrieval the search starts alongside
+        the cache lookup instead and is discarded on a hit. Produces the
+        same values as the sequential steps 0 and 1; only the waiting
+        overlaps.
+        """
+        started = time.monotonic()
+        knn_backend = self.active_backend != 'kendra'
+        
+        generation_future = embedding_future = search_future = None
+        if self.answer_cache:
+            generation_future = self._pipeline_pool.submit(self.tenant_generations.get, context.tenant_id)
+        if self.answer_cache or knn_backend:
+            embedding_future = self._pipeline_pool.submit(self.embed_question, context.question)
+        
+        def search(search_timer: StageTimer) -> Tuple[List[RetrievalHit], Dict[str, Any]]:
+            with search_timer.stage('search'):
+                if knn_backend:
+                    # k-NN search then reads the embedding from the embedding cache
+                    self._await(embedding_future, started + self.embedding_deadline, 'Question embedding')
+                return self.retrieve(context)
+        
+        # A discarded search must not add its stage to a cache hit's timings
+        search_timer = StageTimer() if self.answer_cache and self.speculative_retrieval else timer
+        if search_timer is not timer:
+            logger.info(f"Searching documents for tenant {context.tenant_id} during the answer-cache lookup")
+            search_future = self._pipeline_pool.submit(search, search_timer)
+        
+        question_embedding = answer_generation = None
+        if self.answer_cache:
+            with timer.stage('answer_cache'):
+                answer_generation = self._await(generation_future, started + self.tenant_state_deadline, 'Tenant state lookup')
+                if answer_generation is not None:
+                    question_embedding = self._await(embedding_future, started + self.embedding_deadline, 'Question embedding')
+                if question_embedding:
+                    cached = self._answer_cache_hit(context, start_time, question_embedding, answer_generation)
+                    if cached:
+                        if search_future and not search_future.cancel():
+                            record_metric('SpeculativeSearchDiscarded')
+                        return cached, question_embedding, answer_generation, [], {}
+                else:
+                    question_embedding = None
+        
+        if search_future:
+            # How long the search had been running when the cache missed: an upper bound on the latency saved
+            record_metric('SpeculativeSearchHeadStartMs', (time.monotonic() - started) * 1000, 'Milliseconds')
+        else:
+            logger.info(f"Searching documents for tenant {context.tenant_id}")
+            search_future = self._pipeline_pool.submit(search, search_timer)
+        
+        try:
+            search_results, retrieval_metrics = search_future.result(
+                timeout=max(started + self.search_deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            raise BackendUnavailableError('Search missed its pipeline deadline', 1.0)
+        
+        if search_timer is not timer:
+            timer.durations_ms.update(search_timer.durations_ms)
+        return None, question_embedding, answer_generation, search_results, retrieval_metrics
+    
+    def prepare_query(self, context: QueryContext, start_time: datetime) -> Tuple[Optional[Dict[str, Any]], Optional[PreparedQuery]]:
+        """Run everything before generation, returning (final response, None) when no generation is needed"""
+        timer = StageTimer()
+        
+        # Precomputed FAQ answers skip retrieval and generation entirely
+        if self.faq_store and context.use_faq:
+            with timer.stage('faq'):
+                faq = self._lookup_faq(context, start_time)
+            if faq:
+                self._record_timings(context, timer, faq['metrics'])
+                return faq, None
+        
+        if self.concurrent_pipeline:
+            # Steps 0 and 1 overlapped
+            cached, question_embedding, answer_generation, search_results, retrieval_metrics = \
+                self._gather_concurrent(context, start_time, timer)
+        else:
+            # Step 0: Check the semantic answer cache
+            with timer.stage('answer_cache'):
+                cached, question_embedding, answer_generation = self._lookup_answer_cache(context, start_time)
             
-            # Add metadata
-            response['processing_time_ms'] = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-            response['metrics'] = metrics
-            response['tenant_id'] = context.tenant_id
-            response['timestamp'] = datetime.utcnow().isoformat()
+            # Step 1: Search documents
+            if not cached:
+                logger.info(f"Searching documents for tenant {context.tenant_id}")
+                with timer.stage('search'):
+                    search_results, retrieval_metrics = self.retrieve(context)
+        
+        if cached:
+            self._record_timings(context, timer, cached['metrics'])
+            return cached, None
+        
+        if not search_results:
+            return self._no_results_response(start_time), None
+        
+        # Kendra already answered with VERY_HIGH confidence; no generation needed
+        if self.kendra_answer_shortcut:
+            shortcut = self.kendra_answer(search_results)
+            if shortcut:
+                return self._shortcut_response(context, shortcut, start_time, retrieval_metrics, timer), None
+        
+        # Step 2: Extract citations
+        with timer.stage('extract_citations'):
+            search_results = self.suppress_near_duplicates(search_results, retrieval_metrics)
+            citations = self.pack_context(self.extract_citations(search_results), retrieval_metrics)
+        logger.info(f"Found {len(citations)} relevant documents")
+        
+        # Step 3: Build prompt
+        with timer.stage('build_prompt'):
+            route = self.route_query(context, citations)
+            prompt = self.build_strata_prompt(context, citations)
+        
+        return None, PreparedQuery(context, start_time, citations, prompt, question_embedding,
+                                   answer_generation, retrieval_metrics, timer, route)
+    
+    def complete_query(self, prepared: PreparedQuery) -> Dict[str, Any]:
+        """Generate and format the answer for a prepared query"""
+        # Step 4: Generate answer
+        with prepared.timer.stage('generate'):
+            answer, metrics = self.generate_answer(prepared.prompt, prepared.route)
+        
+        # Step 5: Format response
+        return self._complete_response(prepared, answer, metrics)
+    
+    def process_query(self, context: QueryContext) -> Dict[str, Any]:
+        """Main query processing pipeline"""
+        start_time = datetime.utcnow()
+        
+        try:
+            response, prepared = self.prepare_query(context, start_time)
+            if response:
+                return response
             
-            return response
+            return self.complete_query(prepared)
             
         except Exception as e:
             logger.error(f"Query processing error: {str(e)}", exc_info=True)
-            return {
-                'error': str(e),
-                'answer': "I encountered an error processing your query. Please try again.",
-                'citations': [],
-                'processing_time_ms': int((datetime.utcnow() - start_time).total_seconds() * 1000)
-            }
+            return self._error_response(e, start_time)
+    
+    def _complete_batch_query(self, prepared: PreparedQuery) -> Tuple[Dict[str, Any], float]:
+        """Generate one batch answer once the rate limiter allows, returning the response and seconds waited"""
+        waited = self.generation_limiter.acquire()
+        try:
+            return self.complete_query(prepared), waited
+        except Exception as e:
+            logger.error(f"Batch generation error: {str(e)}", exc_info=True)
+            return self._error_response(e, prepared.start_time), waited
+    
+    def process_batch(self, contexts: List[QueryContext],
+                      on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Answer several questions in one invocation.
+        
+        Retrieval runs on a bounded pool. Each question is handed to the
+        generation pool as soon as its prompt is ready, so generation of
+        early questions overlaps retrieval of later ones. Bedrock calls
+        are paced by the container's generation rate limiter, and Kendra
+        searches wait up to the batch permit wait for the Kendra limiter
+        instead of failing once the burst is spent. on_result, if given, is
+        called with (index, response) as each question completes.
+        """
+        start = time.perf_counter()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(contexts)
+        retrieval_done_ms = 0.0
+        limiter_wait = 0.0
+        
+        def prepare(index: int) -> Tuple[Optional[Dict[str, Any]], Optional[PreparedQuery]]:
+            start_time = datetime.utcnow()
+            context = contexts[index]
+            if context.permit_wait is None:
+                context = replace(context, permit_wait=self.batch_kendra_permit_wait)
+            try:
+                return self.prepare_query(context, start_time)
+            except Exception as e:
+                logger.error(f"Batch retrieval error: {str(e)}", exc_info=True)
+                return self._error_response(e, start_time), None
+        
+        with ThreadPoolExecutor(max_workers=self.batch_retrieval_concurrency, thread_name_prefix='batch-retrieve') as retrieval_pool, \
+                ThreadPoolExecutor(max_workers=self.batch_generation_concurrency, thread_name_prefix='batch-generate') as generation_pool:
+            retrievals = {retrieval_pool.submit(prepare, i): i for i in range(len(contexts))}
+            generations = {}
+            
+            for future in as_completed(retrievals):
+                index = retrievals[future]
+                response, prepared = future.result()
+                if response:
+                    results[index] = response
+                    if on_result:
+                        on_result(index, response)
+                else:
+                    generations[generation_pool.submit(self._complete_batch_query, prepared)] = index
+            retrieval_done_ms = (time.perf_counter() - start) * 1000
+            
+            for future in as_completed(generations):
+                index = generations[future]
+                results[index], waited = future.result()
+                limiter_wait += waited
+                if on_result:
+                    on_result(index, results[index])
+        
+        answered = sum(1 for r in results if r.get('metrics', {}).get('input_tokens'))
+        cached = sum(1 for r in results if r.get('metrics', {}).get('answer_cache', {}).get('hit'))
+        batch_metrics = {
+            'questions': len(contexts),
+            'answered': answered,
+            'cached': cached,
+            'short_circuited': sum(1 for r in results if r.get('metrics', {}).get('short_circuit')),
+            'failed': sum(1 for r in results if 'error' in r or r['answer'] == GENERATION_FAILED_ANSWER),
+            'total_ms': round((time.perf_counter() - start) * 1000, 1),
+            'retrieval_ms': round(retrieval_done_ms, 1),
+            'rate_limit_wait_ms': round(limiter_wait * 1000, 1),
+            'sum_processing_time_ms': sum(r.get('processing_time_ms', 0) for r in results),
+            'input_tokens': sum(r.get('metrics', {}).get('input_tokens', 0) for r in results),
+            'output_tokens': sum(r.get('metrics', {}).get('output_tokens', 0) for r in results)
+        }
+        logger.info(f"Batch of {len(contexts)} questions completed in {batch_metrics['total_ms']}ms")
+        
+        return {
+            'results': results,
+            'tenant_id': contexts[0].tenant_id if contexts else None,
+            'metrics': batch_metrics,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+# Engine is built once per container and reused by warm invocations
+_engine: Optional[StrataRAGEngine] = None
+_engine_init_ms = 0
+
+def get_engine() -> Tuple[StrataRAGEngine, bool]:
+    """Return the container's engine and whether this call created it"""
+    global _engine, _engine_init_ms
+    if _engine is not None:
+        return _engine, False
+    
+    start = time.perf_counter()
+    _engine = StrataRAGEngine()
+    _engine_init_ms = int((time.perf_counter() - start) * 1000)
+    return _engine, True
+
+# Optionally build the engine and open TLS connections during the init phase
+if os.environ.get('PRIME_CONNECTIONS', 'false').lower() == 'true':
+    try:
+        _primed_engine, _ = get_engine()
+        _primed_engine.prime()
+    except Exception as e:
+        logger.warning(f"Connection priming failed: {str(e)}")
+
+_cold_start = True
+
+def http_response(status_code: int, body_text: str, event: Dict[str, Any], min_gzip_bytes: int,
+                  content_type: str = 'application/json', headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Build a proxy response, gzip-compressing the body when the client accepts it"""
+    body, compressed, raw_bytes, sent_bytes = encode_body(body_text, accepts_gzip(event.get('headers')), min_gzip_bytes)
+    response_headers = {
+        'Content-Type': content_type,
+        'Access-Control-Allow-Origin': '*',
+        **(headers or {})
+    }
+    if compressed:
+        response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Vary'] = 'Accept-Encoding'
+    
+    # Track bandwidth before and after projection/compression
+    record_metric('ResponseBytes', raw_bytes, 'Bytes')
+    record_metric('ResponseBytesSent', sent_bytes, 'Bytes')
+    logger.info(f"Response {status_code}: {raw_bytes} bytes, {sent_bytes} sent{' (gzip)' if compressed else ''}")
+    
+    response = {'statusCode': status_code, 'headers': response_headers, 'body': body}
+    if compressed:
+        response['isBase64Encoded'] = True
+    return response
+
+def bad_request(message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 400,
+        'body': json.dumps({'error': message})
+    }
+
+def validate_request(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return a 400 response for a malformed query or batch, otherwise None"""
+    # Batch requests carry a list of questions for a single tenant
+    if 'questions' in body:
+        questions = body['questions']
+        if not isinstance(questions, list) or not questions:
+            return bad_request('questions must be a non-empty list')
+        engine, _ = get_engine()
+        if len(questions) > engine.batch_max_questions:
+            return bad_request(f'At most {engine.batch_max_questions} questions per batch')
+        if not all(isinstance(q, str) and q.strip() for q in questions):
+            return bad_request('Every question must be a non-empty string')
+        return None
+    
+    if not body.get('question', ''):
+        return bad_request('Question is required')
+    
+    # Callers invoke this function synchronously and read one response
+    if body.get('stream', False):
+        return bad_request('Streaming responses are not supported by this endpoint')
+    return None
+
+def admit_request(body: Dict[str, Any], event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return a 429 response if the tenant is over its limit (400 if the request can never fit), otherwise None"""
+    engine, _ = get_engine()
+    if not engine.admission:
+        return None
+    # chat-resolver has already charged this message to the tenant's 'chat' bucket.
+    # rag-query is only reachable by IAM-authorised direct invocation, so the flag is trusted
+    if body.get('admitted_by'):
+        return None
+    
+    # A batch costs one token per question; the request has already been validated
+    cost = len(body['questions']) if 'questions' in body else 1
+    tenant_id = body.get('tenant_id', 'default')
+    decision = engine.admission.admit(tenant_id, cost)
+    if decision.allowed:
+        return None
+    # The bucket never holds more than the burst, so retrying such a batch cannot succeed
+    if cost > decision.limit.burst:
+        return bad_request(f'At most {int(decision.limit.burst)} questions per batch for tenant {tenant_id}')
+    
+    return http_response(429, json.dumps({
+        'error': f'Rate limit exceeded for tenant {tenant_id}',
+        'retry_after_seconds': decision.retry_after_seconds
+    }), event, engine.response_gzip_min_bytes, headers={'Retry-After': str(decision.retry_after_seconds)})
+
+def batch_handler(body: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer a validated list of questions for one tenant in a single invocation"""
+    questions = body['questions']
+    engine, _ = get_engine()
+    
+    contexts = [
+        QueryContext(
+            question=question,
+            tenant_id=body.get('tenant_id', 'default'),
+            max_results=body.get('max_results', 10),
+            include_citations=body.get('include_citations', True),
+            answer_style=body.get('answer_style', 'professional'),
+            debug=bool(body.get('debug', False))
+        )
+        for question in questions
+    ]
+    
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    result = engine.process_batch(contexts)
+    result['metrics'].update({
+        'cold_start': cold_start,
+        'engine_init_ms': _engine_init_ms if cold_start else 0
+    })
+    
+    fields = parse_fields(body.get('fields'))
+    if fields:
+        result['results'] = [project_response(r, fields) for r in result['results']]
+    
+    return http_response(200, json.dumps(result), event, engine.response_gzip_min_bytes)
+
+def faq_handler(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Precompute FAQ answers for one tenant's canonical questions"""
+    engine, _ = get_engine()
+    questions = body.get('questions')
+    
+    if not engine.faq_store:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'FAQ store is not configured'})}
+    if not body.get('tenant_id') or not isinstance(questions, list) or not questions:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'tenant_id and a non-empty questions list are required'})}
+    if len(questions) > engine.faq_max_questions:
+        return {'statusCode': 400, 'body': json.dumps(
+            {'error': f'At most {engine.faq_max_questions} questions per call; send the rest in further calls'})}
+    
+    result = engine.precompute_faq(body['tenant_id'], questions, body.get('answer_style', 'professional'))
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(result)
+    }
+
+def snapshot_handler(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Export a tenant's vector snapshot, or benchmark it against OpenSearch"""
+    engine, _ = get_engine()
+    tenant_id = body.get('tenant_id')
+    
+    if not engine.opensearch_client:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'OpenSearch is not configured'})}
+    if not VectorSnapshotStore.valid_tenant(tenant_id or ''):
+        return {'statusCode': 400, 'body': json.dumps({'error': 'A single tenant_id is required'})}
+    
+    if body['action'] == 'export_vector_snapshot':
+        result = engine.export_vector_snapshot(tenant_id)
+    else:
+        questions = body.get('questions')
+        if not engine.vector_snapshots:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Vector snapshots are not enabled'})}
+        if not isinstance(questions, list) or not questions:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'A non-empty questions list is required'})}
+        result = engine.benchmark_vector_snapshot(tenant_id, questions, int(body.get('k', 10)))
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(result)
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Lambda handler"""
-    logger.info(f"Received event: {json.dumps(event)}")
-    
     # Extract parameters
     body = json.loads(event.get('body', '{}')) if isinstance(event.get('body'), str) else event
     
+    # Log the request shape only; questions and headers stay out of the logs
+    logger.info(f"Received request: tenant={body.get('tenant_id', 'default')} action={body.get('action', 'query')} "
+                f"questions={len(body['questions']) if isinstance(body.get('questions'), list) else 1} "
+                f"stream={bool(body.get('stream', False))} fields={body.get('fields')}")
+    
+    # Offline job: precompute the tenant's FAQ answers
+    if body.get('action') == 'precompute_faq':
+        return faq_handler(body)
+    
+    # Offline jobs: export or benchmark the tenant's vector snapshot
+    if body.get('action') in ('export_vector_snapshot', 'benchmark_vector_snapshot'):
+        return snapshot_handler(body)
+    
+    # Reject malformed requests before they are charged to the tenant
+    invalid = validate_request(body)
+    if invalid:
+        return invalid
+    
+    # Spend from the tenant's token bucket before any Kendra or Bedrock work
+    rejected = admit_request(body, event)
+    if rejected:
+        return rejected
+    
+    if 'questions' in body:
+        return batch_handler(body, event)
+    
     # Create query context
     query_context = QueryContext(
-        question=body.get('question', ''),
+        question=body['question'],
         tenant_id=body.get('tenant_id', 'default'),
         max_results=body.get('max_results', 10),
         include_citations=body.get('include_citations', True),
-        answer_style=body.get('answer_style', 'professional')
+        answer_style=body.get('answer_style', 'professional'),
+        debug=bool(body.get('debug', False))
     )
     
-    # Validate input
-    if not query_context.question:
-        return {
-            'statusCode': 400,
-            'body': json.dumps({'error': 'Question is required'})
-        }
+    # Process query on the container's shared engine
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    engine, _ = get_engine()
+    container_metrics = {
+        'cold_start': cold_start,
+        'engine_init_ms': _engine_init_ms if cold_start else 0
+    }
+    
+    fields = parse_fields(body.get('fields'))
     
-    # Process query
-    engine = StrataRAGEngine()
     result = engine.process_query(query_context)
     
+    # Report container lifecycle so cold and warm latency can be compared
+    result.setdefault('metrics', {}).update(container_metrics)
+    
+    # Retrieval was refused rather than retried; tell the client when to come back
+    if 'retry_after_seconds' in result:
+        return http_response(503, json.dumps(project_response(result, fields)), event, engine.response_gzip_min_bytes,
+                             headers={'Retry-After': str(result['retry_after_seconds'])})
+    
     # Return response
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(result)
-    }
\ No newline at end of file
+    return http_response(200, json.dumps(project_response(result, fields)), event, engine.response_gzip_min_bytes)
+
+# Flush Powertools metrics (e.g. embedding cache hits) at the end of each invocation
+if powertools_metrics is not None:
+    handler = powertools_metrics.log_metrics(handler)
@@ -0,0 +1,115 @@
+"""
+Hedged requests for backends with a long latency tail.
+
+If a call has not returned within the container's recent latency
+percentile, a second identical call is started and whichever returns
+first is used; the slower one is left to finish and its result dropped.
+
+Hedging is limited by a budget: every call earns `max_fraction` of a
+hedge credit (up to `burst` credits) and every hedge spends one, so at
+most max_fraction of calls are hedged over any stretch of traffic.
+Latency of every attempt, hedge or not, feeds the percentile, so the
+threshold follows the backend rather than the hedged outcome.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+
+
+class LatencyTracker:
+    """Rolling percentile of the last `window` latencies"""
+
+    def __init__(self, percentile: float = 95, window: int = 256, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> Optional[float]:
+        """The percentile in seconds, or None until min_samples latencies have been seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+
+class HedgeBudget:
+    def __init__(self, max_fraction: float = 0.05, burst: float = 2):
+        self.max_fraction = max_fraction
+        self.burst = burst
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self._credit = min(self.burst, self._credit + self.max_fraction)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credit >= 1:
+                self._credit -= 1
+                return True
+            return False
+
+    def refund(self) -> None:
+        with self._lock:
+            self._credit = min(self.burst, self._credit + 1)
+
+
+@dataclass
+class HedgeOutcome:
+    hedged: bool = False
+    # The hedge returned before the original call
+    won: bool = False
+    # The call passed the threshold but the budget (or can_hedge) refused a hedge
+    denied: bool = False
+
+
+class Hedger:
+    def __init__(self, executor: Executor, tracker: LatencyTracker, budget: HedgeBudget,
+                 min_delay: float = 0.05):
+        self.executor = executor
+        self.tracker = tracker
+        self.budget = budget
+        self.min_delay = min_delay
+
+    def _submit(self, fn: Callable[[], Any]) -> Future:
+        start = time.perf_counter()
+        future = self.executor.submit(fn)
+        future.add_done_callback(lambda _: self.tracker.record(time.perf_counter() - start))
+        return future
+
+    def call(self, fn: Callable[[], Any], can_hedge: Callable[[], bool] = lambda: True) -> Tuple[Any, HedgeOutcome]:
+        """Run fn, hedging it once if it is slower than the tracked percentile"""
+        self.budget.earn()
+        threshold = self.tracker.threshold()
+        primary = self._submit(fn)
+        if threshold is None:
+            return primary.result(), HedgeOutcome()
+
+        done, _ = wait([primary], timeout=max(threshold, self.min_delay))
+        if done:
+            return primary.result(), HedgeOutcome()
+        if not self.budget.try_spend():
+            return primary.result(), HedgeOutcome(denied=True)
+        if not can_hedge():
+            self.budget.refund()
+            return primary.result(), HedgeOutcome(denied=True)
+
+        hedge = self._submit(fn)
+        done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        # Prefer whichever finished first without an error
+        for future in (primary, hedge):
+            if future in done and future.exception() is None:
+                return future.result(), HedgeOutcome(hedged=True, won=future is hedge)
+        # The first to finish failed, so the other one decides
+        other = next(iter(pending), primary)
+        return other.result(), HedgeOutcome(hedged=True, won=other is hedge)
@@ -0,0 +1,361 @@
+"""
+In-process retrieval for tenants with few documents.
+
+embeddings-generator writes one chunk artifact per document to
+s3://DOCUMENT_BUCKET/<prefix>/<tenant_id>/<URL-encoded source key>.json,
+holding the chunk-sanitizer chunks with their Titan embeddings
+(little-endian float16, base64). kendra-custom-ingest deletes it when the
+document is deleted. A tenant's artifacts are loaded on first use and held
+in the warm container as BM25 postings plus a normalised NumPy embedding
+matrix. The index is rebuilt when the tenant's document generation changes.
+
+Small tenants are loaded on the request thread, since they are searched
+in-process on every request, once their artifacts cover every document
+the tracking table lists as indexed (IndexedDocumentCounts). Larger
+tenants, and tenants whose older documents predate the artifacts, are
+only needed while Kendra is unavailable, so their load is started in the
+background then.
+
+Search runs BM25 over the postings and cosine similarity over the matrix,
+and merges the two rankings with reciprocal rank fusion.
+
+Tenants are isolated by the artifact prefix (always ending in "/") and by
+the tenant_id recorded in each artifact, which must match.
+"""
+import base64
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from fusion import reciprocal_rank_fusion
+from rerank import tokenize
+from retrieval_hit import RetrievalHit
+
+logger = logging.getLogger()
+
+
+# Rough per-object Python overhead for the memory estimate: a posting's dict entry,
+# tuple and two array headers; a chunk's dict and string headers
+POSTING_OVERHEAD_BYTES = 300
+CHUNK_OVERHEAD_BYTES = 1000
+
+
+def decode_embedding(payload: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload), dtype='<f2').astype(np.float32)
+
+
+class LocalTenantIndex:
+    def __init__(self, tenant_id: str, generation: int, chunks: List[Dict[str, Any]],
+                 document_count: int, k1: float = 1.2, b: float = 0.75):
+        self.tenant_id = tenant_id
+        self.generation = generation
+        self.document_count = document_count
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+
+        # BM25 postings: term -> (chunk rows, term frequencies)
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            tokens = tokenize(chunk['text'])
+            lengths[row] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[row] = counts.get(row, 0) + 1
+        self.postings = {
+            term: (np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                   np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            for term, counts in postings.items()
+        }
+        self.length_norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()) if len(chunks) else 0.0, 1.0))
+
+        # Embedding matrix, L2-normalised so a dot product is the cosine similarity
+        embedded = [row for row, chunk in enumerate(chunks) if chunk.get('embedding') is not None]
+        self.embedded_rows = np.array(embedded, dtype=np.int32)
+        if embedded:
+            matrix = np.stack([chunks[row]['embedding'] for row in embedded])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.matrix = (matrix / np.maximum(norms, 1e-9)).astype(np.float32)
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        # The matrix holds the only copy of each embedding
+        for chunk in chunks:
+            chunk.pop('embedding', None)
+        self.nbytes = self._estimate_bytes()
+
+    def _estimate_bytes(self) -> int:
+        """Memory held by the index: arrays, postings and chunk text"""
+        arrays = self.matrix.nbytes + self.length_norm.nbytes + self.embedded_rows.nbytes
+        postings = sum(rows.nbytes + tf.nbytes + len(term) + POSTING_OVERHEAD_BYTES
+                       for term, (rows, tf) in self.postings.items())
+        text = sum(len(chunk['text']) + CHUNK_OVERHEAD_BYTES for chunk in self.chunks)
+        return arrays + postings + text
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def bm25(self, question: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in set(tokenize(question)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            idf = math.log1p((len(self.chunks) - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+    def similarities(self, embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        """Cosine similarity of every embedded chunk to the question, NaN for chunks without an embedding"""
+        if embedding is None or not len(self.embedded_rows):
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self.matrix.shape[1]:
+            logger.warning(f"Local index for tenant {self.tenant_id} has dimension {self.matrix.shape[1]}, "
+                           f"question embedding has {query.shape[0]}")
+            return None
+        query = query / max(float(np.linalg.norm(query)), 1e-9)
+        similarities = np.full(len(self.chunks), np.nan, dtype=np.float32)
+        similarities[self.embedded_rows] = self.matrix @ query
+        return similarities
+
+    def search(self, question: str, embedding: Optional[List[float]], limit: int,
+               to_hit: Callable[[Dict[str, Any], float, float], RetrievalHit], rrf_k: int = 60) -> List[RetrievalHit]:
+        """Top chunks by fused BM25 and vector rank; to_hit builds a hit from (chunk, bm25, similarity)"""
+        if not self.chunks:
+            return []
+        bm25 = self.bm25(question)
+        similarities = self.similarities(embedding)
+        candidates = limit * 2
+
+        def top(scores: np.ndarray, valid: np.ndarray) -> List[int]:
+            rows = np.flatnonzero(valid)
+            if len(rows) > candidates:
+                rows = rows[np.argpartition(-scores[rows], candidates - 1)[:candidates]]
+            return rows[np.argsort(-scores[rows], kind='stable')].tolist()
+
+        ranked = [top(bm25, bm25 > 0)]
+        if similarities is not None:
+            ranked.append(top(similarities, ~np.isnan(similarities)))
+
+        # Fuse on row numbers, then build hits only for the rows returned
+        rows = reciprocal_rank_fusion(ranked, k=rrf_k, limit=limit, key=lambda row: row)
+        return [
+            to_hit(self.chunks[row], float(bm25[row]),
+                   float(similarities[row]) if similarities is not None else math.nan)
+            for row in rows
+        ]
+
+
+class LocalIndexStore:
+    """
+    Per-container cache of tenant indexes, loaded from S3 chunk artifacts.
+
+    Entries are keyed on the tenant's document generation and never reloaded
+    within it. The artifact listing (document count and bytes) is remembered
+    per generation too, so a tenant that is too large, or has no artifacts,
+    is not listed again on every request. Loaded indexes are evicted least
+    recently used first to stay within max_bytes.
+    """
+
+    def __init__(self, s3_client: Any, bucket: str, prefix: str = 'local-index',
+                 max_documents: int = 500, max_bytes: int = 256 * 1024 * 1024,
+                 executor: Optional[Executor] = None):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='local-index')
+        self._indexes: 'OrderedDict[str, LocalTenantIndex]' = OrderedDict()
+        # tenant -> (generation, document count or None if over max_documents, artifact bytes)
+        self._listings: Dict[str, Tuple[int, Optional[int], int]] = {}
+        self._background: Dict[str, Tuple[int, Future]] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def valid_tenant(tenant_id: str) -> bool:
+        return bool(tenant_id) and tenant_id != 'ALL' and '/' not in tenant_id
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(index.nbytes for index in self._indexes.values())
+
+    def _artifact_keys(self, tenant_id: str) -> Optional[List[Tuple[str, int]]]:
+        """(key, size) of the tenant's artifacts, or None if there are more than max_documents"""
+        keys = []
+        params = {'Bucket': self.bucket, 'Prefix': f"{self.prefix}/{tenant_id}/"}
+        while True:
+            response = self.s3.list_objects_v2(**params)
+            keys += [(obj['Key'], obj.get('Size', 0)) for obj in response.get('Contents', [])
+                     if obj['Key'].endswith('.json')]
+            if len(keys) > self.max_documents:
+                return None
+            if not response.get('IsTruncated'):
+                return keys
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    def _load(self, tenant_id: str, generation: int, keys: List[str]) -> LocalTenantIndex:
+        start = time.perf_counter()
+        chunks = []
+        for key in keys:
+            artifact = json.loads(self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+            if artifact.get('tenant_id') != tenant_id:
+                logger.error(f"Skipping chunk artifact {key}: recorded tenant does not match {tenant_id}")
+                continue
+            for chunk in artifact.get('chunks', []):
+                chunks.append({
+                    'document_id': artifact['document_id'],
+                    'title': artifact.get('title') or artifact['document_id'],
+                    'source_key': artifact.get('source_key'),
+                    'text': chunk['text'],
+                    'page_number': chunk.get('page_number'),
+                    'embedding': decode_embedding(chunk['embedding']) if chunk.get('embedding') else None
+                })
+
+        index = LocalTenantIndex(tenant_id, generation, chunks, document_count=len(keys))
+        logger.info(f"Loaded local index for tenant {tenant_id}: {len(keys)} documents, {len(chunks)} chunks, "
+                    f"~{index.nbytes} bytes in {int((time.perf_counter() - start) * 1000)}ms")
+        return index
+
+    def _store(self, tenant_id: str, index: LocalTenantIndex) -> None:
+        """Cache the index, evicting least recently used tenants until it fits in max_bytes"""
+        with self._lock:
+            self._indexes.pop(tenant_id, None)
+            used = sum(cached.nbytes for cached in self._indexes.values())
+            while self._indexes and used + index.nbytes > self.max_bytes:
+                _, evicted = self._indexes.popitem(last=False)
+                used -= evicted.nbytes
+            self._indexes[tenant_id] = index
+
+    def cached(self, tenant_id: str, generation: int) -> Optional[LocalTenantIndex]:
+        """The tenant's index if it is already loaded for this generation, without any S3 calls"""
+        with self._lock:
+            index = self._indexes.get(tenant_id)
+            if index is None or index.generation != generation:
+                return None
+            self._indexes.move_to_end(tenant_id)
+            return index
+
+    def get(self, tenant_id: str, generation: int, max_documents: Optional[int] = None) -> Optional[LocalTenantIndex]:
+        """
+        The tenant's index for this generation, loading it on this thread if
+        it has at most max_documents documents; None if it has none or more.
+        """
+        if not self.valid_tenant(tenant_id):
+            return None
+        limit = self.max_documents if max_documents is None else min(max_documents, self.max_documents)
+
+        def known_unavailable() -> bool:
+            with self._lock:
+                listing = self._listings.get(tenant_id)
+            return (listing is not None and listing[0] == generation
+                    and (listing[1] is None or listing[1] == 0 or listing[1] > limit or listing[2] > self.max_bytes))
+
+        index = self.cached(tenant_id, generation)
+        if index is not None or known_unavailable():
+            return index
+
+        with self._lock:
+            loading = self._loading.setdefault(tenant_id, threading.Lock())
+        # One load per tenant at a time; concurrent requests wait for it
+        with loading:
+            index = self.cached(tenant_id, generation)
+            if index is not None or known_unavailable():
+                return index
+            try:
+                keys = self._artifact_keys(tenant_id)
+                size = sum(key_size for _, key_size in keys or ())
+                with self._lock:
+                    self._listings[tenant_id] = (generation, None if keys is None else len(keys), size)
+                if keys is None or not keys or len(keys) > limit or size > self.max_bytes:
+                    logger.info(f"No local index for tenant {tenant_id} "
+                                f"({'no chunk artifacts' if keys == [] else 'over the document or byte limit'})")
+                    return None
+                index = self._load(tenant_id, generation, [key for key, _ in keys])
+            except Exception as e:
+                logger.warning(f"Local index load failed for tenant {tenant_id}: {str(e)}")
+                # Not retried until the generation changes; Kendra serves the tenant meanwhile
+                with self._lock:
+                    self._listings[tenant_id] = (generation, None, 0)
+                return None
+            if index.nbytes > self.max_bytes:
+                logger.warning(f"Local index for tenant {tenant_id} is ~{index.nbytes} bytes, "
+                               f"over the {self.max_bytes}-byte limit")
+                with self._lock:
+                    self._listings[tenant_id] = (generation, None, index.nbytes)
+                return None
+            self._store(tenant_id, index)
+        return index
+
+    def load_in_background(self, tenant_id: str, generation: int) -> Future:
+        """Start loading the tenant's index off the request thread; concurrent calls share one load"""
+        with self._lock:
+            running = self._background.get(tenant_id)
+            if running and running[0] == generation and not running[1].done():
+                return running[1]
+            future = self.executor.submit(self.get, tenant_id, generation)
+            self._background[tenant_id] = (generation, future)
+        return future
+
+
+class IndexedDocumentCounts:
+    """
+    Counts each tenant's Kendra-indexed documents in the document tracking
+    table, once per document generation. Chunk artifacts only exist for
+    documents embedded since the local index shipped, so a tenant is only
+    served from its local index when the artifacts cover this count.
+    """
+
+    def __init__(self, table_name: Optional[str] = None, dynamodb_client: Any = None,
+                 index_name: str = 'tenant-index'):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.index_name = index_name
+        self._counts: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str, generation: int) -> Optional[int]:
+        """The tenant's indexed document count at this generation, or None if it cannot be determined"""
+        if not self.table_name or not self.dynamodb:
+            return None
+
+        with self._lock:
+            cached = self._counts.get(tenant_id)
+        if cached and cached[0] == generation:
+            return cached[1]
+
+        count = 0
+        params = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': 'tenant_id = :tenant',
+            'FilterExpression': '#status = :indexed',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':tenant': {'S': tenant_id}, ':indexed': {'S': 'indexed'}},
+            'Select': 'COUNT'
+        }
+        try:
+            while True:
+                response = self.dynamodb.query(**params)
+                count += response.get('Count', 0)
+                if 'LastEvaluatedKey' not in response:
+                    break
+                params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            logger.warning(f"Failed to count indexed documents for tenant {tenant_id}: {str(e)}")
+            return None
+
+        with self._lock:
+            self._counts[tenant_id] = (generation, count)
+        return count
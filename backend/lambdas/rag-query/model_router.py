@@ -0,0 +1,119 @@
+"""
+Category-aware routing of generation requests to Bedrock models.
+
+Each question gets a complexity score from its category (prompts.py),
+length, the number of distinct documents in its context and the
+requested answer style. The score selects a tier from the routing table,
+and each tier names a model and an output-token cap.
+
+By default every tier uses the engine's BEDROCK_MODEL_ID and the tiers
+differ only in output-token cap, so routing never moves a question to a
+pricier model. Upgrading a tier to another model is opt-in: replace the
+table through MODEL_ROUTING_TABLE (JSON with the same shape as
+DEFAULT_ROUTING_TABLE) and grant the Lambda role access to that model.
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, List, Optional
+
+from prompts import categorize_question
+
+logger = logging.getLogger()
+
+DEFAULT_ROUTING_TABLE: Dict[str, Any] = {
+    'tiers': {
+        # None uses the engine's BEDROCK_MODEL_ID
+        'fast': {'model_id': None, 'max_tokens': 400},
+        'standard': {'model_id': None, 'max_tokens': 1000},
+        'large': {'model_id': None, 'max_tokens': 1500}
+    },
+    # Baseline complexity per prompts.py category
+    'categories': {
+        'by_laws': 0,
+        'meetings': 0,
+        'finance': 1,
+        'maintenance': 1,
+        'governance': 1,
+        'disputes': 2,
+        'general': 1
+    },
+    'styles': {'simple': -1, 'professional': 0, 'detailed': 2},
+    'long_question_words': 25,
+    'multi_document_threshold': 3,
+    # Score <= fast_max uses 'fast', score >= large_min uses 'large', otherwise 'standard'
+    'fast_max': 0,
+    'large_min': 3
+}
+
+# Phrasing that asks for reasoning across sources rather than a lookup
+_COMPARATIVE = re.compile(r"\b(compare|comparison|difference|versus|vs|explain why|pros and cons|implications)\b")
+
+
+@dataclass
+class RoutingDecision:
+    tier: str
+    model_id: str
+    max_tokens: int
+    category: str
+    complexity: int
+    signals: List[str]
+
+    def to_metrics(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def load_routing_table(raw: Optional[str]) -> Dict[str, Any]:
+    """Parse a JSON routing table, falling back to the defaults if it is missing or invalid"""
+    if not raw:
+        return DEFAULT_ROUTING_TABLE
+    try:
+        table = json.loads(raw)
+        missing = {'fast', 'standard', 'large'} - set(table.get('tiers', {}))
+        if missing:
+            raise ValueError(f"missing tiers {sorted(missing)}")
+        return {**DEFAULT_ROUTING_TABLE, **table}
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid MODEL_ROUTING_TABLE, using defaults: {str(e)}")
+        return DEFAULT_ROUTING_TABLE
+
+
+class ModelRouter:
+    def __init__(self, default_model_id: str, table: Optional[Dict[str, Any]] = None):
+        self.default_model_id = default_model_id
+        self.table = table or DEFAULT_ROUTING_TABLE
+
+    def route(self, question: str, answer_style: str, document_count: int) -> RoutingDecision:
+        table = self.table
+        category = categorize_question(question)
+        complexity = table['categories'].get(category, 1)
+        signals = [f"category:{category}"]
+
+        style_weight = table['styles'].get(answer_style, 0)
+        if style_weight:
+            complexity += style_weight
+            signals.append(f"style:{answer_style}")
+
+        if len(question.split()) > table['long_question_words']:
+            complexity += 1
+            signals.append('long_question')
+
+        if question.count('?') > 1 or _COMPARATIVE.search(question.lower()):
+            complexity += 1
+            signals.append('multi_part')
+
+        if document_count >= table['multi_document_threshold']:
+            complexity += 1
+            signals.append('multi_document')
+
+        if complexity <= table['fast_max']:
+            tier = 'fast'
+        elif complexity >= table['large_min']:
+            tier = 'large'
+        else:
+            tier = 'standard'
+
+        settings = table['tiers'][tier]
+        return RoutingDecision(tier, settings.get('model_id') or self.default_model_id, int(settings['max_tokens']),
+                               category, complexity, signals)
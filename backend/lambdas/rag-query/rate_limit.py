@@ -0,0 +1,70 @@
+"""
+Client-side rate limiting for calls made from inside one container
+"""
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """Thread-safe token bucket: `rate` permits per second with bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a permit if one is available; otherwise return the seconds until one will be"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Block until a permit is available; return the seconds waited, or -1 on timeout"""
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return time.monotonic() - start
+            if timeout is not None and time.monotonic() - start + wait > timeout:
+                return -1.0
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Rate limiter that backs off when the service throttles us.
+
+    Each throttle halves the rate, down to min_rate. Each success adds
+    increase_step back, up to max_rate (additive increase, multiplicative
+    decrease), so concurrent containers converge on what the service allows.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = 0.5, increase_step: float = 0.1,
+                 burst: Optional[float] = None):
+        super().__init__(max_rate, burst)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop banked burst so the lower rate applies immediately
+            self._tokens = min(self._tokens, 1.0)
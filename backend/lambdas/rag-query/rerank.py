@@ -0,0 +1,94 @@
+"""
+In-process reranking of retrieval candidates.
+
+Retrieval is run wider than the number of excerpts we send to Bedrock and
+the candidates are rescored here on CPU before citations are extracted.
+The score blends three signals, each scaled to [0, 1]:
+
+- BM25 of the question against the excerpt text (vectorised with NumPy)
+- cosine similarity to the question, when the backend already computed
+  one (k-NN hits); candidates without a similarity are scored on the
+  remaining signals only
+- the backend's own confidence, so the original ranking still counts
+"""
+import re
+from typing import List, Optional
+
+import numpy as np
+
+from retrieval_hit import RetrievalHit
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in is it its
+my of on or our should that the their there this to was we what when where
+which who why will with you your
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class Reranker:
+    def __init__(self, bm25_weight: float = 0.6, vector_weight: float = 0.3,
+                 prior_weight: float = 0.1, k1: float = 1.2, b: float = 0.75):
+        self.weights = np.array([bm25_weight, vector_weight, prior_weight], dtype=np.float32)
+        self.k1 = k1
+        self.b = b
+
+    def bm25(self, question: str, texts: List[str]) -> np.ndarray:
+        """BM25 of the question against each text, with IDF taken over the candidate set"""
+        terms = sorted(set(tokenize(question)))
+        if not terms or not texts:
+            return np.zeros(len(texts), dtype=np.float32)
+
+        term_index = {term: i for i, term in enumerate(terms)}
+        tf = np.zeros((len(texts), len(terms)), dtype=np.float32)
+        lengths = np.empty(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                col = term_index.get(token)
+                if col is not None:
+                    tf[row, col] += 1
+
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        avg_length = max(float(lengths.mean()), 1.0)
+        norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+        return (tf * (self.k1 + 1) / (tf + norm[:, None])) @ idf
+
+    def score(self, question: str, texts: List[str], similarities: np.ndarray,
+              priors: np.ndarray) -> np.ndarray:
+        """Blend BM25, vector similarity (NaN where unknown) and backend prior"""
+        bm25 = self.bm25(question, texts)
+        top = bm25.max() if len(bm25) else 0.0
+        if top > 0:
+            bm25 = bm25 / top
+
+        signals = np.stack([bm25, np.clip(np.nan_to_num(similarities), 0.0, 1.0), priors], axis=1)
+        available = np.ones_like(signals)
+        available[:, 1] = ~np.isnan(similarities)
+
+        # Renormalise per row so missing similarities are not treated as zero
+        weights = available * self.weights
+        return (signals * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+    def rerank(self, question: str, results: List[RetrievalHit],
+               limit: Optional[int] = None) -> List[RetrievalHit]:
+        """Reorder retrieval hits by blended score"""
+        if len(results) < 2:
+            return results[:limit] if limit else results
+
+        texts = [f"{r.title} {r.excerpt}" for r in results]
+        similarities = np.array([r.similarity for r in results], dtype=np.float32)
+        priors = np.array([r.confidence_score for r in results], dtype=np.float32)
+
+        scores = self.score(question, texts, similarities, priors)
+        # Stable sort keeps backend order for ties
+        order = np.argsort(-scores, kind='stable')
+        if limit:
+            order = order[:limit]
+        return [results[i] for i in order]
@@ -0,0 +1,109 @@
+"""
+Exact-match retrieval cache for the RAG query Lambda.
+
+Search results are cached per container on (tenant, generation, normalised
+question, max_results). The generation is a per-tenant counter that the
+ingestion Lambda bumps whenever a tenant's documents are added or removed,
+so a changed document set makes every older entry for that tenant
+unreachable without having to enumerate or invalidate keys.
+
+Entries past their TTL are kept until evicted and can still be served by
+get_stale while Kendra is throttling.
+"""
+import logging
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from answer_cache import normalize_question
+from retrieval_hit import RetrievalHit
+
+logger = logging.getLogger()
+
+
+class TenantGenerations:
+    """Reads per-tenant document generations, re-checking DynamoDB at most every refresh_seconds"""
+
+    def __init__(self, table_name: Optional[str] = None, dynamodb_client: Any = None,
+                 refresh_seconds: float = 10):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client
+        self.refresh_seconds = refresh_seconds
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str) -> Optional[int]:
+        """Return the tenant's current generation, or None if it cannot be determined"""
+        if not self.table_name or not self.dynamodb:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._generations.get(tenant_id)
+        if cached and now - cached[1] < self.refresh_seconds:
+            return cached[0]
+
+        try:
+            response = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'tenant_id': {'S': tenant_id}},
+                ProjectionExpression='generation'
+            )
+        except Exception as e:
+            logger.warning(f"Failed to read generation for tenant {tenant_id}: {str(e)}")
+            return None
+
+        generation = int(response.get('Item', {}).get('generation', {}).get('N', '0'))
+        with self._lock:
+            self._generations[tenant_id] = (generation, now)
+        return generation
+
+
+class RetrievalCache:
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[str, int, str, int], Tuple[List[RetrievalHit], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tenant_id: str, generation: int, question: str, max_results: int) -> Tuple[str, int, str, int]:
+        return (tenant_id, generation, normalize_question(question), max_results)
+
+    def get(self, tenant_id: str, generation: int, question: str,
+            max_results: int) -> Optional[List[RetrievalHit]]:
+        key = self.key(tenant_id, generation, question, max_results)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            results, expires_at = entry
+            # Expired entries stay until evicted so get_stale can still serve them
+            if expires_at <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return list(results)
+
+    def get_stale(self, tenant_id: str, question: str, max_results: int) -> Optional[List[RetrievalHit]]:
+        """Return the newest entry for the question ignoring TTL and generation, for use when the backend is unavailable"""
+        normalized = normalize_question(question)
+        with self._lock:
+            for key in reversed(self._entries):
+                if key[0] == tenant_id and key[2] == normalized and key[3] == max_results:
+                    return list(self._entries[key][0])
+        return None
+
+    def put(self, tenant_id: str, generation: int, question: str,
+            max_results: int, results: List[RetrievalHit]) -> None:
+        key = self.key(tenant_id, generation, question, max_results)
+        with self._lock:
+            # Entries from older generations can never be hit again
+            stale = [k for k in self._entries if k[0] == tenant_id and k[1] != generation]
+            for stale_key in stale:
+                del self._entries[stale_key]
+
+            self._entries[key] = (list(results), time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,91 @@
+"""
+Normalised retrieval result shared by every search backend.
+
+Kendra result items and OpenSearch hits are converted once, where the
+backend returns them, into RetrievalHit objects. Fusion, reranking,
+citation extraction and the Kendra answer shortcut then read plain
+attributes instead of walking nested response dicts on every pass.
+"""
+import math
+from typing import Any, Dict, List, Optional
+
+KENDRA_ANSWER_TYPES = ('ANSWER', 'QUESTION_ANSWER')
+
+CONFIDENCE_SCORES = {'LOW': 0.3, 'MEDIUM': 0.6, 'HIGH': 0.8, 'VERY_HIGH': 0.95}
+
+
+class RetrievalHit:
+    __slots__ = ('document_id', 'title', 'excerpt', 'confidence', 'similarity', 'page_number',
+                 's3_uri', 'result_type', 'answer_text', 'answer_highlights')
+
+    def __init__(self, document_id: str, title: str, excerpt: str, confidence: str = 'MEDIUM',
+                 similarity: float = math.nan, page_number: Optional[int] = None,
+                 s3_uri: Optional[str] = None, result_type: str = 'DOCUMENT',
+                 answer_text: str = '', answer_highlights: Optional[List[Dict[str, Any]]] = None):
+        self.document_id = document_id
+        self.title = title
+        self.excerpt = excerpt
+        # Kendra-style confidence bucket: LOW, MEDIUM, HIGH or VERY_HIGH
+        self.confidence = confidence
+        # Question/passage cosine similarity, NaN when the backend did not compute one
+        self.similarity = similarity
+        self.page_number = page_number
+        self.s3_uri = s3_uri
+        self.result_type = result_type
+        self.answer_text = answer_text
+        self.answer_highlights = answer_highlights or []
+
+    @classmethod
+    def from_kendra(cls, item: Dict[str, Any]) -> 'RetrievalHit':
+        """Convert a Kendra Query ResultItem, reading each attribute list once"""
+        s3_uri = None
+        page_number = None
+        for attr in item.get('DocumentAttributes', ()):
+            key = attr.get('Key')
+            if key == '_source_uri':
+                s3_uri = attr.get('Value', {}).get('StringValue')
+            elif key == 'page_number':
+                page_number = int(attr.get('Value', {}).get('LongValue', 0))
+
+        result_type = item.get('Type', 'DOCUMENT')
+        answer_text, highlights = '', []
+        if result_type in KENDRA_ANSWER_TYPES:
+            for attr in item.get('AdditionalAttributes', ()):
+                if attr.get('Key') == 'AnswerText':
+                    value = attr.get('Value', {}).get('TextWithHighlightsValue', {})
+                    answer_text, highlights = value.get('Text', ''), value.get('Highlights', [])
+                    break
+            # Answers often come from FAQ sources without our _source_uri attribute
+            s3_uri = s3_uri or item.get('DocumentURI')
+
+        return cls(
+            document_id=item.get('DocumentId', ''),
+            title=item.get('DocumentTitle', {}).get('Text', 'Untitled Document'),
+            excerpt=item.get('DocumentExcerpt', {}).get('Text', ''),
+            confidence=item.get('ScoreAttributes', {}).get('ScoreConfidence', 'MEDIUM'),
+            page_number=page_number,
+            s3_uri=s3_uri,
+            result_type=result_type,
+            answer_text=answer_text,
+            answer_highlights=highlights
+        )
+
+    @property
+    def is_answer(self) -> bool:
+        return self.result_type in KENDRA_ANSWER_TYPES
+
+    @property
+    def confidence_score(self) -> float:
+        return CONFIDENCE_SCORES.get(self.confidence, 0.5)
+
+    @property
+    def source_key(self) -> str:
+        """The document's S3 object key, shared by every backend; the document id when no S3 location is known"""
+        # Kendra ids are s3:// URIs, the ingestion pipeline's ids are its own
+        for uri in (self.s3_uri, self.document_id):
+            if uri and uri.startswith('s3://'):
+                return uri[len('s3://'):].partition('/')[2]
+        return self.document_id
+
+    def __repr__(self) -> str:
+        return f"RetrievalHit({self.document_id!r}, {self.result_type}, {self.confidence})"
@@ -0,0 +1,64 @@
+"""
+Per-stage latency timing for the query pipeline.
+
+Stage durations are emitted as CloudWatch Embedded Metric Format (EMF)
+log lines, one per stage, so they can be dimensioned by stage and search
+backend without the Powertools layer (whose metrics share a single
+dimension set per invocation).
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+NAMESPACE = os.environ.get('POWERTOOLS_METRICS_NAMESPACE', 'StrataGPT/RAG')
+
+
+class StageTimer:
+    def __init__(self):
+        self.durations_ms: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter_ns() - start) / 1e6
+            self.durations_ms[name] = self.durations_ms.get(name, 0.0) + elapsed
+
+    def breakdown(self) -> Dict[str, float]:
+        return {name: round(ms, 3) for name, ms in self.durations_ms.items()}
+
+
+def tokens_per_second(tokens: int, duration_ms: Optional[float]) -> float:
+    if not tokens or not duration_ms:
+        return 0.0
+    return round(tokens / (duration_ms / 1000), 1)
+
+
+def emit_stage_metrics(durations_ms: Dict[str, float], backend: str,
+                       throughput: Optional[Dict[str, float]] = None) -> None:
+    """Print one EMF record per stage, plus generation throughput if given"""
+    timestamp = int(time.time() * 1000)
+    for stage, duration in durations_ms.items():
+        record = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['stage', 'backend'], ['stage']],
+                    'Metrics': [{'Name': 'StageLatency', 'Unit': 'Milliseconds'}]
+                }]
+            },
+            'stage': stage,
+            'backend': backend,
+            'StageLatency': round(duration, 3)
+        }
+        if stage == 'generate' and throughput:
+            record['_aws']['CloudWatchMetrics'][0]['Metrics'] += [
+                {'Name': name, 'Unit': 'Count/Second'} for name in throughput
+            ]
+            record.update(throughput)
+        print(json.dumps(record))
@@ -0,0 +1,281 @@
+"""
+Per-tenant vector snapshots for brute-force search without OpenSearch.
+
+The export action writes each tenant's chunk embeddings to S3 as two
+objects under <prefix>/<tenant_id>/:
+
+  g<generation>.f16   row-major little-endian float16 matrix, one
+                      L2-normalised row per chunk
+  snapshot.json       sidecar with the tenant, generation, shape and the
+                      chunk metadata, stored column-wise
+
+The matrix is uploaded before the sidecar, so a sidecar never points at a
+matrix that is not there yet.
+
+rag-query reads the sidecar, and uses the snapshot only if it was exported
+at the tenant's current document generation. The matrix is then
+downloaded to /tmp once per container and opened with np.memmap, so the
+pages are read from disk as the search touches them. Search is a blocked
+dot product against the question embedding, which is the exact cosine
+similarity up to float16 rounding.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+SIDECAR_NAME = 'snapshot.json'
+SNAPSHOT_FORMAT = 1
+
+# Rows converted to float32 per step of the search
+SEARCH_BLOCK_ROWS = 8192
+
+
+def encode_matrix(embeddings: List[List[float]]) -> np.ndarray:
+    """L2-normalised float16 rows, so a dot product with a unit query is the cosine similarity"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.maximum(norms, 1e-9)).astype('<f2')
+
+
+def build_sidecar(tenant_id: str, generation: int, chunks: List[Dict[str, Any]], dimension: int,
+                  matrix_key: str) -> Dict[str, Any]:
+    """Column-wise chunk metadata; titles and source keys are stored once per document"""
+    documents: 'OrderedDict[str, int]' = OrderedDict()
+    document_info: List[Dict[str, Any]] = []
+    columns: Dict[str, List[Any]] = {'chunk_id': [], 'document': [], 'page_number': [], 'text': []}
+    for chunk in chunks:
+        if chunk['document_id'] not in documents:
+            documents[chunk['document_id']] = len(document_info)
+            document_info.append({
+                'document_id': chunk['document_id'],
+                'title': chunk.get('title'),
+                'source_key': chunk.get('source_key')
+            })
+        columns['chunk_id'].append(chunk['chunk_id'])
+        columns['document'].append(documents[chunk['document_id']])
+        columns['page_number'].append(chunk.get('page_number'))
+        columns['text'].append(chunk['text'])
+
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'tenant_id': tenant_id,
+        'generation': generation,
+        'rows': len(chunks),
+        'dimension': dimension,
+        'dtype': '<f2',
+        'matrix_key': matrix_key,
+        'exported_at': int(time.time()),
+        'documents': document_info,
+        'chunks': columns
+    }
+
+
+def write_snapshot(s3_client: Any, bucket: str, prefix: str, tenant_id: str, generation: int,
+                   chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Upload the tenant's matrix and then its sidecar; chunks carry an 'embedding' list each"""
+    matrix = encode_matrix([chunk['embedding'] for chunk in chunks])
+    matrix_key = f"{prefix}/{tenant_id}/g{generation}.f16"
+    sidecar = build_sidecar(tenant_id, generation, chunks, matrix.shape[1], matrix_key)
+
+    s3_client.put_object(Bucket=bucket, Key=matrix_key, Body=matrix.tobytes(),
+                         ContentType='application/octet-stream')
+    s3_client.put_object(Bucket=bucket, Key=f"{prefix}/{tenant_id}/{SIDECAR_NAME}",
+                         Body=json.dumps(sidecar, separators=(',', ':')), ContentType='application/json')
+    summary = {key: sidecar[key] for key in ('tenant_id', 'generation', 'rows', 'dimension', 'matrix_key')}
+    summary['matrix_bytes'] = matrix.nbytes
+    return summary
+
+
+class VectorSnapshot:
+    def __init__(self, sidecar: Dict[str, Any], path: str):
+        self.tenant_id = sidecar['tenant_id']
+        self.generation = sidecar['generation']
+        self.path = path
+        self.documents = sidecar['documents']
+        self.chunks = sidecar['chunks']
+        self.matrix = np.memmap(path, dtype=sidecar['dtype'], mode='r',
+                                shape=(sidecar['rows'], sidecar['dimension']))
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def search(self, embedding: List[float], limit: int) -> List[Tuple[int, float]]:
+        """(row, cosine similarity) of the closest chunks, best first"""
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self.matrix.shape[1]:
+            logger.warning(f"Vector snapshot for tenant {self.tenant_id} has dimension {self.matrix.shape[1]}, "
+                           f"question embedding has {query.shape[0]}")
+            return []
+        query = query / max(float(np.linalg.norm(query)), 1e-9)
+
+        # float16 matmul has no BLAS path, so widen one block at a time
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = self.matrix[start:start + SEARCH_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+
+        limit = min(limit, len(self))
+        if limit <= 0:
+            return []
+        rows = np.argpartition(-scores, limit - 1)[:limit] if limit < len(self) else np.arange(len(self))
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def chunk(self, row: int) -> Dict[str, Any]:
+        document = self.documents[self.chunks['document'][row]]
+        return {
+            'chunk_id': self.chunks['chunk_id'][row],
+            'document_id': document['document_id'],
+            'title': document.get('title') or document['document_id'],
+            'source_key': document.get('source_key'),
+            'page_number': self.chunks['page_number'][row],
+            'text': self.chunks['text'][row]
+        }
+
+
+class VectorSnapshotStore:
+    """Per-container cache of tenant snapshots, downloaded to local disk and memory-mapped"""
+
+    def __init__(self, s3_client: Any, bucket: str, prefix: str = 'vector-snapshots',
+                 directory: str = '/tmp/vector-snapshots', max_bytes: int = 512 * 1024 * 1024,
+                 refresh_seconds: float = 300):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.refresh_seconds = refresh_seconds
+        # None records a tenant with no usable snapshot at that generation
+        self._snapshots: 'OrderedDict[str, Tuple[int, float, Optional[VectorSnapshot]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def valid_tenant(tenant_id: str) -> bool:
+        return bool(tenant_id) and tenant_id != 'ALL' and '/' not in tenant_id
+
+    def _download(self, key: str, path: str, expected_bytes: int) -> None:
+        """Stream the matrix to a temporary file and move it into place"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body']
+        try:
+            with open(partial, 'wb') as f:
+                for block in iter(lambda: body.read(1024 * 1024), b''):
+                    f.write(block)
+            if os.path.getsize(partial) != expected_bytes:
+                raise ValueError(f"{key} is {os.path.getsize(partial)} bytes, expected {expected_bytes}")
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _evict(self, needed: int) -> None:
+        """Drop least recently used snapshots until needed more bytes fit on disk"""
+        with self._lock:
+            used = sum(entry[2].nbytes for entry in self._snapshots.values() if entry[2] is not None)
+            for tenant_id in list(self._snapshots):
+                if used + needed <= self.max_bytes:
+                    break
+                snapshot = self._snapshots[tenant_id][2]
+                if snapshot is None:
+                    continue
+                del self._snapshots[tenant_id]
+                used -= snapshot.nbytes
+                try:
+                    os.remove(snapshot.path)
+                except OSError:
+                    pass
+
+    def _load(self, tenant_id: str, generation: int) -> Optional[VectorSnapshot]:
+        start = time.perf_counter()
+        try:
+            sidecar = json.loads(self.s3.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}/{tenant_id}/{SIDECAR_NAME}"
+            )['Body'].read())
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                logger.info(f"No vector snapshot for tenant {tenant_id}")
+                return None
+            raise
+
+        if sidecar.get('tenant_id') != tenant_id or sidecar.get('format') != SNAPSHOT_FORMAT:
+            logger.error(f"Ignoring vector snapshot for tenant {tenant_id}: "
+                         f"recorded tenant {sidecar.get('tenant_id')}, format {sidecar.get('format')}")
+            return None
+        if sidecar.get('generation') != generation:
+            logger.info(f"Vector snapshot for tenant {tenant_id} is at generation {sidecar.get('generation')}, "
+                        f"tenant is at {generation}")
+            return None
+
+        matrix_bytes = sidecar['rows'] * sidecar['dimension'] * np.dtype(sidecar['dtype']).itemsize
+        if matrix_bytes > self.max_bytes:
+            logger.warning(f"Vector snapshot for tenant {tenant_id} is {matrix_bytes} bytes, "
+                           f"over the {self.max_bytes}-byte limit")
+            return None
+
+        path = os.path.join(self.directory, tenant_id, f"g{generation}.f16")
+        downloaded = False
+        if not os.path.exists(path) or os.path.getsize(path) != matrix_bytes:
+            self._evict(matrix_bytes)
+            self._download(sidecar['matrix_key'], path, matrix_bytes)
+            downloaded = True
+
+        snapshot = VectorSnapshot(sidecar, path)
+        logger.info(f"{'Downloaded' if downloaded else 'Reopened'} vector snapshot for tenant {tenant_id}: "
+                    f"{len(snapshot)} chunks, {matrix_bytes} bytes in {int((time.perf_counter() - start) * 1000)}ms")
+        return snapshot
+
+    def get(self, tenant_id: str, generation: int) -> Optional[VectorSnapshot]:
+        """The tenant's snapshot for this generation, downloading it if needed; None if there is none"""
+        if not self.valid_tenant(tenant_id):
+            return None
+
+        with self._lock:
+            entry = self._snapshots.get(tenant_id)
+            if entry:
+                self._snapshots.move_to_end(tenant_id)
+            loading = self._loading.setdefault(tenant_id, threading.Lock())
+        if self._current(entry, generation):
+            return entry[2]
+
+        # One download per tenant at a time; concurrent requests wait for it
+        with loading:
+            with self._lock:
+                entry = self._snapshots.get(tenant_id)
+            if self._current(entry, generation):
+                return entry[2]
+            try:
+                snapshot = self._load(tenant_id, generation)
+            except Exception as e:
+                logger.warning(f"Vector snapshot load failed for tenant {tenant_id}: {str(e)}")
+                snapshot = None
+            with self._lock:
+                previous = self._snapshots.get(tenant_id)
+                self._snapshots[tenant_id] = (generation, time.monotonic(), snapshot)
+                self._snapshots.move_to_end(tenant_id)
+            # The superseded generation's file is no longer needed
+            if previous and previous[2] is not None and (snapshot is None or previous[2].path != snapshot.path):
+                try:
+                    os.remove(previous[2].path)
+                except OSError:
+                    pass
+        return snapshot
+
+    def _current(self, entry: Optional[Tuple[int, float, Optional[VectorSnapshot]]], generation: int) -> bool:
+        """A loaded snapshot is valid for its whole generation; a miss is re-checked after refresh_seconds"""
+        if not entry or entry[0] != generation:
+            return False
+        return entry[2] is not None or time.monotonic() - entry[1] < self.refresh_seconds
@@ -90,6 +90,8 @@ const apiStack = new ApiStack(app, `${stackPrefix}-API-${environment}`, {
   env,
   kendraIndexId: ragStack.kendraIndexId,
   ragQueryFunctionArn: ragStack.ragQueryFunction.functionArn,
+  admissionTable: ragStack.admissionTable,
+  commonLayer: ragStack.commonLayer,
   userPool: authStack.userPool,
   description: 'Chat API endpoints'
 });
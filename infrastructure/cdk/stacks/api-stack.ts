@@ -11,6 +11,8 @@ import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
 interface ApiStackProps extends cdk.StackProps {
   kendraIndexId: string;
   ragQueryFunctionArn: string;
+  admissionTable: dynamodb.ITable;
+  commonLayer: lambda.ILayerVersion;
   userPool?: cognito.IUserPool;
 }
 
@@ -64,11 +66,16 @@ export class ApiStack extends cdk.Stack {
       handler: 'handler',
       timeout: cdk.Duration.seconds(300),
       memorySize: 1769,  // Optimal for CPU-bound tasks (1 vCPU threshold)
+      layers: [props.commonLayer],
       environment: {
         KENDRA_INDEX_ID: props.kendraIndexId,
         CONVERSATIONS_TABLE: this.conversationsTable.tableName,
         MESSAGES_TABLE: this.messagesTable.tableName,
         RAG_FUNCTION_ARN: props.ragQueryFunctionArn,
+        ADMISSION_TABLE: props.admissionTable.tableName,
+        ADMISSION_RATE: '1',
+        ADMISSION_BURST: '10',
+        POWERTOOLS_METRICS_NAMESPACE: 'StrataGPT/RAG',
       },
       logRetention: logs.RetentionDays.ONE_WEEK,
     });
@@ -76,6 +83,7 @@ export class ApiStack extends cdk.Stack {
     // Grant permissions
     this.conversationsTable.grantReadWriteData(chatResolverFunction);
     this.messagesTable.grantReadWriteData(chatResolverFunction);
+    props.admissionTable.grantReadWriteData(chatResolverFunction);
 
     // Grant permission to invoke RAG query function
     chatResolverFunction.addToRolePolicy(new iam.PolicyStatement({
@@ -126,6 +134,8 @@ export class ApiStack extends cdk.Stack {
     this.api = new apigateway.RestApi(this, 'ChatApi', {
       restApiName: `${cdk.Stack.of(this).stackName}-ChatAPI`,
       description: 'Australian Strata GPT Chat API',
+      // Gzip responses for clients that send Accept-Encoding; the Lambdas never see client headers
+      minCompressionSize: cdk.Size.bytes(1024),
       deployOptions: {
         stageName: 'v1',
         loggingLevel: apigateway.MethodLoggingLevel.INFO,
@@ -195,6 +205,8 @@ export class ApiStack extends cdk.Stack {
         properties: {
           message: { type: apigateway.JsonSchemaType.STRING },
           stream: { type: apigateway.JsonSchemaType.BOOLEAN },
+          // Response keys to return, e.g. ["content"] or ["content", "citations.document_id"]
+          fields: { type: apigateway.JsonSchemaType.ARRAY, items: { type: apigateway.JsonSchemaType.STRING } },
         },
         required: ['message'],
       },
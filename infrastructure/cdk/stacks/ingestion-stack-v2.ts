@@ -86,6 +86,12 @@ export class IngestionStack extends cdk.Stack {
       resources: [`${props.openSearchDomain.domainArn}/*`]
     }));
 
+    // embeddings-generator bumps the tenant's document generation (table owned by the RAG stack)
+    lambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['dynamodb:UpdateItem'],
+      resources: [this.formatArn({ service: 'dynamodb', resource: 'table', resourceName: 'strata-tenant-state' })]
+    }));
+
     lambdaRole.addToPolicy(new iam.PolicyStatement({
       actions: [
         'cloudwatch:PutMetricData'
@@ -97,6 +103,7 @@ export class IngestionStack extends cdk.Stack {
     const lambdaEnvironment = {
       'OPENSEARCH_ENDPOINT': props.openSearchDomain.domainEndpoint,
       'DOCUMENT_BUCKET': props.documentBucket.bucketName,
+      'TENANT_STATE_TABLE': 'strata-tenant-state',
       'AWS_XRAY_TRACING_NAME': 'StrataIngestion',
       'POWERTOOLS_SERVICE_NAME': 'ingestion',
       'POWERTOOLS_METRICS_NAMESPACE': 'StrataGPT/Ingestion'
@@ -7,6 +7,7 @@ import * as opensearch from 'aws-cdk-lib/aws-opensearchservice';
 import * as ssm from 'aws-cdk-lib/aws-ssm';
 import * as s3n from 'aws-cdk-lib/aws-s3-notifications';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
 import { Construct } from 'constructs';
 
 export interface RAGStackProps extends cdk.StackProps {
@@ -22,6 +23,12 @@ export class RAGStack extends cdk.Stack {
   public readonly evaluationLambda: lambda.Function;
   public readonly kendraIngestLambda: lambda.Function;
   public readonly documentTrackingTable: dynamodb.Table;
+  public readonly answerCacheTable: dynamodb.Table;
+  public readonly tenantStateTable: dynamodb.Table;
+  public readonly embeddingCacheTable: dynamodb.Table;
+  public readonly faqTable: dynamodb.Table;
+  public readonly admissionTable: dynamodb.Table;
+  public readonly commonLayer: PythonLayerVersion;
 
   constructor(scope: Construct, id: string, props: RAGStackProps) {
     super(scope, id, props);
@@ -102,6 +109,62 @@ export class RAGStack extends cdk.Stack {
       sortKey: { name: 'ingested_at', type: dynamodb.AttributeType.STRING }
     });
 
+    // Per-tenant document generation counters used to invalidate query caches
+    this.tenantStateTable = new dynamodb.Table(this, 'TenantStateTable', {
+      tableName: 'strata-tenant-state',
+      partitionKey: { name: 'tenant_id', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED
+    });
+
+    // Shared semantic answer cache for the RAG query Lambda
+    this.answerCacheTable = new dynamodb.Table(this, 'AnswerCacheTable', {
+      tableName: 'strata-answer-cache',
+      partitionKey: { name: 'scope', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'question_hash', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expires_at',
+      removalPolicy: cdk.RemovalPolicy.DESTROY  // Cache contents are disposable
+    });
+
+    // Question embedding cache shared by the query-side Lambdas
+    this.embeddingCacheTable = new dynamodb.Table(this, 'EmbeddingCacheTable', {
+      tableName: 'strata-embedding-cache',
+      partitionKey: { name: 'cache_key', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expires_at',
+      removalPolicy: cdk.RemovalPolicy.DESTROY  // Cache contents are disposable
+    });
+
+    // Precomputed per-tenant FAQ answers, tagged with the tenant generation they were built from
+    this.faqTable = new dynamodb.Table(this, 'FaqTable', {
+      tableName: 'strata-faq-answers',
+      partitionKey: { name: 'tenant_id', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'faq_key', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expires_at'
+    });
+
+    // Per-tenant admission token buckets, one item per tenant and service.
+    // Set numeric rate/burst attributes on an item to override a tenant's limit.
+    this.admissionTable = new dynamodb.Table(this, 'AdmissionTable', {
+      tableName: 'strata-tenant-admission',
+      partitionKey: { name: 'tenant_id', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'bucket', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED
+    });
+
+    // Shared Python modules (Powertools helpers, embedding cache)
+    this.commonLayer = new PythonLayerVersion(this, 'CommonLayer', {
+      entry: '../../backend/lambdas/common',
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_11, lambda.Runtime.PYTHON_3_12],
+      description: 'Shared Powertools utilities, embedding cache, tenant admission and response encoding'
+    });
+
     // Create IAM role for custom Kendra ingestion Lambda
     const kendraIngestRole = new iam.Role(this, 'KendraIngestLambdaRole', {
       assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
@@ -133,6 +196,7 @@ export class RAGStack extends cdk.Stack {
 
     // Grant S3 permissions
     props.documentBucket.grantRead(kendraIngestRole);
+    props.documentBucket.grantDelete(kendraIngestRole, 'local-index/*');  // Chunk artifacts of deleted documents
     kendraIngestRole.addToPolicy(new iam.PolicyStatement({
       actions: ['s3:GetObjectTagging'],
       resources: [`${props.documentBucket.bucketArn}/*`]
@@ -140,6 +204,7 @@ export class RAGStack extends cdk.Stack {
 
     // Grant DynamoDB permissions
     this.documentTrackingTable.grantReadWriteData(kendraIngestRole);
+    this.tenantStateTable.grantReadWriteData(kendraIngestRole);
 
     // Custom Kendra Ingestion Lambda
     this.kendraIngestLambda = new lambda.Function(this, 'KendraIngestFunction', {
@@ -152,6 +217,7 @@ export class RAGStack extends cdk.Stack {
       environment: {
         'KENDRA_INDEX_ID': this.kendraIndex.ref,
         'DOCUMENT_TABLE': this.documentTrackingTable.tableName,
+        'TENANT_STATE_TABLE': this.tenantStateTable.tableName,
         'KENDRA_ROLE_ARN': kendraRole.roleArn
       },
       tracing: lambda.Tracing.ACTIVE
@@ -175,7 +241,8 @@ export class RAGStack extends cdk.Stack {
       actions: [
         'kendra:Query',
         'kendra:Retrieve',
-        'kendra:BatchGetDocumentStatus'
+        'kendra:BatchGetDocumentStatus',
+        'kendra:DescribeIndex'  // Used to open the connection during init
       ],
       resources: [this.kendraIndex.attrArn]
     }));
@@ -186,10 +253,19 @@ export class RAGStack extends cdk.Stack {
         'bedrock:InvokeModelWithResponseStream'
       ],
       resources: [
-        `arn:aws:bedrock:${this.region}::foundation-model/anthropic.claude-3-haiku-20240307-v1:0`
+        `arn:aws:bedrock:${this.region}::foundation-model/anthropic.claude-3-haiku-20240307-v1:0`,
+        `arn:aws:bedrock:${this.region}::foundation-model/amazon.titan-embed-text-v2:0`
       ]
     }));
 
+    this.answerCacheTable.grantReadWriteData(ragLambdaRole);
+    this.tenantStateTable.grantReadData(ragLambdaRole);
+    this.embeddingCacheTable.grantReadWriteData(ragLambdaRole);
+    this.faqTable.grantReadWriteData(ragLambdaRole);
+    this.admissionTable.grantReadWriteData(ragLambdaRole);
+    // The local index counts a tenant's indexed documents before it skips Kendra
+    this.documentTrackingTable.grantReadData(ragLambdaRole);
+
     ragLambdaRole.addToPolicy(new iam.PolicyStatement({
       actions: [
         'es:ESHttpPost',
@@ -205,23 +281,69 @@ export class RAGStack extends cdk.Stack {
       resources: [`${props.documentBucket.bucketArn}/*`]
     }));
 
+    // The in-process index lists each tenant's chunk artifacts; listing vector-snapshots/
+    // lets a missing snapshot sidecar read as NoSuchKey rather than AccessDenied
+    ragLambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['s3:ListBucket'],
+      resources: [props.documentBucket.bucketArn],
+      conditions: { StringLike: { 's3:prefix': ['local-index/*', 'vector-snapshots/*'] } }
+    }));
+
+    // The export_vector_snapshot action writes each tenant's float16 snapshot
+    ragLambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['s3:PutObject'],
+      resources: [`${props.documentBucket.bucketArn}/vector-snapshots/*`]
+    }));
+
     // Environment variables
     const ragEnvironment = {
       'KENDRA_INDEX_ID': this.kendraIndex.ref,
       'OPENSEARCH_ENDPOINT': props.openSearchDomain.domainEndpoint,
       'DOCUMENT_BUCKET': props.documentBucket.bucketName,
       'BEDROCK_MODEL_ID': 'anthropic.claude-3-haiku-20240307-v1:0',  // Using Haiku for speed/cost
-      'USE_OPENSEARCH': 'false'  // Use Kendra with proper AttributeFilter
+      'USE_OPENSEARCH': 'false',  // Use Kendra with proper AttributeFilter
+      'PRIME_CONNECTIONS': 'true',  // Open AWS connections during the init phase
+      'ANSWER_CACHE_ENABLED': 'true',
+      'ANSWER_CACHE_TABLE': this.answerCacheTable.tableName,
+      'ANSWER_CACHE_THRESHOLD': '0.95',
+      'RETRIEVAL_CACHE_ENABLED': 'true',
+      'KENDRA_HEDGE_ENABLED': 'true',  // Re-issue Kendra queries slower than the container's p95
+      'KENDRA_HEDGE_MAX_FRACTION': '0.05',  // Hard cap on the share of Kendra queries that are hedged
+      'RERANK_CANDIDATES': '30',
+      'CONTEXT_TOKEN_BUDGET': '1500',  // Estimated prompt tokens for retrieved excerpts
+      'NEAR_DUPLICATE_THRESHOLD': '8',  // SimHash bits within which retrieved excerpts are collapsed
+      'BATCH_GENERATION_CONCURRENCY': '4',
+      'BATCH_GENERATION_RPS': '5',
+      'MODEL_ROUTING_ENABLED': 'true',  // Output-token cap by question complexity; every tier uses BEDROCK_MODEL_ID (see model_router.py)
+      'CONCURRENT_PIPELINE_ENABLED': 'true',  // Overlap tenant-state lookup, embedding and retrieval
+      'SPECULATIVE_RETRIEVAL_ENABLED': 'true',  // Search during the answer-cache lookup; hits discard it but still spend a Kendra query
+      'QUERY_EXPANSION_ENABLED': 'true',  // Append statutory terms for strata abbreviations before retrieval
+      'LOCAL_INDEX_ENABLED': 'true',  // In-process BM25 + vector search for small tenants and Kendra throttling
+      'LOCAL_INDEX_MAX_MB': '256',  // Estimated heap held by loaded local indexes per container
+      'DOCUMENT_TABLE': this.documentTrackingTable.tableName,  // Tenants are served locally only when artifacts cover every indexed document
+      'VECTOR_SNAPSHOT_ENABLED': 'true',  // Memory-mapped float16 snapshots replace the k-NN hop on the OpenSearch backends
+      'VECTOR_SNAPSHOT_MAX_MB': '768',  // Snapshot files kept in /tmp per container
+      'TENANT_STATE_TABLE': this.tenantStateTable.tableName,
+      'EMBEDDING_CACHE_TABLE': this.embeddingCacheTable.tableName,
+      'FAQ_TABLE': this.faqTable.tableName,
+      'ADMISSION_TABLE': this.admissionTable.tableName,
+      'ADMISSION_RATE': '2',  // Default per-tenant requests per second
+      'ADMISSION_BURST': '50',  // Covers a full batch (BATCH_MAX_QUESTIONS)
+      'POWERTOOLS_METRICS_NAMESPACE': 'StrataGPT/RAG',
+      'POWERTOOLS_SERVICE_NAME': 'rag-query'
     };
 
-    // RAG Query Lambda
-    this.ragQueryLambda = new lambda.Function(this, 'RAGQueryFunction', {
+    // RAG Query Lambda (bundled so requirements.txt - numpy, opensearch-py - are installed)
+    this.ragQueryLambda = new PythonFunction(this, 'RAGQueryFunction', {
       runtime: lambda.Runtime.PYTHON_3_12,
-      handler: 'index.handler',
-      code: lambda.Code.fromAsset('../../backend/lambdas/rag-query'),
+      entry: '../../backend/lambdas/rag-query',
+      index: 'index.py',
+      handler: 'handler',
+      layers: [this.commonLayer],
       role: ragLambdaRole,
-      timeout: cdk.Duration.seconds(60),
+      timeout: cdk.Duration.seconds(120),  // Batch checklists answer up to 50 questions per invocation
       memorySize: 1769,  // Optimal for RAG workloads (1 vCPU threshold)
+      ephemeralStorageSize: cdk.Size.mebibytes(1024),  // Room in /tmp for vector snapshots
       environment: ragEnvironment,
       tracing: lambda.Tracing.ACTIVE
     });
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Precompute FAQ answers for a tenant.
+This script sends the tenant's canonical questions to the RAG query Lambda,
+which answers them through the normal pipeline and stores the results in
+the FAQ table for the tenant's current document generation.
+Re-run it after the tenant's documents change; older answers are not served.
+
+Questions are sent in chunks (the Lambda accepts FAQ_MAX_QUESTIONS per
+call) so each call finishes inside the Lambda's 120 second timeout. The
+Lambda stores each answer as it completes, so a failed chunk keeps the
+answers it already produced and can simply be re-run.
+"""
+
+import boto3
+from botocore.config import Config
+import json
+import sys
+import argparse
+
+# Above the RAG query Lambda's 120 second timeout, so the client never gives up first
+READ_TIMEOUT_SECONDS = 130
+
+def get_lambda_function_name(region='ap-south-1'):
+    """Get the RAG query Lambda function name"""
+    lambda_client = boto3.client('lambda', region_name=region)
+
+    paginator = lambda_client.get_paginator('list_functions')
+    for page in paginator.paginate():
+        for func in page['Functions']:
+            if 'RAGQueryFunction' in func['FunctionName']:
+                return func['FunctionName']
+
+    raise Exception("RAG query Lambda function not found")
+
+def precompute_faq(tenant_id, questions, answer_style='professional', region='ap-south-1', chunk_size=10):
+    """Invoke the precompute_faq action for one tenant, one chunk of questions at a time"""
+    # No retries: a timed-out chunk may still be running and would be answered twice
+    lambda_client = boto3.client('lambda', region_name=region, config=Config(
+        read_timeout=READ_TIMEOUT_SECONDS, retries={'total_max_attempts': 1}))
+
+    function_name = get_lambda_function_name(region)
+    print(f"Using Lambda function: {function_name}")
+    print(f"Precomputing {len(questions)} answers for tenant {tenant_id} in chunks of {chunk_size}...")
+
+    stored, failed = 0, 0
+    for start in range(0, len(questions), chunk_size):
+        chunk = questions[start:start + chunk_size]
+        print(f"Questions {start + 1}-{start + len(chunk)}:")
+
+        try:
+            response = lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType='RequestResponse',
+                Payload=json.dumps({
+                    'action': 'precompute_faq',
+                    'tenant_id': tenant_id,
+                    'questions': chunk,
+                    'answer_style': answer_style
+                })
+            )
+            result = json.loads(response['Payload'].read())
+        except Exception as e:
+            print(f"  Error: {str(e)}")
+            failed += len(chunk)
+            continue
+
+        if result.get('statusCode') != 200:
+            print(f"  Error: {result.get('body', result)}")
+            failed += len(chunk)
+            continue
+
+        body = json.loads(result['body'])
+        stored += body['stored']
+        print(f"  Stored: {body['stored']} (generation {body['generation']}) in {body['metrics']['total_ms']}ms")
+        for question in body['skipped']:
+            print(f"  Skipped (no answer): {question}")
+
+    print(f"Stored {stored} of {len(questions)} answers")
+    if failed:
+        print(f"{failed} questions were in failed chunks; re-run to retry them")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute FAQ answers for a tenant')
+    parser.add_argument('tenant_id', help='Tenant to precompute answers for')
+    parser.add_argument('questions_file', help='Text file with one canonical question per line')
+    parser.add_argument('--style', default='professional', choices=['professional', 'simple', 'detailed'])
+    parser.add_argument('--region', default='ap-south-1', help='AWS region')
+    parser.add_argument('--chunk-size', type=int, default=10,
+                        help='Questions per Lambda call (at most FAQ_MAX_QUESTIONS)')
+
+    args = parser.parse_args()
+
+    with open(args.questions_file) as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    try:
+        precompute_faq(args.tenant_id, questions, args.style, args.region, args.chunk_size)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
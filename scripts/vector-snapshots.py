@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Export and benchmark per-tenant vector snapshots.
+`export` asks the RAG query Lambda to write each tenant's OpenSearch chunk
+embeddings to S3 as a float16 snapshot at the tenant's current document
+generation. Re-run it after the tenant's documents change; rag-query
+ignores snapshots from older generations and uses OpenSearch instead.
+`benchmark` runs questions through the snapshot and the OpenSearch HNSW
+index and reports latency and recall@k against exact OpenSearch scoring.
+"""
+
+import boto3
+import json
+import sys
+import argparse
+
+def get_lambda_function_name(region='ap-south-1'):
+    """Get the RAG query Lambda function name"""
+    lambda_client = boto3.client('lambda', region_name=region)
+
+    paginator = lambda_client.get_paginator('list_functions')
+    for page in paginator.paginate():
+        for func in page['Functions']:
+            if 'RAGQueryFunction' in func['FunctionName']:
+                return func['FunctionName']
+
+    raise Exception("RAG query Lambda function not found")
+
+def invoke(payload, region='ap-south-1'):
+    """Invoke a rag-query action and return the decoded body"""
+    lambda_client = boto3.client('lambda', region_name=region)
+
+    response = lambda_client.invoke(
+        FunctionName=get_lambda_function_name(region),
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload)
+    )
+
+    result = json.loads(response['Payload'].read())
+    if result.get('statusCode') != 200:
+        raise Exception(result.get('body', result))
+    return json.loads(result['body'])
+
+def export_snapshots(tenant_ids, region='ap-south-1'):
+    for tenant_id in tenant_ids:
+        body = invoke({'action': 'export_vector_snapshot', 'tenant_id': tenant_id}, region)
+        print(f"{tenant_id}: {body['rows']} chunks x {body['dimension']} dims, "
+              f"{body['matrix_bytes'] / 1024:.0f} KiB at generation {body['generation']} ({body['duration_ms']}ms)")
+
+def benchmark_snapshot(tenant_id, questions, k=10, region='ap-south-1'):
+    body = invoke({'action': 'benchmark_vector_snapshot', 'tenant_id': tenant_id, 'questions': questions, 'k': k}, region)
+
+    snapshot = body['snapshot']
+    print(f"Tenant {tenant_id}, generation {body['generation']}: {body['questions']} questions, "
+          f"{snapshot['chunks']} chunks ({snapshot['matrix_bytes'] / 1024:.0f} KiB, loaded in {snapshot['load_ms']}ms)")
+    print(f"{'backend':<18}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{f'recall@{k}':>12}")
+    for name, latency in body['latency_ms'].items():
+        print(f"{name:<18}{latency['p50']:>10}{latency['p95']:>10}{latency['mean']:>10}"
+              f"{body[f'recall_at_{k}'][name]:>12}")
+    return body
+
+def main():
+    parser = argparse.ArgumentParser(description='Export and benchmark per-tenant vector snapshots')
+    parser.add_argument('--region', default='ap-south-1', help='AWS region')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write snapshots at each tenant\'s current generation')
+    export_parser.add_argument('tenant_ids', nargs='+', help='Tenants to export')
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Compare the snapshot with OpenSearch HNSW')
+    benchmark_parser.add_argument('tenant_id', help='Tenant to benchmark')
+    benchmark_parser.add_argument('questions_file', help='Text file with one question per line')
+    benchmark_parser.add_argument('--k', type=int, default=10, help='Results per question for recall@k')
+    benchmark_parser.add_argument('--json', help='Also write the raw results to this file')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            export_snapshots(args.tenant_ids, args.region)
+        else:
+            with open(args.questions_file) as f:
+                questions = [line.strip() for line in f if line.strip()]
+            result = benchmark_snapshot(args.tenant_id, questions, args.k, args.region)
+            if args.json:
+                with open(args.json, 'w') as f:
+                    json.dump(result, f, indent=2)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import pytest
+import importlib.util
+from unittest.mock import patch, MagicMock
+import os
+
+os.environ.setdefault('KENDRA_INDEX_ID', 'test-index')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+
+# Loaded under its own name: every Lambda's module is called handler
+_spec = importlib.util.spec_from_file_location(
+    'kendra_custom_ingest',
+    os.path.join(os.path.dirname(__file__), '../../../backend/lambdas/kendra-custom-ingest/handler.py')
+)
+ingest = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ingest)
+
+
+class TestDeleteDocument:
+
+    @pytest.fixture
+    def ingestor(self):
+        with patch.object(ingest, 'dynamodb'):
+            ingestor = ingest.KendraCustomIngestor()
+        ingestor.doc_table = None
+        ingestor.tenant_state_table = MagicMock()
+        return ingestor
+
+    def test_delete_removes_kendra_document_and_chunk_artifact(self, ingestor):
+        with patch.object(ingest, 'kendra') as kendra, patch.object(ingest, 's3') as s3:
+            result = ingestor.delete_document('doc-bucket', 'tenant-a/documents/by-laws 2024.pdf')
+
+        assert result['success'] is True
+        kendra.batch_delete_document.assert_called_once_with(
+            IndexId='test-index', DocumentIdList=['s3://doc-bucket/tenant-a/documents/by-laws 2024.pdf'])
+        s3.delete_object.assert_called_once_with(
+            Bucket='doc-bucket', Key='local-index/tenant-a/tenant-a%2Fdocuments%2Fby-laws%202024.pdf.json')
+        ingestor.tenant_state_table.update_item.assert_called_once()
+        assert ingestor.tenant_state_table.update_item.call_args[1]['Key'] == {'tenant_id': 'tenant-a'}
+
+    def test_artifact_delete_failure_still_deletes_document(self, ingestor):
+        with patch.object(ingest, 'kendra'), patch.object(ingest, 's3') as s3:
+            s3.delete_object.side_effect = Exception('AccessDenied')
+
+            result = ingestor.delete_document('doc-bucket', 'tenant-a/documents/bylaws.pdf')
+
+        assert result['success'] is True
+        ingestor.tenant_state_table.update_item.assert_called_once()
@@ -0,0 +1,1729 @@
+import pytest
+import json
+from unittest.mock import Mock, patch, MagicMock
+import io
+import sys
+import os
+
+import numpy as np
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+os.environ.setdefault('DOCUMENT_BUCKET', 'test-bucket')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../backend/lambdas/rag-query'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../backend/lambdas/common'))
+import handler as rag
+import embedding_cache
+import clients
+from answer_cache import SemanticAnswerCache, normalize_question
+from retrieval_cache import RetrievalCache, TenantGenerations
+from faq_store import FaqStore
+from local_index import LocalIndexStore, LocalTenantIndex
+from vector_snapshot import VectorSnapshotStore, write_snapshot
+from tenant_admission import TenantAdmission, TenantLimit, LocalBucketStore, DynamoDBBucketStore
+from response_encoding import parse_fields, project_response, accepts_gzip, encode_body
+from fusion import reciprocal_rank_fusion
+from retrieval_hit import RetrievalHit
+from rerank import Reranker
+from context_packer import ContextPacker, estimate_tokens
+from rate_limit import RateLimiter, AdaptiveRateLimiter
+from model_router import ModelRouter, load_routing_table, DEFAULT_ROUTING_TABLE
+from query_expansion import QueryExpander, load_dictionary, DEFAULT_SYNONYMS
+from near_duplicates import simhash64, hamming, collapse_near_duplicates
+from circuit_breaker import CircuitBreaker, BackendUnavailableError
+from hedging import Hedger, HedgeBudget, LatencyTracker
+from botocore.exceptions import ClientError
+from handler import StrataRAGEngine, QueryContext, Citation
+
+
+def kendra_result(doc_id, title='Bylaws', excerpt='Pets require approval', confidence='HIGH', page=1):
+    # Ingested documents use their S3 URI as the Kendra id
+    source_uri = doc_id if doc_id.startswith('s3://') else f's3://test-bucket/{doc_id}'
+    return {
+        'DocumentId': doc_id,
+        'DocumentTitle': {'Text': title},
+        'DocumentExcerpt': {'Text': excerpt},
+        'ScoreAttributes': {'ScoreConfidence': confidence},
+        'DocumentAttributes': [
+            {'Key': '_source_uri', 'Value': {'StringValue': source_uri}},
+            {'Key': 'page_number', 'Value': {'LongValue': page}}
+        ]
+    }
+
+
+def kendra_hit(doc_id, **kwargs):
+    return RetrievalHit.from_kendra(kendra_result(doc_id, **kwargs))
+
+
+def bedrock_body(text='Pets need approval [Document 1]', input_tokens=100, output_tokens=20):
+    body = Mock()
+    body.read.return_value = json.dumps({
+        'content': [{'text': text}],
+        'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens}
+    })
+    return {'body': body}
+
+
+def embedding_body(vector):
+    body = Mock()
+    body.read.return_value = json.dumps({'embedding': vector})
+    return {'body': body}
+
+
+def opensearch_hits(*hits):
+    return {'hits': {'hits': [
+        {'_score': score, '_source': {'document_id': doc_id, 'text': text}}
+        for doc_id, text, score in hits
+    ]}}
+
+
+@pytest.fixture
+def mock_aws():
+    services = {'kendra': MagicMock(), 'bedrock-runtime': MagicMock(), 's3': MagicMock()}
+    with patch('handler.get_client', side_effect=lambda name: services[name]):
+        yield services
+
+
+@pytest.fixture
+def engine():
+    return StrataRAGEngine()
+
+
+class TestClients:
+
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        clients.reset_clients()
+        yield
+        clients.reset_clients()
+
+    def test_get_client_is_cached(self):
+        with patch('clients.boto3.client') as mock_client:
+            first = clients.get_client('kendra')
+            second = clients.get_client('kendra')
+
+        assert first is second
+        mock_client.assert_called_once()
+        config = mock_client.call_args[1]['config']
+        assert config.tcp_keepalive is True
+
+    def test_bedrock_gets_longer_read_timeout(self):
+        with patch('clients.boto3.client') as mock_client:
+            clients.get_client('bedrock-runtime')
+
+        config = mock_client.call_args[1]['config']
+        assert config.read_timeout == 60
+
+    def test_prime_connections_ignores_errors(self):
+        failing = MagicMock()
+        failing.describe_index.side_effect = Exception("AccessDenied")
+        with patch('clients.get_client', return_value=failing):
+            timings = clients.prime_connections('index-1', 'bucket-1')
+
+        assert set(timings) == {'bedrock-runtime', 'kendra', 's3'}
+
+
+class TestSemanticAnswerCache:
+
+    @pytest.fixture
+    def cache(self):
+        return SemanticAnswerCache(threshold=0.9, max_entries=2)
+
+    def test_normalize_question(self):
+        assert normalize_question("  What's the AGM   quorum?? ") == 'what s the agm quorum'
+
+    def test_similar_question_hits(self, cache):
+        cache.put('tenant-a', 'professional', 'AGM quorum?', [1.0, 0.0, 0.0], {'answer': 'Two owners'})
+
+        hit = cache.get('tenant-a', 'professional', [0.99, 0.05, 0.0])
+
+        assert hit is not None
+        payload, info = hit
+        assert payload['answer'] == 'Two owners'
+        assert info['tier'] == 'memory'
+
+    def test_dissimilar_question_misses(self, cache):
+        cache.put('tenant-a', 'professional', 'AGM quorum?', [1.0, 0.0, 0.0], {'answer': 'Two owners'})
+
+        assert cache.get('tenant-a', 'professional', [0.0, 1.0, 0.0]) is None
+
+    def test_scoped_by_tenant_and_style(self, cache):
+        cache.put('tenant-a', 'professional', 'AGM quorum?', [1.0, 0.0, 0.0], {'answer': 'Two owners'})
+
+        assert cache.get('tenant-b', 'professional', [1.0, 0.0, 0.0]) is None
+        assert cache.get('tenant-a', 'simple', [1.0, 0.0, 0.0]) is None
+
+    def test_lru_eviction(self, cache):
+        cache.put('tenant-a', 'professional', 'q1', [1.0, 0.0], {'answer': '1'})
+        cache.put('tenant-a', 'professional', 'q2', [0.0, 1.0], {'answer': '2'})
+        cache.put('tenant-a', 'professional', 'q3', [-1.0, 0.0], {'answer': '3'})
+
+        assert cache.get('tenant-a', 'professional', [1.0, 0.0]) is None
+
+    def test_shared_tier_hit_is_promoted(self):
+        import numpy as np
+        dynamodb = MagicMock()
+        dynamodb.query.return_value = {'Items': [{
+            'scope': {'S': 'tenant-a#0#professional'},
+            'question_hash': {'S': 'abc'},
+            'embedding': {'B': np.array([1.0, 0.0], dtype=np.float16).tobytes()},
+            'payload': {'S': json.dumps({'answer': 'Shared'})},
+            'expires_at': {'N': '9999999999'}
+        }]}
+        cache = SemanticAnswerCache(threshold=0.9, table_name='cache', dynamodb_client=dynamodb)
+
+        payload, info = cache.get('tenant-a', 'professional', [1.0, 0.0])
+        assert payload['answer'] == 'Shared'
+        assert info['tier'] == 'dynamodb'
+
+        _, info = cache.get('tenant-a', 'professional', [1.0, 0.0])
+        assert info['tier'] == 'memory'
+        dynamodb.query.assert_called_once()
+
+
+class TestRetrievalCache:
+
+    def test_hit_on_normalised_question(self):
+        cache = RetrievalCache()
+        cache.put('tenant-a', 1, 'What is the AGM quorum?', 10, [{'DocumentId': 'doc-1'}])
+
+        assert cache.get('tenant-a', 1, 'what is the agm quorum', 10) == [{'DocumentId': 'doc-1'}]
+        assert cache.get('tenant-a', 1, 'what is the agm quorum', 5) is None
+        assert cache.get('tenant-b', 1, 'what is the agm quorum', 10) is None
+
+    def test_new_generation_drops_stale_entries(self):
+        cache = RetrievalCache()
+        cache.put('tenant-a', 1, 'quorum', 10, [{'DocumentId': 'old'}])
+        cache.put('tenant-a', 2, 'levies', 10, [{'DocumentId': 'new'}])
+
+        assert cache.get('tenant-a', 1, 'quorum', 10) is None
+        assert len(cache._entries) == 1
+
+    def test_ttl_expiry(self):
+        cache = RetrievalCache(ttl_seconds=0)
+        cache.put('tenant-a', 1, 'quorum', 10, [{'DocumentId': 'doc-1'}])
+
+        assert cache.get('tenant-a', 1, 'quorum', 10) is None
+
+    def test_tenant_generations_refresh(self):
+        dynamodb = MagicMock()
+        dynamodb.get_item.return_value = {'Item': {'generation': {'N': '3'}}}
+        generations = TenantGenerations('tenant-state', dynamodb, refresh_seconds=60)
+
+        assert generations.get('tenant-a') == 3
+        assert generations.get('tenant-a') == 3
+        dynamodb.get_item.assert_called_once()
+
+    def test_tenant_generations_unavailable(self):
+        dynamodb = MagicMock()
+        dynamodb.get_item.side_effect = Exception("Throttled")
+
+        assert TenantGenerations('tenant-state', dynamodb).get('tenant-a') is None
+        assert TenantGenerations().get('tenant-a') == 0
+
+
+class TestReciprocalRankFusion:
+
+    def test_passages_in_both_lists_rank_first(self):
+        a, b, c = kendra_hit('a', excerpt='A'), kendra_hit('b', excerpt='B'), kendra_hit('c', excerpt='C')
+
+        fused = reciprocal_rank_fusion([[a, b], [c, b]], k=60)
+
+        assert [r.document_id for r in fused] == ['b', 'a', 'c']
+
+    def test_limit(self):
+        results = [kendra_hit(f'doc-{i}', excerpt=str(i)) for i in range(5)]
+
+        assert len(reciprocal_rank_fusion([results], limit=3)) == 3
+
+
+class TestReranker:
+
+    def test_bm25_prefers_matching_excerpt(self):
+        scores = Reranker().bm25('parking levy', [
+            'The levy for parking spaces is set at the AGM',
+            'Pets require written approval',
+            'Parking bays are allocated by the committee'
+        ])
+
+        assert scores.argmax() == 0
+        assert scores[1] == 0
+
+    def test_rerank_orders_by_blended_score(self):
+        results = [
+            kendra_hit('pets', excerpt='Pets require written approval', confidence='VERY_HIGH'),
+            kendra_hit('levy', excerpt='The special levy is raised at the AGM', confidence='MEDIUM')
+        ]
+
+        reranked = Reranker().rerank('How is a special levy raised?', results, limit=1)
+
+        assert [r.document_id for r in reranked] == ['levy']
+
+    def test_missing_similarity_is_not_scored_as_zero(self):
+        reranker = Reranker(bm25_weight=0.5, vector_weight=0.5, prior_weight=0.0)
+        without = kendra_hit('kendra', excerpt='levy')
+        with_similarity = kendra_hit('knn', excerpt='levy')
+        with_similarity.similarity = 0.2
+
+        reranked = reranker.rerank('levy', [with_similarity, without])
+
+        assert [r.document_id for r in reranked] == ['kendra', 'knn']
+
+
+class TestContextPacker:
+
+    def citation(self, doc_id, excerpt, confidence=0.8):
+        return Citation(document_id=doc_id, document_title='Bylaws', excerpt=excerpt,
+                        page_number=None, confidence_score=confidence, s3_uri=None)
+
+    def test_merges_same_document_and_drops_chunk_overlap(self):
+        shared = ' '.join(f'word{i}' for i in range(20))
+        first = self.citation('doc-1', f'intro text {shared}')
+        second = self.citation('doc-1', f'{shared} closing text', confidence=0.6)
+
+        packed, stats = ContextPacker(budget_tokens=1000).pack([first, second])
+
+        assert len(packed) == 1
+        assert packed[0].excerpt == f'intro text {shared} ... closing text'
+        assert stats['overlap_tokens_removed'] > 0
+        assert stats['tokens_saved'] > 0
+
+    def test_contained_excerpt_is_skipped(self):
+        packed, _ = ContextPacker().pack([
+            self.citation('doc-1', 'pets require written approval from the committee'),
+            self.citation('doc-1', 'written approval from the committee')
+        ])
+
+        assert packed[0].excerpt == 'pets require written approval from the committee'
+
+    def test_budget_fills_greedily_in_rank_order(self):
+        long_excerpt = 'levy ' * 400
+        citations = [
+            self.citation('low', 'short low excerpt', confidence=0.3),
+            self.citation('long', long_excerpt, confidence=0.95),
+            self.citation('high', 'short high excerpt', confidence=0.8)
+        ]
+
+        packed, stats = ContextPacker(budget_tokens=100).pack(citations)
+
+        # Reranked order is kept even where Kendra confidence disagrees
+        assert [c.document_id for c in packed] == ['low', 'high']
+        assert stats['excerpts_dropped'] == 1
+        assert stats['packed_tokens'] <= 100
+
+    def test_tokens_saved_against_top_five_prompt(self):
+        citations = [self.citation(f'doc-{i}', 'levy ' * 40) for i in range(8)]
+
+        _, stats = ContextPacker(budget_tokens=2000).pack(citations)
+
+        assert stats['baseline_tokens'] == stats['candidate_tokens'] * 5 // 8
+        assert stats['tokens_saved'] == stats['baseline_tokens'] - stats['packed_tokens']
+        assert stats['tokens_saved'] < 0
+
+    def test_merges_by_source_object_not_placeholder_document_id(self):
+        citations = [
+            Citation(document_id='doc-default', document_title='Bylaws', excerpt='pets need approval',
+                     page_number=None, confidence_score=0.8, s3_uri='s3://docs/tenant-a/bylaws.pdf'),
+            Citation(document_id='doc-default', document_title='Minutes', excerpt='levies rise in July',
+                     page_number=None, confidence_score=0.7, s3_uri='s3://docs/tenant-a/minutes.pdf')
+        ]
+
+        packed, stats = ContextPacker().pack(citations)
+
+        assert [c.document_title for c in packed] == ['Bylaws', 'Minutes']
+        assert stats['documents'] == 2
+
+    def test_estimate_tokens(self):
+        assert estimate_tokens('') == 0
+        assert estimate_tokens('abcdefgh') == 2
+
+
+class TestRateLimiter:
+
+    def test_burst_then_wait(self):
+        limiter = RateLimiter(rate=10, burst=2)
+
+        assert limiter.try_acquire() == 0
+        assert limiter.try_acquire() == 0
+        assert 0 < limiter.try_acquire() <= 0.1
+
+    def test_acquire_times_out(self):
+        limiter = RateLimiter(rate=0.1, burst=1)
+        limiter.acquire()
+
+        assert limiter.acquire(timeout=0.01) == -1
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_threshold_and_probes_after_reset(self):
+        transitions = []
+        breaker = CircuitBreaker('kendra', failure_threshold=2, reset_seconds=0.05,
+                                 on_transition=lambda name, old, new: transitions.append(new))
+
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+        assert 0 < breaker.retry_after() <= 0.05
+
+        import time as _time
+        _time.sleep(0.06)
+        assert breaker.allow()
+        assert not breaker.allow()  # one probe at a time
+        breaker.record_success()
+
+        assert transitions == ['open', 'half_open', 'closed']
+
+    def test_adaptive_limiter_halves_on_throttle(self):
+        limiter = AdaptiveRateLimiter(max_rate=8, min_rate=1, increase_step=1)
+
+        limiter.on_throttle()
+        limiter.on_throttle()
+        assert limiter.rate == 2
+        limiter.on_success()
+        assert limiter.rate == 3
+
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Query')
+
+
+def slow_then_fast(result, delay=0.3):
+    """A callable whose first call takes `delay` seconds and later calls return at once"""
+    import itertools, time as _time
+    calls = itertools.count()
+
+    def call(**kwargs):
+        if next(calls) == 0:
+            _time.sleep(delay)
+            return {**result, 'attempt': 'original'}
+        return {**result, 'attempt': 'hedge'}
+    return call
+
+
+def warm_tracker(seconds=0.01, samples=20):
+    tracker = LatencyTracker(percentile=95, min_samples=samples)
+    for _ in range(samples):
+        tracker.record(seconds)
+    return tracker
+
+
+class TestHedging:
+
+    @pytest.fixture
+    def executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            yield pool
+
+    def test_tracker_needs_min_samples(self):
+        tracker = LatencyTracker(percentile=90, min_samples=10)
+        for ms in range(1, 10):
+            tracker.record(ms / 1000)
+        assert tracker.threshold() is None
+        tracker.record(0.1)
+        assert tracker.threshold() == 0.1
+
+    def test_slow_call_is_hedged_and_hedge_wins(self, executor):
+        hedger = Hedger(executor, warm_tracker(), HedgeBudget(max_fraction=1.0), min_delay=0.01)
+
+        response, outcome = hedger.call(slow_then_fast({}))
+
+        assert response['attempt'] == 'hedge'
+        assert outcome.hedged and outcome.won
+
+    def test_budget_caps_hedged_fraction(self, executor):
+        budget = HedgeBudget(max_fraction=0.5, burst=1)
+        hedger = Hedger(executor, warm_tracker(), budget, min_delay=0.01)
+
+        # Half a credit after one call: not enough to hedge
+        response, outcome = hedger.call(slow_then_fast({}, delay=0.05))
+        assert response['attempt'] == 'original'
+        assert outcome.denied and not outcome.hedged
+
+        # A refused can_hedge hands the credit back
+        _, outcome = hedger.call(slow_then_fast({}, delay=0.05), can_hedge=lambda: False)
+        assert outcome.denied
+        assert budget.try_spend()
+
+    def test_no_hedging_before_tracker_is_warm(self, executor):
+        hedger = Hedger(executor, LatencyTracker(min_samples=5), HedgeBudget(max_fraction=1.0), min_delay=0.01)
+
+        response, outcome = hedger.call(slow_then_fast({}, delay=0.05))
+
+        assert response['attempt'] == 'original'
+        assert outcome == type(outcome)()
+
+
+class TestModelRouter:
+
+    @pytest.fixture
+    def router(self):
+        return ModelRouter('default-model')
+
+    def test_simple_lookup_uses_fast_tier(self, router):
+        decision = router.route('Are pets allowed?', 'simple', 1)
+
+        assert decision.tier == 'fast'
+        assert decision.category == 'by_laws'
+        assert decision.max_tokens == 400
+
+    def test_detailed_multi_document_question_uses_large_tier(self, router):
+        decision = router.route('What is the difference between mediation and a tribunal application?', 'detailed', 4)
+
+        assert decision.tier == 'large'
+        assert {'style:detailed', 'multi_part', 'multi_document'} <= set(decision.signals)
+        # A larger model is only used when the routing table names one
+        assert decision.model_id == 'default-model'
+        assert decision.max_tokens == 1500
+
+    def test_routing_table_can_upgrade_large_tier(self):
+        table = load_routing_table(json.dumps({'tiers': {
+            'fast': {'model_id': None, 'max_tokens': 400},
+            'standard': {'model_id': None, 'max_tokens': 1000},
+            'large': {'model_id': 'anthropic.claude-3-5-sonnet-20240620-v1:0', 'max_tokens': 1500}
+        }}))
+
+        decision = ModelRouter('default-model', table).route(
+            'What is the difference between mediation and a tribunal application?', 'detailed', 4)
+
+        assert decision.model_id == 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+
+    def test_standard_tier_uses_engine_default_model(self, router):
+        decision = router.route('When are levies due?', 'professional', 1)
+
+        assert decision.tier == 'standard'
+        assert decision.model_id == 'default-model'
+
+    def test_invalid_routing_table_falls_back_to_defaults(self):
+        assert load_routing_table('{"tiers": {"fast": {}}}') is DEFAULT_ROUTING_TABLE
+        assert load_routing_table('not json') is DEFAULT_ROUTING_TABLE
+        custom = load_routing_table(json.dumps({'tiers': {t: {'model_id': 'm', 'max_tokens': 10} for t in ('fast', 'standard', 'large')}, 'fast_max': 1}))
+        assert custom['fast_max'] == 1
+        assert custom['large_min'] == DEFAULT_ROUTING_TABLE['large_min']
+
+
+BYLAW_EXCERPT = (
+    'An owner or occupier of a lot may keep an animal on the lot with the written approval of the '
+    'owners corporation. The owners corporation must not unreasonably refuse approval and may attach '
+    'reasonable conditions, including that the animal is kept under control on common property, that '
+    'any damage caused by the animal is repaired at the cost of the owner, and that approval may be '
+    'withdrawn if the animal causes a nuisance to other occupiers of the scheme.'
+)
+
+
+class TestNearDuplicates:
+
+    def test_simhash_distance_tracks_similarity(self):
+        edited = BYLAW_EXCERPT.replace('reasonable conditions', 'sensible conditions')
+        unrelated = ('Levies are payable quarterly in advance into the administrative fund and the capital works '
+                     'fund, and interest accrues on any contribution that remains unpaid one month after it is due.')
+
+        assert simhash64(BYLAW_EXCERPT) == simhash64(BYLAW_EXCERPT.upper())
+        assert hamming(simhash64(BYLAW_EXCERPT), simhash64(edited)) <= 8
+        assert hamming(simhash64(BYLAW_EXCERPT), simhash64(unrelated)) > 8
+
+    def test_collapse_keeps_best_ranked_copy(self):
+        hits = [
+            kendra_hit('bylaws-2023', excerpt=BYLAW_EXCERPT),
+            kendra_hit('levies', excerpt='Levies are due quarterly in advance'),
+            kendra_hit('bylaws-2021', excerpt=BYLAW_EXCERPT.replace('nuisance', 'disturbance')),
+            kendra_hit('bylaws-2019', excerpt=BYLAW_EXCERPT),
+        ]
+
+        kept, collapsed = collapse_near_duplicates(hits)
+
+        assert [h.document_id for h in kept] == ['bylaws-2023', 'levies']
+        assert collapsed == 2
+        assert collapse_near_duplicates(hits, threshold=-1) == (hits, 0)
+
+
+class TestQueryExpansion:
+
+    @pytest.fixture
+    def expander(self):
+        return QueryExpander(DEFAULT_SYNONYMS)
+
+    def test_expands_abbreviations_on_word_boundaries(self, expander):
+        text, added = expander.expand('When must the OC hold the AGM? (not a doc question)')
+
+        assert added == {'oc': ['owners corporation'], 'agm': ['annual general meeting']}
+        assert text.endswith('owners corporation annual general meeting')
+
+    def test_longest_match_wins(self, expander):
+        matches = expander.find('who pays body corp fees')
+
+        assert [expander.terms[index] for _, _, index in matches] == ['body corp fees']
+
+    def test_skips_expansions_already_in_question(self, expander):
+        text, added = expander.expand('Is the sinking fund the same as the capital works fund?')
+
+        assert 'capital works fund' not in added.get('sinking fund', [])
+        assert text.count('capital works fund') == 1
+
+    def test_no_match_returns_question(self, expander):
+        assert expander.expand('Can I keep a pet?') == ('Can I keep a pet?', {})
+
+    def test_load_dictionary_merges_overrides(self):
+        assert load_dictionary('{"Lot": ["unit"]}')['lot'] == ['unit']
+        assert load_dictionary('not json') is DEFAULT_SYNONYMS
+
+
+class FakeFaqTable:
+    """In-memory stand-in for the FAQ DynamoDB table"""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item):
+        self.items[(Item['tenant_id']['S'], Item['faq_key']['S'])] = Item
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        tenant = ExpressionAttributeValues[':tenant']['S']
+        prefix = ExpressionAttributeValues[':style']['S']
+        return {'Items': [item for (t, key), item in self.items.items() if t == tenant and key.startswith(prefix)]}
+
+
+class TestFaqStore:
+
+    @pytest.fixture
+    def store(self):
+        store = FaqStore('faq', FakeFaqTable(), threshold=0.7)
+        store.put('tenant-a', 'professional', 'What is the quorum for an AGM?', 3,
+                  {'answer': 'A quarter of lots [Document 1]', 'citations': [], 'processing_time_ms': 900})
+        return store
+
+    def test_similar_question_hits(self, store):
+        payload, match = store.lookup('tenant-a', 'professional', 'what is the quorum for the AGM', 3)
+
+        assert payload == {'answer': 'A quarter of lots [Document 1]', 'citations': []}
+        assert match['question'] == 'What is the quorum for an AGM?'
+        assert match['similarity'] >= 0.7
+
+    def test_unrelated_question_misses(self, store):
+        assert store.lookup('tenant-a', 'professional', 'Can I keep a dog?', 3) is None
+
+    def test_scoped_by_tenant_style_and_generation(self, store):
+        question = 'What is the quorum for an AGM?'
+
+        assert store.lookup('tenant-b', 'professional', question, 3) is None
+        assert store.lookup('tenant-a', 'simple', question, 3) is None
+        # Documents changed: the generation moved on and the answer expires
+        assert store.lookup('tenant-a', 'professional', question, 4) is None
+
+
+class TestResponseEncoding:
+
+    RESPONSE = {
+        'answer': 'Pets need approval [Document 1]',
+        'citations': [{'document_id': 'doc-1', 'title': 'Bylaws', 'excerpt': 'Pets require approval'}],
+        'metrics': {'input_tokens': 100}
+    }
+
+    def test_parse_fields(self):
+        assert parse_fields('answer, citations.document_id') == ['answer', 'citations.document_id']
+        assert parse_fields(['answer']) == ['answer']
+        assert parse_fields('') is None
+
+    def test_project_answer_and_citation_ids(self):
+        projected = project_response(self.RESPONSE, ['answer', 'citations.document_id'])
+
+        assert projected == {'answer': self.RESPONSE['answer'], 'citations': [{'document_id': 'doc-1'}]}
+
+    def test_projection_keeps_errors(self):
+        projected = project_response({'error': 'Kendra throttled', 'retry_after_seconds': 2}, ['answer'])
+
+        assert projected == {'error': 'Kendra throttled', 'retry_after_seconds': 2}
+
+    def test_accepts_gzip(self):
+        assert accepts_gzip({'accept-encoding': 'br, gzip;q=0.8'})
+        assert not accepts_gzip({'Accept-Encoding': 'gzip;q=0'})
+        assert not accepts_gzip(None)
+
+    def test_encode_body_compresses_large_bodies_only(self):
+        import base64, gzip
+        text = json.dumps(self.RESPONSE) * 50
+
+        body, compressed, raw_bytes, sent_bytes = encode_body(text, True)
+        assert compressed and sent_bytes < raw_bytes
+        assert gzip.decompress(base64.b64decode(body)).decode() == text
+        assert encode_body('{}', True)[1] is False
+        assert encode_body(text, False)[1] is False
+
+
+class FakeAdmissionTable:
+    """In-memory stand-in for the admission DynamoDB table with conditional updates"""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.items.get((Key['tenant_id']['S'], Key['bucket']['S']))
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, TableName, Key, ConditionExpression, ExpressionAttributeValues, **kwargs):
+        key = (Key['tenant_id']['S'], Key['bucket']['S'])
+        item = self.items.get(key, {})
+        if ConditionExpression == 'attribute_not_exists(tokens)':
+            ok = 'tokens' not in item
+        else:
+            ok = item.get('updated_at') == ExpressionAttributeValues[':previous']
+        if not ok:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}}, 'UpdateItem')
+        self.items[key] = {**item, 'tokens': ExpressionAttributeValues[':tokens'],
+                           'updated_at': ExpressionAttributeValues[':now']}
+
+
+class TestTenantAdmission:
+
+    def test_local_bucket_rejects_after_burst(self):
+        store = LocalBucketStore()
+        limit = TenantLimit(rate=1, burst=2)
+
+        decisions = [store.take('tenant-a', 'rag-query', 1, limit, now=100.0) for _ in range(3)]
+
+        assert [d.allowed for d in decisions] == [True, True, False]
+        assert decisions[2].retry_after == pytest.approx(1.0)
+        assert store.take('tenant-b', 'rag-query', 1, limit, now=100.0).allowed
+        assert store.take('tenant-a', 'rag-query', 1, limit, now=101.0).allowed
+
+    def test_local_per_tenant_limit(self):
+        store = LocalBucketStore({'big-manager': TenantLimit(rate=1, burst=1)})
+        admission = TenantAdmission(store, 'rag-query', TenantLimit(rate=10, burst=10))
+
+        assert admission.admit('big-manager').allowed
+        assert not admission.admit('big-manager').allowed
+        assert admission.admit('tenant-a').allowed
+
+    def test_dynamodb_bucket_uses_item_limit_and_conditional_updates(self):
+        table = FakeAdmissionTable()
+        table.items[('tenant-a', 'rag-query')] = {'rate': {'N': '0.5'}, 'burst': {'N': '1'}}
+        store = DynamoDBBucketStore('admission', table)
+        default = TenantLimit(rate=10, burst=10)
+
+        first = store.take('tenant-a', 'rag-query', 1, default, now=50.0)
+        second = store.take('tenant-a', 'rag-query', 1, default, now=50.0)
+
+        assert first.allowed and not second.allowed
+        assert second.retry_after == pytest.approx(2.0)
+        assert table.items[('tenant-a', 'rag-query')]['rate'] == {'N': '0.5'}
+
+    def test_store_failure_admits(self):
+        store = Mock()
+        store.take.side_effect = Exception('DynamoDB unavailable')
+
+        assert TenantAdmission(store, 'chat', TenantLimit(1, 1)).admit('tenant-a').allowed
+
+
+class TestEmbeddingCache:
+
+    def test_float16_round_trip(self):
+        packed = embedding_cache.pack_embedding([0.5, -0.25, 1.0])
+
+        assert len(packed) == 6
+        assert embedding_cache.unpack_embedding(packed) == [0.5, -0.25, 1.0]
+
+    def test_key_includes_model_and_dimensions(self):
+        key = embedding_cache.EmbeddingCache.key
+
+        assert key('titan', 768, 'AGM  Quorum') == key('titan', 768, 'agm quorum')
+        assert key('titan', 768, 'agm quorum') != key('titan', 256, 'agm quorum')
+        assert key('titan', 768, 'agm quorum') != key('cohere', 768, 'agm quorum')
+
+    def test_get_or_compute_counts_hits_and_misses(self):
+        cache = embedding_cache.EmbeddingCache(max_entries=10)
+        compute = Mock(return_value=[0.5, 0.25])
+        recorded = []
+
+        with patch.object(embedding_cache.EmbeddingCache, '_record', side_effect=lambda name, tier=None: recorded.append(name)):
+            first = cache.get_or_compute('titan', 2, 'agm quorum', compute)
+            second = cache.get_or_compute('titan', 2, 'AGM quorum', compute)
+
+        assert first == second == [0.5, 0.25]
+        compute.assert_called_once()
+        assert recorded == ['EmbeddingCacheMiss', 'EmbeddingCacheHit']
+
+    def test_shared_tier(self):
+        dynamodb = MagicMock()
+        dynamodb.get_item.return_value = {'Item': {
+            'embedding': {'B': embedding_cache.pack_embedding([1.0, 0.0])},
+            'expires_at': {'N': '9999999999'}
+        }}
+        cache = embedding_cache.EmbeddingCache(table_name='embeddings', dynamodb_client=dynamodb)
+
+        assert cache.get('titan', 2, 'agm quorum') == [1.0, 0.0]
+        assert cache.get('titan', 2, 'agm quorum') == [1.0, 0.0]
+        dynamodb.get_item.assert_called_once()
+
+
+def chunk_artifact(tenant_id, document_id, texts, embeddings=None):
+    import base64, struct
+    return {
+        'tenant_id': tenant_id,
+        'document_id': document_id,
+        'source_key': f'{tenant_id}/{document_id}.pdf',
+        'chunks': [
+            {'chunk_id': f'{document_id}_chunk_{i}', 'text': text,
+             'embedding': base64.b64encode(struct.pack(f'<{len(embeddings[i])}e', *embeddings[i])).decode()
+             if embeddings else None}
+            for i, text in enumerate(texts)
+        ]
+    }
+
+
+class FakeArtifactBucket:
+    """In-memory stand-in for S3 list_objects_v2/get_object over chunk artifacts"""
+
+    def __init__(self, artifacts):
+        self.objects = {f"local-index/{a['tenant_id']}/{a['document_id']}.json": a for a in artifacts}
+        self.lists = 0
+        self.gets = 0
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        self.lists += 1
+        return {'Contents': [{'Key': key, 'Size': len(json.dumps(artifact))} for key, artifact in self.objects.items()
+                             if key.startswith(Prefix)], 'IsTruncated': False}
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        body = Mock()
+        body.read.return_value = json.dumps(self.objects[Key])
+        return {'Body': body}
+
+
+class FakeDocumentTable:
+    """In-memory stand-in for the document tracking table's tenant-index COUNT query"""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        assert kwargs['Select'] == 'COUNT'
+        return {'Count': self.counts.get(kwargs['ExpressionAttributeValues'][':tenant']['S'], 0)}
+
+
+class TestLocalIndex:
+
+    def test_fuses_bm25_and_vector_rankings(self):
+        index = LocalTenantIndex('tenant-a', 0, [
+            {'text': 'Quorum for a general meeting is one quarter of lots', 'embedding': np.array([0.0, 1.0])},
+            {'text': 'Pets require committee approval', 'embedding': np.array([1.0, 0.0])},
+            {'text': 'Levies are due quarterly', 'embedding': np.array([0.6, 0.8])},
+        ], document_count=1)
+
+        hits = index.search('AGM quorum', [0.0, 1.0], 2, lambda chunk, bm25, similarity: (chunk['text'], similarity))
+
+        assert hits[0][0].startswith('Quorum')
+        assert hits[0][1] == pytest.approx(1.0)
+        assert hits[1][0] == 'Levies are due quarterly'
+
+    def test_store_isolates_tenants_by_prefix_and_recorded_tenant(self):
+        bucket = FakeArtifactBucket([
+            chunk_artifact('tenant', 'doc-1', ['AGM quorum rules']),
+            chunk_artifact('tenant-b', 'doc-2', ['AGM quorum rules for tenant b']),
+        ])
+        # An artifact filed under the wrong tenant's prefix is ignored
+        bucket.objects['local-index/tenant/doc-3.json'] = chunk_artifact('tenant-b', 'doc-3', ['quorum'])
+        store = LocalIndexStore(bucket, 'bucket')
+
+        index = store.get('tenant', 0)
+
+        assert {chunk['document_id'] for chunk in index.chunks} == {'doc-1'}
+        assert store.get('ALL', 0) is None
+        assert store.get('tenant/../tenant-b', 0) is None
+
+    def test_store_reloads_on_new_generation_only(self):
+        bucket = FakeArtifactBucket([chunk_artifact('tenant-a', 'doc-1', ['AGM quorum'])])
+        store = LocalIndexStore(bucket, 'bucket')
+
+        store.get('tenant-a', 1)
+        store.get('tenant-a', 1)
+        store.get('tenant-a', 2)
+
+        assert bucket.lists == 2
+
+    def test_store_skips_tenants_over_document_limit(self):
+        bucket = FakeArtifactBucket([chunk_artifact('tenant-a', f'doc-{i}', ['text']) for i in range(3)])
+
+        assert LocalIndexStore(bucket, 'bucket', max_documents=2).get('tenant-a', 0) is None
+
+    def test_store_remembers_tenant_over_request_limit_without_loading(self):
+        bucket = FakeArtifactBucket([chunk_artifact('tenant-a', f'doc-{i}', ['text']) for i in range(3)])
+        store = LocalIndexStore(bucket, 'bucket')
+
+        assert store.get('tenant-a', 0, max_documents=2) is None
+        assert store.get('tenant-a', 0, max_documents=2) is None
+        assert (bucket.lists, bucket.gets) == (1, 0)
+
+        store.load_in_background('tenant-a', 0).result()
+        assert store.cached('tenant-a', 0).document_count == 3
+
+    def test_store_evicts_least_recently_used_by_bytes(self):
+        bucket = FakeArtifactBucket([
+            chunk_artifact(tenant, 'doc-1', ['AGM quorum rules ' * 50], [[0.1] * 64]) for tenant in ('tenant-a', 'tenant-b')
+        ])
+        probe = LocalIndexStore(bucket, 'bucket')
+        one_index = probe.get('tenant-a', 0).nbytes
+        store = LocalIndexStore(bucket, 'bucket', max_bytes=int(one_index * 1.5))
+
+        store.get('tenant-a', 0)
+        store.get('tenant-b', 0)
+
+        assert store.cached('tenant-a', 0) is None
+        assert store.cached('tenant-b', 0) is not None
+        assert store.nbytes <= store.max_bytes
+
+
+class FakeSnapshotBucket:
+    """In-memory stand-in for S3 put_object/get_object over snapshot objects"""
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode()
+
+    def get_object(self, Bucket, Key):
+        self.gets.append(Key)
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def snapshot_chunks(vectors):
+    return [
+        {'chunk_id': f'doc-{i}_chunk_0', 'document_id': f'doc-{i}', 'title': f'Doc {i}',
+         'source_key': f'tenant-a/doc-{i}.pdf', 'page_number': i + 1, 'text': f'chunk {i}', 'embedding': vector}
+        for i, vector in enumerate(vectors)
+    ]
+
+
+class TestVectorSnapshot:
+
+    def test_search_ranks_by_cosine_similarity(self, tmp_path):
+        bucket = FakeSnapshotBucket()
+        write_snapshot(bucket, 'bucket', 'vector-snapshots', 'tenant-a', 1,
+                       snapshot_chunks([[1.0, 0.0, 0.0], [0.0, 3.0, 0.0], [0.6, 0.8, 0.0]]))
+        store = VectorSnapshotStore(bucket, 'bucket', directory=str(tmp_path))
+
+        snapshot = store.get('tenant-a', 1)
+        rows = snapshot.search([0.0, 1.0, 0.0], 2)
+
+        assert [row for row, _ in rows] == [1, 2]
+        assert rows[0][1] == pytest.approx(1.0, abs=1e-3)
+        assert rows[1][1] == pytest.approx(0.8, abs=1e-3)
+        assert snapshot.chunk(1)['document_id'] == 'doc-1'
+        assert snapshot.chunk(1)['page_number'] == 2
+
+    def test_store_checks_generation_and_downloads_once(self, tmp_path):
+        bucket = FakeSnapshotBucket()
+        write_snapshot(bucket, 'bucket', 'vector-snapshots', 'tenant-a', 3, snapshot_chunks([[1.0, 0.0]]))
+        store = VectorSnapshotStore(bucket, 'bucket', directory=str(tmp_path))
+
+        assert store.get('tenant-a', 4) is None
+        assert store.get('tenant-a', 3) is not None
+        assert store.get('tenant-a', 3) is not None
+
+        assert bucket.gets.count('vector-snapshots/tenant-a/g3.f16') == 1
+        assert (tmp_path / 'tenant-a' / 'g3.f16').stat().st_size == 2 * 2
+
+    def test_store_isolates_tenants(self, tmp_path):
+        bucket = FakeSnapshotBucket()
+        write_snapshot(bucket, 'bucket', 'vector-snapshots', 'tenant-b', 0, snapshot_chunks([[1.0, 0.0]]))
+        # A sidecar copied under another tenant's prefix is ignored
+        bucket.objects['vector-snapshots/tenant-a/snapshot.json'] = bucket.objects['vector-snapshots/tenant-b/snapshot.json']
+        store = VectorSnapshotStore(bucket, 'bucket', directory=str(tmp_path))
+
+        assert store.get('tenant-a', 0) is None
+        assert store.get('tenant-c', 0) is None
+        assert store.get('ALL', 0) is None
+        assert store.get('tenant-b', 0) is not None
+
+
+class TestStrataRAGEngine:
+
+    def test_extract_citations(self, engine):
+        citations = engine.extract_citations([kendra_hit('doc-1', page=3)])
+
+        assert len(citations) == 1
+        assert citations[0].document_id == 'doc-1'
+        assert citations[0].page_number == 3
+        assert citations[0].confidence_score == 0.8
+        assert citations[0].s3_uri == 's3://test-bucket/doc-1'
+
+    def test_format_response_only_includes_cited_documents(self, engine):
+        citations = engine.extract_citations([kendra_hit('doc-1'), kendra_hit('doc-2')])
+
+        response = engine.format_response('See [Document 2]', citations)
+
+        assert response['cited_sources'] == 1
+        assert response['citations'][0]['document_id'] == 'doc-2'
+
+    def test_process_query(self, engine, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='Can I keep a pet?', tenant_id='tenant-a'))
+
+        assert result['answer'].startswith('Pets need approval')
+        assert result['cited_sources'] == 1
+        assert result['metrics']['input_tokens'] == 100
+        query_params = mock_aws['kendra'].query.call_args[1]
+        assert query_params['AttributeFilter']['EqualsTo']['Value']['StringValue'] == 'tenant-a'
+
+    def test_process_query_expands_kendra_query(self, mock_aws):
+        with patch.dict(os.environ, {'QUERY_EXPANSION_ENABLED': 'true'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='How much is the sinking fund levy?', tenant_id='tenant-a'))
+
+        assert mock_aws['kendra'].query.call_args[1]['QueryText'] == (
+            'How much is the sinking fund levy? capital works fund maintenance fund contributions')
+        assert result['metrics']['query_expansion']['terms']['levy'] == ['contributions']
+        prompt = json.loads(mock_aws['bedrock-runtime'].invoke_model.call_args[1]['body'])['messages'][0]['content']
+        assert 'capital works fund' not in prompt
+
+    def test_process_query_reranks_wider_candidate_set(self, mock_aws):
+        with patch.dict(os.environ, {'RERANK_CANDIDATES': '30'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [
+            kendra_result('pets', excerpt='Pets require approval'),
+            kendra_result('levy', excerpt='Special levy approval at the AGM')
+        ]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body('Levies [Document 1]')
+
+        result = engine.process_query(QueryContext(question='special levy', tenant_id='tenant-a', max_results=1))
+
+        assert mock_aws['kendra'].query.call_args[1]['PageSize'] == 30
+        assert result['citations'][0]['document_id'] == 'levy'
+        assert result['metrics']['rerank']['candidates'] == 2
+
+    def test_process_query_packs_context(self, mock_aws):
+        with patch.dict(os.environ, {'CONTEXT_TOKEN_BUDGET': '500'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [
+            kendra_result('doc-1', excerpt='Pets require approval'),
+            kendra_result('doc-1', excerpt='Dogs must be leashed'),
+            kendra_result('doc-2', excerpt='Levies are due quarterly')
+        ]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body('Levies [Document 2]')
+
+        result = engine.process_query(QueryContext(question='pets', tenant_id='tenant-a'))
+
+        prompt = json.loads(mock_aws['bedrock-runtime'].invoke_model.call_args[1]['body'])['messages'][0]['content']
+        assert 'Pets require approval ... Dogs must be leashed' in prompt
+        assert result['citations'][0]['document_id'] == 'doc-2'
+        assert result['metrics']['context_packing']['documents'] == 2
+
+    def test_process_query_collapses_near_duplicate_excerpts(self, mock_aws):
+        with patch.dict(os.environ, {'NEAR_DUPLICATE_THRESHOLD': '8'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [
+            kendra_result('bylaws-2023', excerpt=BYLAW_EXCERPT),
+            kendra_result('bylaws-2021', excerpt=BYLAW_EXCERPT),
+            kendra_result('levies', excerpt='Levies are due quarterly')
+        ]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body('Pets [Document 1] [Document 2]')
+
+        result = engine.process_query(QueryContext(question='pets', tenant_id='tenant-a'))
+
+        prompt = json.loads(mock_aws['bedrock-runtime'].invoke_model.call_args[1]['body'])['messages'][0]['content']
+        assert prompt.count(BYLAW_EXCERPT) == 1
+        assert [c['document_id'] for c in result['citations']] == ['bylaws-2023', 'levies']
+        assert result['metrics']['near_duplicates']['collapsed'] == 1
+
+    def test_process_batch_keeps_question_order(self, engine, mock_aws):
+        def kendra_query(**kwargs):
+            if 'levy' in kwargs['QueryText']:
+                return {'ResultItems': []}
+            return {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['kendra'].query.side_effect = kendra_query
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+
+        result = engine.process_batch([
+            QueryContext(question=q, tenant_id='tenant-a')
+            for q in ['Can I keep a pet?', 'How is a levy raised?', 'Are dogs allowed?']
+        ])
+
+        assert [r['cited_sources'] if 'cited_sources' in r else None for r in result['results']] == [1, None, 1]
+        assert result['metrics']['questions'] == 3
+        assert result['metrics']['answered'] == 2
+        assert result['metrics']['input_tokens'] == 200
+        assert mock_aws['bedrock-runtime'].invoke_model.call_count == 2
+
+    def test_process_batch_larger_than_kendra_burst_waits_for_permits(self, engine, mock_aws):
+        engine.kendra_limiter = AdaptiveRateLimiter(max_rate=100, burst=10)
+        engine.generation_limiter = RateLimiter(1000)
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+
+        result = engine.process_batch([
+            QueryContext(question=f'Question {i} about pets?', tenant_id='tenant-a') for i in range(30)
+        ])
+
+        assert result['metrics']['failed'] == 0
+        assert result['metrics']['answered'] == 30
+        assert mock_aws['kendra'].query.call_count == 30
+
+    def test_kendra_permit_wait_is_bounded(self, engine, mock_aws):
+        engine.kendra_limiter = AdaptiveRateLimiter(max_rate=1, burst=1)
+        engine.kendra_limiter.try_acquire()
+
+        with pytest.raises(BackendUnavailableError, match='client rate limit'):
+            engine.search_documents_kendra(QueryContext(question='quorum', tenant_id='tenant-a', permit_wait=0.05))
+
+        mock_aws['kendra'].query.assert_not_called()
+
+    def test_kendra_throttle_fails_fast_without_sleeping(self, engine, mock_aws):
+        mock_aws['kendra'].query.side_effect = throttling_error()
+
+        with patch('time.sleep') as sleep:
+            with pytest.raises(BackendUnavailableError) as error:
+                engine.search_documents_kendra(QueryContext(question='quorum', tenant_id='tenant-a'))
+
+        sleep.assert_not_called()
+        assert error.value.retry_after >= 1
+        assert mock_aws['kendra'].query.call_count == 1
+
+    def test_kendra_circuit_open_serves_stale_retrieval(self, mock_aws):
+        with patch.dict(os.environ, {'RETRIEVAL_CACHE_ENABLED': 'true', 'RETRIEVAL_CACHE_TTL_SECONDS': '0',
+                                     'KENDRA_BREAKER_THRESHOLD': '1'}):
+            engine = StrataRAGEngine()
+        context = QueryContext(question='quorum', tenant_id='tenant-a')
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        engine.search_documents_kendra(context)
+
+        mock_aws['kendra'].query.side_effect = throttling_error()
+        assert engine.search_documents_kendra(context)[0].document_id == 'doc-1'
+        assert engine.kendra_breaker.state == 'open'
+
+        # Open circuit: Kendra is not called at all
+        assert engine.search_documents_kendra(context)[0].document_id == 'doc-1'
+        assert mock_aws['kendra'].query.call_count == 2
+
+    @pytest.mark.parametrize('tenant_id, local_results', [
+        ('test-tenant', True),
+        ('tenant-a', False),
+        ('tenant-b', False),
+        ('invalid-tenant', False),
+        ('ALL', False),
+    ])
+    def test_local_index_tenant_isolation(self, mock_aws, tenant_id, local_results):
+        # Mirrors scripts/test_multi_tenancy.py: only test-tenant has documents
+        mock_aws['s3'] = FakeArtifactBucket([
+            chunk_artifact('test-tenant', 'agm-guide', ['The quorum for an AGM is one quarter of lot owners']),
+            chunk_artifact('test-tenant-2', 'other', ['AGM quorum is half of the lots']),
+        ])
+        mock_aws['dynamodb'] = FakeDocumentTable({'test-tenant': 1, 'test-tenant-2': 1})
+        with patch.dict(os.environ, {'LOCAL_INDEX_ENABLED': 'true', 'DOCUMENT_TABLE': 'strata-documents'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': []}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='What is the quorum for an AGM?', tenant_id=tenant_id,
+                                                   max_results=5))
+
+        if local_results:
+            assert [c['document_id'] for c in result['citations']] == ['agm-guide']
+            mock_aws['kendra'].query.assert_not_called()
+        else:
+            assert result['citations'] == []
+            # Tenants without a local index go to Kendra with its tenant filter (or none for ALL)
+            query_params = mock_aws['kendra'].query.call_args[1]
+            assert ('AttributeFilter' in query_params) == (tenant_id != 'ALL')
+
+    @pytest.mark.parametrize('environment, indexed', [
+        # Documents indexed before artifacts were written exist only in Kendra
+        ({'DOCUMENT_TABLE': 'strata-documents'}, 3),
+        # Without the tracking table the artifacts cannot be shown to be complete
+        ({}, 1),
+    ])
+    def test_local_index_defers_to_kendra_unless_artifacts_cover_indexed_documents(self, mock_aws, environment,
+                                                                                   indexed):
+        mock_aws['s3'] = FakeArtifactBucket([chunk_artifact('tenant-a', 'levies', ['Levies are due quarterly'])])
+        documents = mock_aws['dynamodb'] = FakeDocumentTable({'tenant-a': indexed})
+        with patch.dict(os.environ, {'LOCAL_INDEX_ENABLED': 'true', **environment}):
+            engine = StrataRAGEngine()
+        context = QueryContext(question='when are levies due', tenant_id='tenant-a')
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+
+        assert [r.document_id for r in engine.search_documents(context)] == ['doc-1']
+        assert [r.document_id for r in engine.search_documents(context)] == ['doc-1']
+        # The count is cached for the tenant's generation
+        assert documents.queries == (1 if environment else 0)
+
+    def test_local_index_serves_larger_tenant_while_kendra_throttles(self, mock_aws):
+        bucket = mock_aws['s3'] = FakeArtifactBucket([chunk_artifact('tenant-a', 'levies', ['Levies are due quarterly'])])
+        with patch.dict(os.environ, {'LOCAL_INDEX_ENABLED': 'true', 'LOCAL_INDEX_MAX_DOCUMENTS': '0'}):
+            engine = StrataRAGEngine()
+        context = QueryContext(question='when are levies due', tenant_id='tenant-a')
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+
+        # While Kendra is healthy the tenant is too large to load on the request thread
+        engine.search_documents(context)
+        assert bucket.gets == 0
+
+        # The first throttled request starts the load in the background and fails fast
+        mock_aws['kendra'].query.side_effect = throttling_error()
+        with pytest.raises(BackendUnavailableError):
+            engine.search_documents(context)
+        engine.local_index.load_in_background('tenant-a', 0).result()
+
+        results = engine.search_documents(context)
+
+        assert [r.document_id for r in results] == ['levies']
+        assert results[0].s3_uri == 's3://test-bucket/tenant-a/levies.pdf'
+
+    def test_kendra_hedge_records_rate_and_wins(self, mock_aws):
+        with patch.dict(os.environ, {'KENDRA_HEDGE_ENABLED': 'true', 'KENDRA_HEDGE_MAX_FRACTION': '1',
+                                     'KENDRA_HEDGE_MIN_DELAY_MS': '10'}):
+            engine = StrataRAGEngine()
+        engine.kendra_hedger.tracker = warm_tracker()
+        mock_aws['kendra'].query.side_effect = slow_then_fast({'ResultItems': [kendra_result('doc-1')]})
+
+        with patch('handler.record_metric') as record:
+            results = engine.search_documents_kendra(QueryContext(question='quorum', tenant_id='tenant-a'))
+
+        assert [r.document_id for r in results] == ['doc-1']
+        assert mock_aws['kendra'].query.call_count == 2
+        metrics = {c.args[0]: c.args[1] for c in record.call_args_list}
+        assert metrics == {'KendraHedged': 1, 'KendraHedgeWins': 1, 'KendraHedgeDenied': 0}
+
+    def test_process_query_reports_retry_after(self, engine, mock_aws):
+        mock_aws['kendra'].query.side_effect = throttling_error()
+
+        result = engine.process_query(QueryContext(question='quorum', tenant_id='tenant-a'))
+
+        assert result['retry_after_seconds'] >= 1
+        mock_aws['bedrock-runtime'].invoke_model.assert_not_called()
+
+    def test_process_query_debug_stage_breakdown(self, engine, mock_aws, capsys):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='Can I keep a pet?', tenant_id='tenant-a', debug=True))
+
+        stages = result['metrics']['latency']['stages_ms']
+        assert set(stages) == {'answer_cache', 'search', 'extract_citations', 'build_prompt', 'generate', 'format'}
+        assert result['metrics']['latency']['output_tokens_per_second'] > 0
+
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+        assert {r['stage'] for r in records} == set(stages)
+        assert all(r['backend'] == 'kendra' for r in records)
+        generate = next(r for r in records if r['stage'] == 'generate')
+        assert generate['InputTokensPerSecond'] > 0
+
+    def test_stage_breakdown_only_in_debug(self, engine, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='Can I keep a pet?', tenant_id='tenant-a'))
+
+        assert 'latency' not in result['metrics']
+
+    def test_process_query_routes_model(self, mock_aws):
+        with patch.dict(os.environ, {'MODEL_ROUTING_ENABLED': 'true'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='Are pets allowed?', tenant_id='tenant-a', answer_style='simple'))
+
+        call = mock_aws['bedrock-runtime'].invoke_model.call_args[1]
+        assert json.loads(call['body'])['max_tokens'] == 400
+        assert result['metrics']['routing']['tier'] == 'fast'
+        assert result['metrics']['model'] == call['modelId']
+
+    def test_route_counts_distinct_source_objects(self, mock_aws):
+        with patch.dict(os.environ, {'MODEL_ROUTING_ENABLED': 'true'}):
+            engine = StrataRAGEngine()
+        engine.model_router = MagicMock()
+        citations = [
+            Citation(document_id='doc-default', document_title='Bylaws', excerpt='pets', page_number=None,
+                     confidence_score=0.8, s3_uri=f's3://docs/tenant-a/{name}.pdf')
+            for name in ('bylaws', 'minutes', 'bylaws')
+        ]
+
+        engine.route_query(QueryContext(question='Are pets allowed?', tenant_id='tenant-a'), citations)
+
+        engine.model_router.route.assert_called_once_with('Are pets allowed?', 'professional', 2)
+
+    @pytest.mark.parametrize('backend_env', [{}, {'ANSWER_CACHE_ENABLED': 'true'}])
+    def test_concurrent_pipeline_matches_sequential(self, mock_aws, backend_env):
+        responses = []
+        for concurrent in ('false', 'true'):
+            with patch.dict(os.environ, {'CONCURRENT_PIPELINE_ENABLED': concurrent, **backend_env}):
+                engine = StrataRAGEngine()
+            mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1'), kendra_result('doc-2')]}
+            mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: (
+                embedding_body([1.0, 0.0]) if 'titan' in kwargs['modelId'] else bedrock_body())
+            responses.append(engine.process_query(QueryContext(question='Can I keep a pet?', tenant_id='tenant-a')))
+
+        for response in responses:
+            response.pop('processing_time_ms')
+            response.pop('timestamp')
+        assert responses[0] == responses[1]
+
+    def test_concurrent_pipeline_search_deadline(self, mock_aws):
+        with patch.dict(os.environ, {'CONCURRENT_PIPELINE_ENABLED': 'true', 'PIPELINE_SEARCH_DEADLINE_MS': '50'}):
+            engine = StrataRAGEngine()
+        import time as _time
+        mock_aws['kendra'].query.side_effect = lambda **kwargs: _time.sleep(0.3) or {'ResultItems': []}
+
+        result = engine.process_query(QueryContext(question='quorum', tenant_id='tenant-a'))
+
+        assert result['retry_after_seconds'] == 1
+        mock_aws['bedrock-runtime'].invoke_model.assert_not_called()
+
+    def test_concurrent_pipeline_skips_answer_cache_on_slow_embedding(self, mock_aws):
+        with patch.dict(os.environ, {'CONCURRENT_PIPELINE_ENABLED': 'true', 'ANSWER_CACHE_ENABLED': 'true',
+                                     'PIPELINE_EMBEDDING_DEADLINE_MS': '20'}):
+            engine = StrataRAGEngine()
+        import time as _time
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: (
+            _time.sleep(0.2) or embedding_body([1.0, 0.0]) if 'titan' in kwargs['modelId'] else bedrock_body())
+
+        result = engine.process_query(QueryContext(question='Can I keep a pet?', tenant_id='tenant-a'))
+
+        assert result['cited_sources'] == 1
+        assert 'answer_cache' not in result['metrics']
+
+    def kendra_answer_result(self, answer_type='ANSWER', confidence='VERY_HIGH'):
+        result = kendra_result('doc-9', title='Pet by-law', confidence=confidence)
+        text = 'By-law 12: an owner may keep a cat or small dog with committee approval.'
+        result['Type'] = answer_type
+        result['AdditionalAttributes'] = [{
+            'Key': 'AnswerText',
+            'ValueType': 'TEXT_WITH_HIGHLIGHTS_VALUE',
+            'Value': {'TextWithHighlightsValue': {'Text': text, 'Highlights': [
+                {'BeginOffset': 30, 'EndOffset': 71, 'TopAnswer': True}
+            ]}}
+        }]
+        return result
+
+    def test_kendra_answer_shortcut_skips_bedrock(self, mock_aws):
+        with patch.dict(os.environ, {'KENDRA_ANSWER_SHORTCUT': 'true'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [self.kendra_answer_result(), kendra_result('doc-1')]}
+
+        result = engine.process_query(QueryContext(question='Can I keep a dog?', tenant_id='tenant-a'))
+
+        assert 'QueryResultTypeFilter' not in mock_aws['kendra'].query.call_args[1]
+        mock_aws['bedrock-runtime'].invoke_model.assert_not_called()
+        assert result['answer_source'] == 'kendra_answer'
+        assert result['answer'].startswith('cat or small dog with committee approval')
+        assert result['citations'][0]['document_id'] == 'doc-9'
+        assert result['metrics']['short_circuit'] is True
+
+    def test_kendra_answer_below_very_high_is_generated(self, mock_aws):
+        with patch.dict(os.environ, {'KENDRA_ANSWER_SHORTCUT': 'true'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [
+            self.kendra_answer_result('QUESTION_ANSWER', confidence='HIGH'), kendra_result('doc-1')
+        ]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        result = engine.process_query(QueryContext(question='Can I keep a dog?', tenant_id='tenant-a'))
+
+        assert result['answer_source'] == 'generated'
+        assert result['total_sources'] == 1  # the FAQ match is not used as prompt context
+
+    def test_kendra_answer_shortcut_off_by_default(self, engine, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        engine.process_query(QueryContext(question='Can I keep a dog?', tenant_id='tenant-a'))
+
+        assert mock_aws['kendra'].query.call_args[1]['QueryResultTypeFilter'] == 'DOCUMENT'
+
+    def test_faq_hit_skips_retrieval(self, mock_aws):
+        with patch.dict(os.environ, {'FAQ_TABLE': 'faq'}):
+            mock_aws['dynamodb'] = FakeFaqTable()
+            engine = StrataRAGEngine()
+        engine.faq_store.put('tenant-a', 'professional', 'Can I keep a pet?', 0, {'answer': 'Yes [Document 1]', 'citations': []})
+
+        result = engine.process_query(QueryContext(question='can i keep a pet', tenant_id='tenant-a'))
+
+        assert result['answer_source'] == 'faq'
+        assert result['answer'] == 'Yes [Document 1]'
+        mock_aws['kendra'].query.assert_not_called()
+
+    def test_precompute_faq_stores_answered_questions(self, mock_aws):
+        with patch.dict(os.environ, {'FAQ_TABLE': 'faq'}):
+            mock_aws['dynamodb'] = FakeFaqTable()
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.side_effect = lambda **kwargs: {
+            'ResultItems': [] if 'levy' in kwargs['QueryText'] else [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+
+        result = engine.precompute_faq('tenant-a', ['Can I keep a pet?', 'When is the levy due?'])
+
+        assert result['stored'] == 1
+        assert result['skipped'] == ['When is the levy due?']
+        assert mock_aws['dynamodb'].items
+
+    def test_precompute_faq_stores_each_answer_as_it_completes(self, mock_aws):
+        with patch.dict(os.environ, {'FAQ_TABLE': 'faq', 'BATCH_GENERATION_CONCURRENCY': '1'}):
+            mock_aws['dynamodb'] = FakeFaqTable()
+            engine = StrataRAGEngine()
+        import time as _time
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        stored_during_batch = []
+
+        def generate(**kwargs):
+            if stored_during_batch == [] and generate.calls:
+                # Second generation: the first answer should reach the table while this one runs
+                deadline = _time.monotonic() + 1
+                while not mock_aws['dynamodb'].items and _time.monotonic() < deadline:
+                    _time.sleep(0.01)
+                stored_during_batch.append(len(mock_aws['dynamodb'].items))
+            generate.calls += 1
+            return bedrock_body()
+        generate.calls = 0
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = generate
+
+        result = engine.precompute_faq('tenant-a', ['Can I keep a pet?', 'When is the levy due?'])
+
+        assert result['stored'] == 2
+        assert stored_during_batch == [1]
+
+    def test_faq_handler_caps_questions_per_call(self, mock_aws):
+        with patch.dict(os.environ, {'FAQ_TABLE': 'faq', 'FAQ_MAX_QUESTIONS': '2'}):
+            mock_aws['dynamodb'] = FakeFaqTable()
+            engine = StrataRAGEngine()
+
+        with patch.object(rag, '_engine', engine):
+            result = rag.handler({'action': 'precompute_faq', 'tenant_id': 'tenant-a',
+                                  'questions': ['Pets?', 'Quorum?', 'Levies?']}, None)
+
+        assert result['statusCode'] == 400
+        assert 'At most 2 questions' in json.loads(result['body'])['error']
+        mock_aws['kendra'].query.assert_not_called()
+
+    @pytest.mark.parametrize('concurrent', ['false', 'true'])
+    def test_process_query_answer_cache(self, mock_aws, concurrent):
+        with patch.dict(os.environ, {'ANSWER_CACHE_ENABLED': 'true', 'CONCURRENT_PIPELINE_ENABLED': concurrent}):
+            engine = StrataRAGEngine()
+        import time as _time
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        responses = iter([embedding_body([1.0, 0.0]), bedrock_body(), embedding_body([0.99, 0.01])])
+        # A slow embedding gives a search started alongside the lookup time to reach Kendra
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: (
+            _time.sleep(0.05) if 'titan' in kwargs['modelId'] else None) or next(responses)
+        context = QueryContext(question='What is the AGM quorum?', tenant_id='tenant-a')
+
+        first = engine.process_query(context)
+        second = engine.process_query(QueryContext(question='AGM quorum?', tenant_id='tenant-a'))
+
+        assert first['metrics']['answer_cache'] == {'hit': False}
+        assert second['metrics']['answer_cache']['hit'] is True
+        assert second['answer'] == first['answer']
+        # The hit never reaches the search backend
+        mock_aws['kendra'].query.assert_called_once()
+
+    def test_speculative_retrieval_overlaps_answer_cache_lookup(self, mock_aws):
+        with patch.dict(os.environ, {'ANSWER_CACHE_ENABLED': 'true', 'CONCURRENT_PIPELINE_ENABLED': 'true',
+                                     'SPECULATIVE_RETRIEVAL_ENABLED': 'true'}):
+            engine = StrataRAGEngine()
+        import threading
+        searched = threading.Event()
+        mock_aws['kendra'].query.side_effect = lambda **kwargs: searched.set() or {'ResultItems': [kendra_result('doc-1')]}
+        responses = iter([embedding_body([1.0, 0.0]), bedrock_body(), embedding_body([0.99, 0.01])])
+        overlapped = []
+
+        def invoke_model(**kwargs):
+            if 'titan' in kwargs['modelId']:
+                # Kendra is queried while the question is still being embedded
+                overlapped.append(searched.wait(1))
+                searched.clear()
+            return next(responses)
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = invoke_model
+
+        first = engine.process_query(QueryContext(question='What is the AGM quorum?', tenant_id='tenant-a', debug=True))
+        second = engine.process_query(QueryContext(question='AGM quorum?', tenant_id='tenant-a', debug=True))
+
+        assert overlapped == [True, True]
+        assert first['cited_sources'] == 1
+        assert 'search' in first['metrics']['latency']['stages_ms']
+        # The hit discards its search, which stays out of the hit's timings
+        assert second['metrics']['answer_cache']['hit'] is True
+        assert second['answer'] == first['answer']
+        assert 'search' not in second['metrics']['latency']['stages_ms']
+        assert mock_aws['kendra'].query.call_count == 2
+
+
+    def test_search_documents_kendra_uses_retrieval_cache(self, mock_aws):
+        with patch.dict(os.environ, {'RETRIEVAL_CACHE_ENABLED': 'true'}):
+            engine = StrataRAGEngine()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+
+        first = engine.search_documents_kendra(QueryContext(question='AGM quorum?', tenant_id='tenant-a'))
+        second = engine.search_documents_kendra(QueryContext(question='agm quorum', tenant_id='tenant-a'))
+
+        assert first == second
+        mock_aws['kendra'].query.assert_called_once()
+
+
+    def test_opensearch_knn_query(self, engine, mock_aws):
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.return_value = opensearch_hits(('doc-1', 'Quorum is 25% of lots', 1 / (2 - 0.8)))
+        mock_aws['bedrock-runtime'].invoke_model.return_value = embedding_body([0.1] * 768)
+
+        results = engine.search_documents_opensearch(QueryContext(question='AGM quorum?', tenant_id='tenant-a', max_results=5))
+
+        embed_call = mock_aws['bedrock-runtime'].invoke_model.call_args[1]
+        assert embed_call['modelId'] == 'amazon.titan-embed-text-v2:0'
+        assert json.loads(embed_call['body'])['dimensions'] == 768
+
+        search = engine.opensearch_client.search.call_args[1]
+        assert search['index'] == 'strata-tenant-a'
+        query = search['body']['query']['bool']
+        assert query['must'][0]['knn']['embedding']['k'] == 5
+        assert query['filter'] == [{'term': {'tenant_id': 'tenant-a'}}]
+
+        assert results[0].document_id == 'doc-1'
+        assert results[0].excerpt == 'Quorum is 25% of lots'
+        assert results[0].confidence == 'VERY_HIGH'
+        assert results[0].similarity > 0.75
+        assert engine.extract_citations(results)[0].excerpt == 'Quorum is 25% of lots'
+
+    def test_vector_snapshot_export_replaces_opensearch_knn(self, mock_aws, tmp_path):
+        mock_aws['s3'] = FakeSnapshotBucket()
+        with patch.dict(os.environ, {'VECTOR_SNAPSHOT_ENABLED': 'true', 'VECTOR_SNAPSHOT_DIR': str(tmp_path)}):
+            engine = StrataRAGEngine()
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.return_value = {'_scroll_id': 'scroll-1', 'hits': {'hits': [
+            {'_source': {'document_id': 'doc-1', 'chunk_id': 'doc-1_chunk_0', 'text': 'Quorum is 25% of lots',
+                         's3_key': 'tenant-a/doc-1.pdf', 'metadata': {'page_number': 4}, 'embedding': [0.0, 1.0]}},
+            {'_source': {'document_id': 'doc-2', 'chunk_id': 'doc-2_chunk_0', 'text': 'Levies are due quarterly',
+                         'embedding': [1.0, 0.0]}}
+        ]}}
+        engine.opensearch_client.scroll.return_value = {'_scroll_id': 'scroll-1', 'hits': {'hits': []}}
+
+        summary = engine.export_vector_snapshot('tenant-a')
+
+        assert summary['rows'] == 2 and summary['matrix_bytes'] == 2 * 2 * 2
+        engine.opensearch_client.scroll.assert_called_once_with(scroll_id='scroll-1', scroll='2m')
+        assert engine.opensearch_client.search.call_args[1]['body']['query']['bool']['filter'] == [
+            {'term': {'tenant_id': 'tenant-a'}}
+        ]
+
+        engine.opensearch_client.search.reset_mock()
+        mock_aws['bedrock-runtime'].invoke_model.return_value = embedding_body([0.1, 0.9])
+        results = engine.search_documents_opensearch(QueryContext(question='AGM quorum?', tenant_id='tenant-a', max_results=1))
+
+        engine.opensearch_client.search.assert_not_called()
+        assert [r.document_id for r in results] == ['doc-1']
+        assert results[0].page_number == 4
+        assert results[0].s3_uri == 's3://test-bucket/tenant-a/doc-1.pdf'
+        assert results[0].similarity == pytest.approx(0.9939, abs=1e-3)
+
+    def test_vector_snapshot_benchmark_reports_recall(self, mock_aws, tmp_path):
+        mock_aws['s3'] = FakeSnapshotBucket()
+        write_snapshot(mock_aws['s3'], 'test-bucket', 'vector-snapshots', 'tenant-a', 0,
+                       snapshot_chunks([[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]))
+        with patch.dict(os.environ, {'VECTOR_SNAPSHOT_ENABLED': 'true', 'VECTOR_SNAPSHOT_DIR': str(tmp_path)}):
+            engine = StrataRAGEngine()
+        mock_aws['bedrock-runtime'].invoke_model.return_value = embedding_body([0.1, 0.9])
+        chunk_hits = lambda *ids: {'hits': {'hits': [{'_score': 1.0, '_source': {'chunk_id': i}} for i in ids]}}
+        engine.opensearch_client = MagicMock()
+        # Exact scoring finds doc-1 and doc-2; the HNSW graph misses doc-2
+        engine.opensearch_client.search.side_effect = lambda index, body: (
+            chunk_hits('doc-1_chunk_0', 'doc-2_chunk_0') if 'script_score' in body['query']
+            else chunk_hits('doc-1_chunk_0', 'doc-0_chunk_0')
+        )
+
+        result = engine.benchmark_vector_snapshot('tenant-a', ['AGM quorum?'], k=2)
+
+        assert result['recall_at_2'] == {'opensearch_hnsw': 0.5, 'snapshot': 1.0}
+        assert set(result['latency_ms']) == {'opensearch_hnsw', 'snapshot'}
+        assert result['snapshot']['chunks'] == 3
+
+    def test_embed_question_uses_embedding_cache(self, engine, mock_aws):
+        mock_aws['bedrock-runtime'].invoke_model.return_value = embedding_body([0.5] * 4)
+
+        assert engine.embed_question('What is the AGM quorum?') == [0.5] * 4
+        assert engine.embed_question('what is the agm quorum') == [0.5] * 4
+        mock_aws['bedrock-runtime'].invoke_model.assert_called_once()
+
+    def test_opensearch_falls_back_to_lexical_query(self, engine, mock_aws):
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.return_value = opensearch_hits()
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = Exception("Bedrock error")
+
+        engine.search_documents_opensearch(QueryContext(question='AGM quorum?', tenant_id='tenant-a'))
+
+        query = engine.opensearch_client.search.call_args[1]['body']['query']['bool']
+        assert 'multi_match' in query['must'][0]
+        assert query['filter'] == [{'term': {'tenant_id': 'tenant-a'}}]
+
+    def test_hybrid_search_fuses_backends(self, engine, mock_aws):
+        engine.search_backend = 'hybrid'
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.return_value = opensearch_hits(('doc-2', 'Levies are due quarterly', 12.0))
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+
+        results = engine.search_documents(QueryContext(question='When are levies due?', tenant_id='tenant-a'))
+
+        assert {r.document_id for r in results} == {'doc-1', 'doc-2'}
+        assert engine.opensearch_client.search.call_args[1]['index'] == 'strata-tenant-a'
+
+    def test_hybrid_search_fuses_same_document_across_backends(self, engine, mock_aws):
+        engine.search_backend = 'hybrid'
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.return_value = {'hits': {'hits': [
+            {'_score': 12.0, '_source': {'document_id': 'doc-default', 'text': BYLAW_EXCERPT,
+                                         's3_key': 'tenant-a/documents/bylaws.pdf'}},
+            {'_score': 9.0, '_source': {'document_id': 'doc-levies', 'text': 'Levies are due quarterly',
+                                        's3_key': 'tenant-a/documents/levies.pdf'}}
+        ]}}
+        mock_aws['kendra'].query.return_value = {'ResultItems': [
+            kendra_result('s3://test-bucket/tenant-a/documents/bylaws.pdf', excerpt=BYLAW_EXCERPT[:200])
+        ]}
+
+        results = engine.search_documents(QueryContext(question='Can I keep a dog?', tenant_id='tenant-a'))
+
+        assert [r.source_key for r in results] == ['tenant-a/documents/bylaws.pdf', 'tenant-a/documents/levies.pdf']
+
+    def test_hybrid_search_tolerates_slow_backend(self, engine, mock_aws):
+        import time as _time
+        engine.search_backend = 'hybrid'
+        engine.opensearch_timeout = 0.05
+        engine.opensearch_client = MagicMock()
+        engine.opensearch_client.search.side_effect = lambda **kwargs: _time.sleep(0.5) or opensearch_hits()
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+
+        start = _time.perf_counter()
+        results = engine.search_documents(QueryContext(question='When are levies due?', tenant_id='tenant-a'))
+
+        assert [r.document_id for r in results] == ['doc-1']
+        assert _time.perf_counter() - start < 0.4
+
+
+class TestHandler:
+
+    @pytest.fixture(autouse=True)
+    def fresh_container(self):
+        with patch.object(rag, '_engine', None), patch.object(rag, '_cold_start', True):
+            yield
+
+    def test_handler_missing_question(self):
+        result = rag.handler({'tenant_id': 'tenant-a'}, None)
+
+        assert result['statusCode'] == 400
+
+    def test_handler_reuses_engine_across_invocations(self, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+        event = {'question': 'Can I keep a pet?', 'tenant_id': 'tenant-a'}
+
+        with patch('handler.StrataRAGEngine', wraps=StrataRAGEngine) as engine_class:
+            cold = json.loads(rag.handler(event, None)['body'])
+            mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+            warm = json.loads(rag.handler(event, None)['body'])
+
+        assert engine_class.call_count == 1
+        assert cold['metrics']['cold_start'] is True
+        assert warm['metrics']['cold_start'] is False
+        assert warm['metrics']['engine_init_ms'] == 0
+
+    def test_handler_batch(self, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+
+        response = rag.handler({'questions': ['Can I keep a pet?', 'Quorum?'], 'tenant_id': 'tenant-a'}, None)
+
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 200
+        assert len(body['results']) == 2
+        assert body['tenant_id'] == 'tenant-a'
+        assert body['metrics']['cold_start'] is True
+
+    def test_handler_batch_validation(self, mock_aws):
+        assert rag.handler({'questions': []}, None)['statusCode'] == 400
+        assert rag.handler({'questions': ['ok', '']}, None)['statusCode'] == 400
+        assert rag.handler({'questions': ['q'] * 51}, None)['statusCode'] == 400
+
+    def test_handler_returns_503_when_kendra_unavailable(self, mock_aws):
+        mock_aws['kendra'].query.side_effect = throttling_error()
+
+        response = rag.handler({'question': 'quorum', 'tenant_id': 'tenant-a'}, None)
+
+        assert response['statusCode'] == 503
+        assert int(response['headers']['Retry-After']) >= 1
+
+    def test_handler_projects_and_compresses_response(self, mock_aws):
+        import base64, gzip
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1', excerpt='Pets require approval ' * 100)]}
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+
+        full = rag.handler({'body': json.dumps({'question': 'Can I keep a pet?', 'tenant_id': 'tenant-a'}),
+                            'headers': {'Accept-Encoding': 'gzip'}}, None)
+        mock_aws['bedrock-runtime'].invoke_model.return_value = bedrock_body()
+        projected = rag.handler({'question': 'Can I keep a pet?', 'tenant_id': 'tenant-a',
+                                 'fields': 'answer,citations.document_id'}, None)
+
+        assert full['headers']['Content-Encoding'] == 'gzip'
+        assert full['isBase64Encoded'] is True
+        assert 'metrics' in json.loads(gzip.decompress(base64.b64decode(full['body'])))
+        assert json.loads(projected['body']) == {
+            'answer': 'Pets need approval [Document 1]', 'citations': [{'document_id': 'doc-1'}]}
+        assert 'Content-Encoding' not in projected['headers']
+
+    def test_handler_rejects_over_limit_tenant(self, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+        engine = StrataRAGEngine()
+        engine.admission = TenantAdmission(LocalBucketStore(), 'rag-query', TenantLimit(rate=0.5, burst=2))
+
+        with patch.object(rag, '_engine', engine):
+            batch = rag.handler({'questions': ['Pets?', 'Quorum?'], 'tenant_id': 'tenant-a'}, None)
+            rejected = rag.handler({'question': 'Levies?', 'tenant_id': 'tenant-a'}, None)
+            other = rag.handler({'question': 'Levies?', 'tenant_id': 'tenant-b'}, None)
+
+        assert batch['statusCode'] == 200
+        assert rejected['statusCode'] == 429
+        assert rejected['headers']['Retry-After'] == '2'
+        assert other['statusCode'] == 200
+
+    def test_handler_does_not_charge_requests_admitted_upstream(self, mock_aws):
+        mock_aws['kendra'].query.return_value = {'ResultItems': [kendra_result('doc-1')]}
+        mock_aws['bedrock-runtime'].invoke_model.side_effect = lambda **kwargs: bedrock_body()
+        engine = StrataRAGEngine()
+        engine.admission = TenantAdmission(LocalBucketStore(), 'rag-query', TenantLimit(rate=0.5, burst=1))
+
+        with patch.object(rag, '_engine', engine):
+            results = [rag.handler({'question': 'Levies?', 'tenant_id': 'tenant-a', 'admitted_by': 'chat'}, None)
+                       for _ in range(3)]
+
+        assert [r['statusCode'] for r in results] == [200, 200, 200]
+        assert engine.admission.admit('tenant-a').allowed
+
+    def test_handler_validates_before_admission(self, mock_aws):
+        engine = StrataRAGEngine()
+        engine.admission = TenantAdmission(LocalBucketStore(), 'rag-query', TenantLimit(rate=0.5, burst=2))
+
+        with patch.object(rag, '_engine', engine):
+            invalid = rag.handler({'questions': ['Pets?', ''], 'tenant_id': 'tenant-a'}, None)
+            missing = rag.handler({'tenant_id': 'tenant-a'}, None)
+            oversized = rag.handler({'questions': ['Pets?', 'Quorum?', 'Levies?'], 'tenant_id': 'tenant-a'}, None)
+
+        assert [r['statusCode'] for r in (invalid, missing, oversized)] == [400, 400, 400]
+        assert 'At most 2 questions' in json.loads(oversized['body'])['error']
+        # None of the rejected requests was charged to the tenant's bucket
+        assert engine.admission.admit('tenant-a', 2).allowed
+
+    def test_handler_rejects_stream_requests(self, mock_aws):
+        result = rag.handler({'question': 'Can I keep a pet?', 'tenant_id': 'tenant-a', 'stream': True}, None)
+
+        assert result['statusCode'] == 400
+        assert 'not supported' in json.loads(result['body'])['error']
+        mock_aws['kendra'].query.assert_not_called()
+        mock_aws['bedrock-runtime'].invoke_model.assert_not_called()